@@ -157,11 +157,17 @@ class CUDARunContext(SerialRunContext):
 
 FEAT_MPI = "mpi"
 FEAT_CUDA = "cuda"
+FEAT_SHM = "shm"
 
 
 
 
 def generate_features(allowed_features):
+    if FEAT_SHM in allowed_features:
+        from hedge.backends.shm import get_worker_run_context
+        if get_worker_run_context() is not None:
+            yield FEAT_SHM
+
     if FEAT_MPI in allowed_features:
         try:
             import pytools.mpiwrap as mpi
@@ -212,6 +218,10 @@ def guess_run_context(allow=None):
 
     feat = list(generate_features(allow))
 
+    if FEAT_SHM in feat:
+        from hedge.backends.shm import get_worker_run_context
+        return get_worker_run_context()
+
     if FEAT_CUDA in feat:
         serial_context = CUDARunContext()
     else:
@@ -229,4 +239,11 @@ def guess_run_context(allow=None):
 
 
 
+# after the base classes, which hedge.backends.mpi needs
+from hedge.backends.shm import (  # noqa
+        SharedMemoryRunContext, run_with_shared_memory_ranks)
+
+
+
+
 # vim: foldmethod=marker
@@ -37,6 +37,18 @@ class ExecutionMapperBase(hedge.optemplate.Evaluator,
         self.discr = executor.discr
         self.executor = executor
 
+    def wait_for_future(self, future):
+        """Evaluate *future*, which is not ready yet, blocking until it is.
+        Called by :class:`hedge.compiler.Code` whenever no instruction can
+        make progress without the result of a future.
+        """
+        return future()
+
+    def exec_reduction_batch_assign(self, insn):
+        return [(name, getattr(self, op.mapper_method)(op, field))
+                for name, op, field in zip(
+                    insn.names, insn.operators, insn.fields)], []
+
     def map_ones(self, expr):
         # FIXME
         if expr.quadrature_tag is not None:
@@ -28,15 +28,280 @@ THE SOFTWARE.
 import hedge.discretization
 import hedge.optemplate
 from hedge.backends.exec_common import ExecutionMapperBase
+from pytools import Record, memoize_method
 import numpy as np
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+# {{{ ensemble support
+
+# An ensemble is a set of independent states advanced by the same operator.
+# Its fields carry a trailing ensemble axis, i.e. have shape
+# *(node_count, member_count)* and are stored with members innermost.
+# Fields shared by all members (geometry, coefficients, boundary data)
+# have no ensemble axis or one of length one. They are never expanded:
+# generated kernels index them with a member stride of zero, and
+# interpreted arithmetic broadcasts them.
+
+def get_ensemble_size(context):
+    """Return the length of the trailing ensemble axis of the fields in
+    *context*, or *None* if there is none.
+    """
+    ensemble_size = None
+
+    for value in context.itervalues():
+        if not isinstance(value, np.ndarray):
+            continue
+
+        if value.dtype == object:
+            sizes = [get_ensemble_size({"": v}) for v in value.flat]
+        elif value.ndim == 2:
+            if not value.flags.c_contiguous:
+                raise ValueError("ensemble fields must be C-contiguous")
+            sizes = [value.shape[1]]
+        else:
+            continue
+
+        for size in sizes:
+            if size is None:
+                continue
+            if ensemble_size is not None and size != ensemble_size:
+                raise ValueError("fields with different ensemble sizes "
+                        "(%d and %d) given" % (ensemble_size, size))
+            ensemble_size = size
+
+    return ensemble_size
+
+
+def _finish_ensemble_result(result):
+    from pytools.obj_array import with_object_array_or_scalar
+
+    def finish(field):
+        if (isinstance(field, np.ndarray)
+                and field.ndim == 2 and field.shape[0] == 1):
+            # a per-member reduction result
+            return field[0]
+        else:
+            # Results independent of the ensemble are returned without
+            # expanding them to all members.
+            return field
+
+    return with_object_array_or_scalar(finish, result)
+
+
+def _get_member_scalar_array(value, member_count, dtype):
+    """Return the scalar *value*, which is either shared by all ensemble
+    members or a per-member reduction result of shape *(1, member_count)*,
+    as an array with one entry per member.
+    """
+    if isinstance(value, np.ndarray) and value.ndim == 2:
+        return np.ascontiguousarray(value[0], dtype=dtype)
+
+    result = np.empty(member_count, dtype=dtype)
+    result.fill(value)
+    return result
+
+
+def perform_ensemble_elwise_operator(src_ranges, dest_ranges, matrix,
+        operand, result, scale_factors=None):
+    """Like :func:`hedge._internal.perform_elwise_operator` (or
+    :func:`hedge._internal.perform_elwise_scaled_operator` if
+    *scale_factors* is given), but for *operand* and *result* with a
+    trailing ensemble axis. Each element's matrix is applied to all members
+    at once, and for uniform element ranges all elements are handled in
+    one matrix-matrix product.
+    """
+    h, w = matrix.shape
+    member_count = operand.shape[1]
+
+    from hedge._internal import UniformElementRanges
+    if (isinstance(src_ranges, UniformElementRanges)
+            and isinstance(dest_ranges, UniformElementRanges)
+            and src_ranges.el_size == w and dest_ranges.el_size == h):
+        el_count = len(src_ranges)
+        src = operand[src_ranges.start:src_ranges.start+el_count*w] \
+                .reshape(el_count, w, member_count)
+        dest = result[dest_ranges.start:dest_ranges.start+el_count*h] \
+                .reshape(el_count, h, member_count)
+
+        # (el_count, member_count, h)
+        prod = np.tensordot(src, matrix, axes=([1], [1]))
+        if scale_factors is not None:
+            prod *= np.asarray(scale_factors)[:, np.newaxis, np.newaxis]
+
+        dest += prod.transpose(0, 2, 1)
+    else:
+        for i, (src_rng, dest_rng) in enumerate(zip(src_ranges, dest_ranges)):
+            prod = np.dot(matrix, operand[src_rng.start:src_rng.start+w])
+            if scale_factors is not None:
+                prod *= scale_factors[i]
+            result[dest_rng.start:dest_rng.start+h] += prod
+
+# }}}
+
+
+# {{{ field block support
+
+def _make_result_block(result_exprs, node_count, dtype):
+    """If *result_exprs*, the result of an operator's code, is
+    vector-valued, return a tuple *(block, rows, targets)*. *block* is a
+    new :class:`hedge.tools.field_block.FieldBlock` to receive the result,
+    *targets* maps the names of result variables to views of the rows of
+    *block* that they may be computed into, and *rows* holds each
+    component's view from *targets*, or *None*. Otherwise, return *None*.
+    """
+    from hedge.tools import is_obj_array
+    if not is_obj_array(result_exprs) or result_exprs.ndim != 1:
+        return None
+
+    from hedge.tools.field_block import FieldBlock
+    block = np.empty((len(result_exprs), node_count), dtype).view(FieldBlock)
+
+    from pymbolic.primitives import Variable
+    rows = []
+    targets = {}
+    for i, expr in enumerate(result_exprs):
+        if isinstance(expr, Variable) and expr.name not in targets:
+            row = targets[expr.name] = block[i]
+        else:
+            row = None
+        rows.append(row)
+
+    return block, rows, targets
+
+
+def _finish_field_block_result(result, block, rows):
+    """Copy those components of a vector-valued *result* into *block* that
+    were not computed into their view in *rows*, broadcasting scalar
+    components. Results that do not fit into *block* are returned
+    unchanged.
+    """
+    from hedge.tools import is_obj_array
+    if (not is_obj_array(result) or result.shape != block.shape[:1]
+            or any(isinstance(fld, np.ndarray)
+                and fld.shape != block.shape[1:] for fld in result)):
+        return result
+
+    for i, (fld, row) in enumerate(zip(result, rows)):
+        if fld is not row:
+            block[i] = fld
+
+    return block
+
+# }}}
+
+
+# {{{ cache blocking
+
+class ElementBlock(Record):
+    """Describes a range of consecutive elements of one element group,
+    treated together by :class:`BlockExecutionMapper`.
+
+    :ivar element_group: the element group containing the block.
+    :ivar el_start: the number of the block's first element within
+      *element_group*.
+    :ivar el_count: the number of elements in the block.
+    :ivar start: the index of the block's first node in volume vectors.
+    :ivar stop: one past the index of the block's last node.
+    :ivar ranges: a :class:`hedge._internal.UniformElementRanges` instance
+      describing the block's elements in vectors that only hold the
+      block's nodes.
+    """
+
+    __slots__ = ["element_group", "el_start", "el_count",
+            "start", "stop", "ranges"]
+
+    @property
+    def node_count(self):
+        return self.stop - self.start
+
+
+def make_element_blocks(discr, max_node_count):
+    """Split the elements of *discr* into a list of :class:`ElementBlock`
+    instances with at most *max_node_count* nodes, but at least one
+    element, each.
+
+    Since volume vectors store the nodes of each element contiguously,
+    the blocks are ranges of elements in storage order. Only element-local
+    operations are performed blockwise, so there is no need to gather
+    neighboring elements into the same block.
+    """
+    from hedge._internal import UniformElementRanges
+
+    result = []
+    for eg in discr.element_groups:
+        assert isinstance(eg.ranges, UniformElementRanges)
+
+        el_size = eg.ranges.el_size
+        eg_el_count = len(eg.ranges)
+        block_el_count = max(1, max_node_count // el_size)
+
+        for el_start in xrange(0, eg_el_count, block_el_count):
+            el_count = min(block_el_count, eg_el_count - el_start)
+            start = eg.ranges.start + el_start*el_size
+            result.append(ElementBlock(
+                element_group=eg,
+                el_start=el_start,
+                el_count=el_count,
+                start=start,
+                stop=start + el_count*el_size,
+                ranges=UniformElementRanges(0, el_size, el_count)))
+
+    return result
+
+
+class BlockingNotApplicable(Exception):
+    """Raised by :class:`BlockExecutionMapper` upon encountering a value
+    that it cannot restrict to a block of elements.
+    """
+
+# }}}
+
+
 # {{{ exec mapper
 
 class ExecutionMapper(ExecutionMapperBase):
+    # Set by the executor if the fields being operated on carry a trailing
+    # ensemble axis of this length.
+    ensemble_size = None
+
+    # Set by the executor to a dictionary mapping names of result variables
+    # to preallocated volume vectors that they may be computed into.
+    result_targets = None
+
+    def _broadcastable(self, value):
+        """In ensemble mode, return a view of a volume or boundary vector
+        *value* that is shared by all members which broadcasts against
+        vectors with an ensemble axis.
+        """
+        if (self.ensemble_size is not None
+                and isinstance(value, np.ndarray)
+                and value.dtype != object
+                and value.ndim == 1):
+            return value[:, np.newaxis]
+        else:
+            return value
+
+    def _volume_zeros_like(self, field, dtype=None):
+        if field.ndim == 2:
+            if dtype is None:
+                dtype = self.discr.default_scalar_type
+            return np.zeros((len(self.discr.nodes), field.shape[1]), dtype)
+        else:
+            return self.discr.volume_zeros(dtype=dtype)
+
+    def _perform_elwise_operator(self, src_ranges, dest_ranges, matrix,
+            field, out):
+        if field.ndim == 2:
+            perform_ensemble_elwise_operator(src_ranges, dest_ranges,
+                    matrix, field, out)
+        else:
+            from hedge._internal import perform_elwise_operator
+            perform_elwise_operator(src_ranges, dest_ranges,
+                    matrix, field, out)
+
     # {{{ code execution functions --------------------------------------------
     def exec_assign(self, insn):
         return [(name, self.rec(expr))
@@ -56,7 +321,7 @@ class ExecutionMapper(ExecutionMapperBase):
         else:
             compiled = insn.compiled(self.executor)
             return zip(compiled.result_names(),
-                    compiled(self, stats_callback)), []
+                    compiled(self, stats_callback, self.result_targets)), []
 
     def exec_flux_batch_assign(self, insn):
         from pymbolic.primitives import is_zero
@@ -102,6 +367,8 @@ class ExecutionMapper(ExecutionMapperBase):
                 return arg
 
         args = [cast_arg(arg) for arg in args]
+        scalar_args = [self.rec(scalar_arg_expr)
+                for scalar_arg_expr in insn.flux_var_info.scalar_parameters]
 
         if insn.quadrature_tag is None:
             if insn.is_boundary:
@@ -117,29 +384,50 @@ class ExecutionMapper(ExecutionMapperBase):
                 face_groups = self.discr.get_quadrature_info(insn.quadrature_tag) \
                         .face_groups
 
+        ensemble = self.ensemble_size is not None
+        if ensemble:
+            # The generated kernels loop over all members at once. See
+            # hedge.backends.jit.flux for the storage conventions.
+            from pytools import to_uncomplex_dtype
+            accum_dtype = self.discr.get_accumulation_dtype(max_dtype)
+            scalar_args = [
+                    _get_member_scalar_array(scalar_arg, self.ensemble_size,
+                        accum_dtype if scalar_par.is_complex
+                        else to_uncomplex_dtype(accum_dtype))
+                    for scalar_par, scalar_arg in zip(
+                        insn.flux_var_info.scalar_parameters, scalar_args)]
+            member_strides = [
+                    int(arg.ndim == 2 and arg.shape[1] != 1) for arg in args]
+            args = [arg.reshape(-1) for arg in args]
+
         result = []
 
         for fg in face_groups:
             # grab module
-            module = insn.get_module(self.discr, max_dtype)
+            module = insn.get_module(self.discr, max_dtype, ensemble)
             func = module.gather_flux
 
             # set up argument structure
             arg_struct = module.ArgStruct()
             for arg_name, arg in zip(insn.flux_var_info.arg_names, args):
                 setattr(arg_struct, arg_name, arg)
-            for arg_num, scalar_arg_expr in enumerate(
-                    insn.flux_var_info.scalar_parameters):
-                setattr(arg_struct,
-                        "_scalar_arg_%d" % arg_num,
-                        self.rec(scalar_arg_expr))
+            for arg_num, scalar_arg in enumerate(scalar_args):
+                setattr(arg_struct, "_scalar_arg_%d" % arg_num, scalar_arg)
 
             fof_shape = (fg.face_count*fg.face_length()*fg.element_count(),)
+            if ensemble:
+                fof_shape += (self.ensemble_size,)
+                arg_struct.member_count = self.ensemble_size
+                for arg_name, member_stride in zip(
+                        insn.flux_var_info.arg_names, member_strides):
+                    setattr(arg_struct, "%s_member_stride" % arg_name,
+                            member_stride)
+
             all_fluxes_on_faces = [
                     np.zeros(fof_shape, dtype=max_dtype)
                     for f in insn.expressions]
             for i, fof in enumerate(all_fluxes_on_faces):
-                setattr(arg_struct, "flux%d_on_faces" % i, fof)
+                setattr(arg_struct, "flux%d_on_faces" % i, fof.reshape(-1))
 
             # make sure everything ended up in Boost.Python attributes
             # (i.e. empty __dict__)
@@ -164,8 +452,16 @@ class ExecutionMapper(ExecutionMapperBase):
                     mat = fg.ldis_loc_quad_info.multi_face_mass_matrix()
                     scaling = None
 
-                out = self.discr.volume_zeros(dtype=fluxes_on_faces.dtype)
-                self.executor.lift_flux(fg, mat, scaling, fluxes_on_faces, out)
+                if ensemble:
+                    out = np.zeros(
+                            (len(self.discr.nodes), self.ensemble_size),
+                            dtype=fluxes_on_faces.dtype)
+                    self.executor.lift_ensemble_flux(
+                            fg, mat, scaling, fluxes_on_faces, out)
+                else:
+                    out = self.discr.volume_zeros(dtype=fluxes_on_faces.dtype)
+                    self.executor.lift_flux(
+                            fg, mat, scaling, fluxes_on_faces, out)
 
                 if self.discr.instrumented:
                     from hedge.tools import lift_flops
@@ -183,64 +479,122 @@ class ExecutionMapper(ExecutionMapperBase):
         return result, []
 
     def exec_diff_batch_assign(self, insn):
-        rst_diff = self.executor.diff(insn.operators, self.rec(insn.field))
+        field = self.rec(insn.field)
+        if field.ndim == 2:
+            rst_diff = self.executor.diff_ensemble(insn.operators, field)
+        else:
+            rst_diff = self.executor.diff(insn.operators, field)
 
         return [(name, diff) for name, diff in zip(insn.names, rst_diff)], []
 
     exec_quad_diff_batch_assign = exec_diff_batch_assign
 
+    def exec_blocked_instruction_group(self, insn):
+        # Instrumentation counts operations per call and would get
+        # confused by blockwise execution.
+        unblockable_group_ids = self.executor.unblockable_group_ids
+        if (self.ensemble_size is None and not self.discr.instrumented
+                and id(insn) not in unblockable_group_ids):
+            block_mapper = BlockExecutionMapper(self.context, self.executor)
+            try:
+                return block_mapper.exec_group_blockwise(
+                        insn, self.result_targets), []
+            except BlockingNotApplicable:
+                # don't try again on later calls
+                unblockable_group_ids.add(id(insn))
+
+        group_values = {}
+        for member in insn.instructions:
+            assignments, new_futures = member.get_executor_method(self)(member)
+            assert not new_futures
+
+            for name, value in assignments:
+                self.context[name] = group_values[name] = value
+
+        for name in group_values:
+            del self.context[name]
+
+        return [(name, group_values[name])
+                for name in insn.exported_names], []
+
     # }}}
 
     # {{{ expression mappings -------------------------------------------------
 
+    def _reduce(self, func, field, **kwargs):
+        if isinstance(field, np.ndarray) and field.ndim == 2:
+            # one result per ensemble member
+            return func(field, axis=0, **kwargs)[np.newaxis, :]
+        else:
+            return func(field, **kwargs)
+
     def map_nodal_sum(self, op, field_expr):
-        return np.sum(self.rec(field_expr))
+        field = self.rec(field_expr)
+        if not isinstance(field, np.ndarray):
+            return self._reduce(np.sum, field)
+
+        return self._reduce(np.sum, field,
+                dtype=self.discr.get_accumulation_dtype(field.dtype))
 
     def map_nodal_max(self, op, field_expr):
-        return np.max(self.rec(field_expr))
+        return self._reduce(np.max, self.rec(field_expr))
 
     def map_nodal_min(self, op, field_expr):
-        return np.min(self.rec(field_expr))
+        return self._reduce(np.min, self.rec(field_expr))
 
-    def map_if_positive(self, expr):
-        crit = self.rec(expr.criterion)
-        bool_crit = crit > 0
-        then = self.rec(expr.then)
-        else_ = self.rec(expr.else_)
+    def _select(self, bool_crit, then_expr, else_expr, dtype):
+        """Return an array holding the value of *then_expr* where
+        *bool_crit* is true and that of *else_expr* elsewhere. A branch
+        that is not selected anywhere is not evaluated.
+        """
+        bool_crit = self._broadcastable(bool_crit)
+        branches = [
+                (then_expr, bool_crit),
+                (else_expr, ~bool_crit)]
+        branches = [(self._broadcastable(self.rec(branch_expr)), mask)
+                for branch_expr, mask in branches
+                if mask.any()]
+
+        shape = np.broadcast(bool_crit, *[
+            value for value, mask in branches
+            if isinstance(value, np.ndarray)]).shape
+        result = np.empty(shape, dtype=dtype)
+
+        for value, mask in branches:
+            indices = np.nonzero(np.broadcast_to(mask, shape))
+            if isinstance(value, np.ndarray):
+                value = np.broadcast_to(value, shape)[indices]
+            result[indices] = value
 
-        true_indices = np.nonzero(bool_crit)
-        false_indices = np.nonzero(~bool_crit)
+        return result
 
-        result = np.empty_like(crit)
+    def map_if_positive(self, expr):
+        crit = self.rec(expr.criterion)
+        return self._select(crit > 0, expr.then, expr.else_, crit.dtype)
 
-        if isinstance(then, np.ndarray):
-            then = then[true_indices]
-        if isinstance(else_, np.ndarray):
-            else_ = else_[false_indices]
+    def map_if(self, expr):
+        return self._select(self.rec(expr.condition), expr.then, expr.else_,
+                self.discr.default_scalar_type)
 
-        result[true_indices] = then
-        result[false_indices] = else_
-        return result
+    # {{{ ensemble broadcasting
 
-    def map_if(self, expr):
-        bool_crit = self.rec(expr.condition)
-        then = self.rec(expr.then)
-        else_ = self.rec(expr.else_)
+    def map_sum(self, expr):
+        return sum(self._broadcastable(self.rec(ch)) for ch in expr.children)
 
-        true_indices = np.nonzero(bool_crit)
-        false_indices = np.nonzero(~bool_crit)
+    def map_product(self, expr):
+        from pytools import product
+        return product(
+                self._broadcastable(self.rec(ch)) for ch in expr.children)
 
-        result = self.discr.volume_empty(
-                kind=self.discr.compute_kind)
+    def map_quotient(self, expr):
+        return (self._broadcastable(self.rec(expr.numerator))
+                / self._broadcastable(self.rec(expr.denominator)))
 
-        if isinstance(then, np.ndarray):
-            then = then[true_indices]
-        if isinstance(else_, np.ndarray):
-            else_ = else_[false_indices]
+    def map_power(self, expr):
+        return (self._broadcastable(self.rec(expr.base))
+                ** self._broadcastable(self.rec(expr.exponent)))
 
-        result[true_indices] = then
-        result[false_indices] = else_
-        return result
+    # }}}
 
     def map_ref_diff_base(self, op, field_expr):
         raise NotImplementedError(
@@ -253,7 +607,7 @@ class ExecutionMapper(ExecutionMapperBase):
         if is_zero(field):
             return 0
 
-        out = self.discr.volume_zeros()
+        out = self._volume_zeros_like(field)
         self.executor.do_elementwise_linear(op, field, out)
         return out
 
@@ -266,13 +620,11 @@ class ExecutionMapper(ExecutionMapperBase):
 
         qtag = op.quadrature_tag
 
-        from hedge._internal import perform_elwise_operator
-
-        out = self.discr.volume_zeros()
+        out = self._volume_zeros_like(field)
         for eg in self.discr.element_groups:
             eg_quad_info = eg.quadrature_info[qtag]
 
-            perform_elwise_operator(eg_quad_info.ranges, eg.ranges,
+            self._perform_elwise_operator(eg_quad_info.ranges, eg.ranges,
                     eg_quad_info.ldis_quad_info.mass_matrix(),
                     field, out)
 
@@ -287,14 +639,13 @@ class ExecutionMapper(ExecutionMapperBase):
 
         qtag = op.quadrature_tag
 
-        from hedge._internal import perform_elwise_operator
         quad_info = self.discr.get_quadrature_info(qtag)
 
-        out = np.zeros(quad_info.node_count, field.dtype)
+        out = np.zeros((quad_info.node_count,) + field.shape[1:], field.dtype)
         for eg in self.discr.element_groups:
             eg_quad_info = eg.quadrature_info[qtag]
 
-            perform_elwise_operator(eg.ranges, eg_quad_info.ranges,
+            self._perform_elwise_operator(eg.ranges, eg_quad_info.ranges,
                 eg_quad_info.ldis_quad_info.volume_up_interpolation_matrix(),
                 field, out)
 
@@ -309,14 +660,15 @@ class ExecutionMapper(ExecutionMapperBase):
 
         qtag = op.quadrature_tag
 
-        from hedge._internal import perform_elwise_operator
         quad_info = self.discr.get_quadrature_info(qtag)
 
-        out = np.zeros(quad_info.int_faces_node_count, field.dtype)
+        out = np.zeros((quad_info.int_faces_node_count,) + field.shape[1:],
+                field.dtype)
         for eg in self.discr.element_groups:
             eg_quad_info = eg.quadrature_info[qtag]
 
-            perform_elwise_operator(eg.ranges, eg_quad_info.el_faces_ranges,
+            self._perform_elwise_operator(
+                eg.ranges, eg_quad_info.el_faces_ranges,
                 eg_quad_info.ldis_quad_info.volume_to_face_up_interpolation_matrix(),
                 field, out)
 
@@ -332,24 +684,39 @@ class ExecutionMapper(ExecutionMapperBase):
         bdry = self.discr.get_boundary(op.boundary_tag)
         bdry_q_info = bdry.get_quadrature_info(op.quadrature_tag)
 
-        out = np.zeros(bdry_q_info.node_count, field.dtype)
+        out = np.zeros((bdry_q_info.node_count,) + field.shape[1:],
+                field.dtype)
 
-        from hedge._internal import perform_elwise_operator
         for fg, from_ranges, to_ranges, ldis_quad_info in zip(
                 bdry.face_groups,
                 bdry.fg_ranges,
                 bdry_q_info.fg_ranges,
                 bdry_q_info.fg_ldis_quad_infos):
-            perform_elwise_operator(from_ranges, to_ranges,
+            self._perform_elwise_operator(from_ranges, to_ranges,
                 ldis_quad_info.face_up_interpolation_matrix(),
                 field, out)
 
         return out
 
     def map_elementwise_max(self, op, field_expr):
-        from hedge._internal import perform_elwise_max
         field = self.rec(field_expr)
 
+        if field.ndim == 2:
+            out = self._volume_zeros_like(field, dtype=field.dtype)
+            for eg in self.discr.element_groups:
+                from hedge._internal import UniformElementRanges
+                assert isinstance(eg.ranges, UniformElementRanges)
+
+                el_size = eg.ranges.el_size
+                rng = slice(eg.ranges.start,
+                        eg.ranges.start + len(eg.ranges)*el_size)
+                el_field = field[rng].reshape(-1, el_size, field.shape[1])
+                out[rng].reshape(el_field.shape)[:] = \
+                        np.max(el_field, axis=1)[:, np.newaxis, :]
+            return out
+
+        from hedge._internal import perform_elwise_max
+
         out = self.discr.volume_zeros(dtype=field.dtype)
         for eg in self.discr.element_groups:
             perform_elwise_max(eg.ranges, field, out)
@@ -358,6 +725,146 @@ class ExecutionMapper(ExecutionMapperBase):
 
     # }}}
 
+
+class BlockExecutionMapper(ExecutionMapper):
+    """Executes the members of a
+    :class:`hedge.backends.jit.compiler.BlockedInstructionGroup` one
+    :class:`ElementBlock` at a time. Volume vectors are restricted to the
+    current block, and values computed within the group only ever exist
+    for the current block.
+    """
+
+    def __init__(self, context, executor):
+        ExecutionMapper.__init__(self, context, executor)
+        self.block = None
+        self.block_values = {}
+
+    def exec_group_blockwise(self, insn, result_targets=None):
+        """Return the exported assignments of *insn*, each assembled from
+        the values computed for all blocks.
+
+        :param result_targets: a dictionary mapping exported names to
+          volume vectors to assemble them in, as in
+          :attr:`ExecutionMapper.result_targets`.
+        """
+        discr = self.discr
+        max_node_count = max(discr.cache_block_min_nodes,
+                discr.cache_block_bytes // (
+                    max(1, insn.vector_count)
+                    * np.dtype(discr.default_scalar_type).itemsize))
+
+        blocks = self.executor.get_element_blocks(max_node_count)
+        if len(blocks) < 2:
+            # nothing to gain over whole-volume execution
+            raise BlockingNotApplicable
+
+        members = [(member, member.get_executor_method(self))
+                for member in insn.instructions]
+
+        exported = {}
+        for block in blocks:
+            self.block = block
+
+            for member, executor_method in members:
+                assignments, new_futures = executor_method(member)
+                assert not new_futures
+                self.block_values.update(assignments)
+
+            for name in insn.exported_names:
+                value = self.block_values[name]
+                if not isinstance(value, np.ndarray):
+                    # e.g. zero, the same for all blocks
+                    exported[name] = value
+                    continue
+
+                try:
+                    full_value = exported[name]
+                except KeyError:
+                    full_value = None
+                    if result_targets is not None:
+                        full_value = result_targets.get(name)
+                    if full_value is None or full_value.dtype != value.dtype:
+                        full_value = np.empty(
+                                len(discr.nodes), dtype=value.dtype)
+                    exported[name] = full_value
+
+                full_value[block.start:block.stop] = value
+
+        return [(name, exported[name]) for name in insn.exported_names]
+
+    def _restrict(self, value):
+        def restrict(field):
+            if not isinstance(field, np.ndarray) or field.ndim == 0:
+                return field
+            elif field.shape == (len(self.discr.nodes),):
+                return field[self.block.start:self.block.stop]
+            else:
+                raise BlockingNotApplicable
+
+        from hedge.tools import with_object_array_or_scalar
+        return with_object_array_or_scalar(restrict, value)
+
+    def _volume_zeros_like(self, field, dtype=None):
+        if dtype is None:
+            dtype = self.discr.default_scalar_type
+        return np.zeros(self.block.node_count, dtype)
+
+    # {{{ code execution functions --------------------------------------------
+    def exec_diff_batch_assign(self, insn):
+        field = self.rec(insn.field)
+        return zip(insn.names, self.executor.diff_block(
+            insn.operators, field, self.block)), []
+
+    # }}}
+
+    # {{{ expression mappings -------------------------------------------------
+    def map_variable(self, expr):
+        try:
+            return self.block_values[expr.name]
+        except KeyError:
+            return self._restrict(ExecutionMapper.map_variable(self, expr))
+
+    def map_ones(self, expr):
+        if expr.quadrature_tag is not None:
+            raise BlockingNotApplicable
+
+        return np.ones(self.block.node_count,
+                dtype=self.discr.default_scalar_type)
+
+    def map_node_coordinate_component(self, expr):
+        if expr.quadrature_tag is not None:
+            raise BlockingNotApplicable
+
+        return self.discr.nodes[self.block.start:self.block.stop,
+                expr.axis].copy()
+
+    def map_jacobian(self, expr):
+        return self._restrict(ExecutionMapper.map_jacobian(self, expr))
+
+    def map_forward_metric_derivative(self, expr):
+        return self._restrict(
+                ExecutionMapper.map_forward_metric_derivative(self, expr))
+
+    def map_inverse_metric_derivative(self, expr):
+        return self._restrict(
+                ExecutionMapper.map_inverse_metric_derivative(self, expr))
+
+    def map_normal_component(self, expr):
+        raise BlockingNotApplicable
+
+    def map_elementwise_linear(self, op, field_expr):
+        field = self.rec(field_expr)
+
+        from hedge.tools import is_zero
+        if is_zero(field):
+            return 0
+
+        out = self._volume_zeros_like(field)
+        self.executor.do_elementwise_linear_block(op, field, out, self.block)
+        return out
+
+    # }}}
+
 # }}}
 
 
@@ -369,6 +876,9 @@ class Executor(object):
         self.code = self.compile_optemplate(discr, optemplate,
                 post_bind_mapper, type_hints)
         self.elwise_linear_cache = {}
+        self.block_diff_matrix_cache = {}
+        # ids of instruction groups in self.code that cannot run blockwise
+        self.unblockable_group_ids = set()
 
         if "dump_op_code" in discr.debug:
             from hedge.tools import open_unique_debug_file
@@ -408,11 +918,17 @@ class Executor(object):
                     for f in choices)
 
         from hedge.backends.jit.diff import JitDifferentiator
-        self.diff = pick_faster_func(bench_diff,
-                [self.diff_builtin, JitDifferentiator(discr)])
         from hedge.backends.jit.lift import JitLifter
-        self.lift_flux = pick_faster_func(bench_lift,
-                [self.lift_flux, JitLifter(discr)])
+        self.jit_diff = JitDifferentiator(discr)
+        if discr.mixed_precision:
+            # only the generated kernels apply double-precision matrices
+            self.diff = self.jit_diff
+            self.lift_flux = JitLifter(discr)
+        else:
+            self.diff = pick_faster_func(bench_diff,
+                    [self.diff_builtin, self.jit_diff])
+            self.lift_flux = pick_faster_func(bench_lift,
+                    [self.lift_flux, JitLifter(discr)])
 
     def compile_optemplate(self, discr, optemplate, post_bind_mapper,
             type_hints):
@@ -479,6 +995,26 @@ class Executor(object):
                 matrix.astype(to_uncomplex_dtype(field.dtype)),
                 scaling, field, out)
 
+    def lift_ensemble_flux(self, fgroup, matrix, scaling, field, out):
+        """Like :meth:`lift_flux`, but for *field* and *out* with a
+        trailing ensemble axis. All elements and members of *fgroup* are
+        lifted in one matrix-matrix product.
+        """
+        h, w = matrix.shape
+        member_count = field.shape[1]
+
+        # (el_count, member_count, h)
+        prod = np.tensordot(field.reshape(-1, w, member_count),
+                matrix.astype(field.dtype), axes=([1], [1]))
+        if scaling is not None:
+            prod *= np.asarray(scaling)[:, np.newaxis, np.newaxis]
+
+        # Each element occurs only once in a face group, so the
+        # indices below are distinct.
+        write_base = np.asarray(fgroup.local_el_write_base, dtype=np.intp)
+        out[write_base[:, np.newaxis] + np.arange(h)] += \
+                prod.transpose(0, 2, 1)
+
     def diff_rst(self, op, field):
         result = self.discr.volume_zeros(dtype=field.dtype)
 
@@ -498,14 +1034,41 @@ class Executor(object):
 
         return [self.diff_rst(op, field) for op in operators]
 
+    def diff_ensemble(self, operators, field):
+        """Like :meth:`diff_builtin`, but for *field* with a trailing
+        ensemble axis.
+        """
+        result = []
+        for op in operators:
+            op_result = np.zeros((len(self.discr.nodes), field.shape[1]),
+                    dtype=field.dtype)
+            for eg in self.discr.element_groups:
+                perform_ensemble_elwise_operator(
+                        op.preimage_ranges(eg), eg.ranges,
+                        op.matrices(eg)[op.rst_axis].astype(field.dtype),
+                        field, op_result)
+            result.append(op_result)
+
+        return result
+
+    def _get_elementwise_linear_data(self, op, eg, dtype):
+        try:
+            return self.elwise_linear_cache[eg, op, dtype]
+        except KeyError:
+            matrix = np.asarray(op.matrix(eg), dtype=dtype)
+            coeffs = op.coefficients(eg)
+            self.elwise_linear_cache[eg, op, dtype] = matrix, coeffs
+            return matrix, coeffs
+
     def do_elementwise_linear(self, op, field, out):
         for eg in self.discr.element_groups:
-            try:
-                matrix, coeffs = self.elwise_linear_cache[eg, op, field.dtype]
-            except KeyError:
-                matrix = np.asarray(op.matrix(eg), dtype=field.dtype)
-                coeffs = op.coefficients(eg)
-                self.elwise_linear_cache[eg, op, field.dtype] = matrix, coeffs
+            matrix, coeffs = self._get_elementwise_linear_data(
+                    op, eg, field.dtype)
+
+            if field.ndim == 2:
+                perform_ensemble_elwise_operator(eg.ranges, eg.ranges,
+                        matrix, field, out, scale_factors=coeffs)
+                continue
 
             from hedge._internal import (
                     perform_elwise_scaled_operator,
@@ -518,9 +1081,101 @@ class Executor(object):
                 perform_elwise_scaled_operator(eg.ranges, eg.ranges,
                         coeffs, matrix, field, out)
 
+    # {{{ cache blocking
+
+    @memoize_method
+    def get_element_blocks(self, max_node_count):
+        return make_element_blocks(self.discr, max_node_count)
+
+    def _get_block_diff_matrices(self, op, eg, dtype):
+        try:
+            return self.block_diff_matrix_cache[op, eg, dtype]
+        except KeyError:
+            result = self.block_diff_matrix_cache[op, eg, dtype] = [
+                    m.astype(dtype) for m in op.matrices(eg)]
+            return result
+
+    def diff_block(self, operators, field, block):
+        """Like :meth:`diff`, but for *field* restricted to the elements
+        of *block*, an :class:`ElementBlock`.
+        """
+        eg = block.element_group
+        rep_op = operators[0]
+
+        result = [np.zeros(block.node_count, dtype=field.dtype)
+                for i in range(self.discr.dimensions)]
+
+        from hedge.tools import is_zero
+        if not is_zero(field):
+            from pytools import to_uncomplex_dtype
+            uncomplex_dtype = to_uncomplex_dtype(
+                    self.discr.get_accumulation_dtype(field.dtype))
+            matrices = self._get_block_diff_matrices(
+                    rep_op, eg, uncomplex_dtype)
+
+            diff_routine = self.jit_diff.make_diff(eg, field.dtype,
+                    matrices[0].shape)
+            diff_routine(*([block.ranges, block.ranges, field]
+                + matrices + result))
+
+        return [result[op.rst_axis] for op in operators]
+
+    def do_elementwise_linear_block(self, op, field, out, block):
+        """Like :meth:`do_elementwise_linear`, but for *field* and *out*
+        restricted to the elements of *block*, an :class:`ElementBlock`.
+        """
+        matrix, coeffs = self._get_elementwise_linear_data(
+                op, block.element_group, field.dtype)
+
+        from hedge._internal import (
+                perform_elwise_scaled_operator,
+                perform_elwise_operator)
+
+        if coeffs is None:
+            perform_elwise_operator(block.ranges, block.ranges,
+                    matrix, field, out)
+        else:
+            coeffs = np.asarray(coeffs)[
+                    block.el_start:block.el_start+block.el_count]
+            perform_elwise_scaled_operator(block.ranges, block.ranges,
+                    coeffs, matrix, field, out)
+
+    # }}}
+
     def __call__(self, **context):
-        return self.code.execute(
-                self.discr.exec_mapper_class(context, self))
+        from hedge.tools.field_block import FieldBlock
+        block_names = [name for name, value in context.iteritems()
+                if isinstance(value, FieldBlock)]
+        result_block = None
+        if block_names:
+            # operate on views of the components
+            from pytools import common_dtype
+            dtype = common_dtype([context[name].dtype for name in block_names]
+                    + [self.discr.default_scalar_type])
+            result_block = _make_result_block(self.code.result,
+                    len(self.discr.nodes), dtype)
+
+            context = context.copy()
+            for name in block_names:
+                context[name] = context[name].components()
+
+        exec_mapper = self.discr.exec_mapper_class(context, self)
+        if result_block is not None:
+            # compute result components right into the result block
+            exec_mapper.result_targets = result_block[2]
+
+        ensemble_size = get_ensemble_size(context)
+        if ensemble_size is None:
+            result = self.code.execute(exec_mapper)
+        else:
+            exec_mapper.ensemble_size = ensemble_size
+            result = _finish_ensemble_result(self.code.execute(exec_mapper))
+
+        if result_block is not None:
+            block, rows, targets = result_block
+            return _finish_field_block_result(result, block, rows)
+        else:
+            return result
 
 # }}}
 
@@ -544,6 +1199,33 @@ class Discretization(hedge.discretization.Discretization):
                 | set(["jit_dont_optimize_large_exprs"]))
 
     def __init__(self, *args, **kwargs):
+        """
+        :param mixed_precision: If *True*, volume and face vectors are
+          stored in *default_scalar_type*, which then defaults to
+          :class:`numpy.float32` and must be of single precision.
+          Differentiation, lifting and flux gathering apply their
+          matrices and geometric factors in double precision and
+          accumulate in it, as do nodal sums, see
+          :meth:`get_accumulation_dtype`. To also accumulate time steps
+          in double precision, pass *residual_dtype* to
+          :class:`hedge.timestep.runge_kutta.LSRK4TimeStepper`.
+        :param cache_block_bytes: If given, compiled operators execute
+          each run of element-local instructions (reference
+          differentiation, element-wise linear operators such as the
+          inverse mass matrix, and vector expressions) that is not
+          interrupted by a flux gather or other non-local instruction one
+          block of elements at a time. Blocks are sized so that the
+          vectors touched by the run take up about this many bytes per
+          block, e.g. the size of the L2 cache. Values used only within
+          a run are never stored for the whole volume.
+        :param cache_block_min_nodes: the smallest number of nodes in a
+          block of elements. Each block costs a Python-level dispatch of
+          every instruction in the run, so blocks that are too small
+          spend more time on that than they save in memory traffic. Runs
+          that would fit into a single block are executed as usual.
+          Use ``test/cache_blocking_performance_test.py`` to choose this
+          and *cache_block_bytes* for a given machine.
+        """
         logger.info("init jit discretization: start")
 
         toolchain = kwargs.pop("toolchain", None)
@@ -551,6 +1233,16 @@ class Discretization(hedge.discretization.Discretization):
         # tolerate (and ignore) the CUDA backend's tune_for argument
         kwargs.pop("tune_for", None)
 
+        self.mixed_precision = kwargs.pop("mixed_precision", False)
+        self.cache_block_bytes = kwargs.pop("cache_block_bytes", None)
+        self.cache_block_min_nodes = kwargs.pop("cache_block_min_nodes", 4096)
+        if self.mixed_precision:
+            kwargs.setdefault("default_scalar_type", np.float32)
+            if np.dtype(kwargs["default_scalar_type"]) not in [
+                    np.dtype(np.float32), np.dtype(np.complex64)]:
+                raise ValueError("mixed precision requires a "
+                        "single-precision default_scalar_type")
+
         hedge.discretization.Discretization.__init__(self, *args, **kwargs)
 
         if toolchain is None:
@@ -565,6 +1257,17 @@ class Discretization(hedge.discretization.Discretization):
 
         logger.info("init jit discretization: done")
 
+    def get_accumulation_dtype(self, dtype):
+        """Return the dtype in which operators acting on vectors of
+        *dtype* apply their matrices and accumulate sums.
+        """
+        dtype = np.dtype(dtype)
+        if self.mixed_precision:
+            from pytools import match_precision
+            return match_precision(dtype, np.dtype(np.float64))
+        else:
+            return dtype
+
 # }}}
 
 
@@ -27,7 +27,7 @@ THE SOFTWARE.
 
 from pytools import memoize_method
 from hedge.compiler import OperatorCompilerBase, FluxBatchAssign, \
-        Assign
+        Assign, Instruction
 
 
 # {{{ jit instructions
@@ -89,7 +89,7 @@ class CompiledFluxBatchAssign(FluxBatchAssign):
         return set(flatten(dep_mapper(dep) for dep in deps))
 
     @memoize_method
-    def get_module(self, discr, dtype):
+    def get_module(self, discr, dtype, ensemble=False):
         from hedge.backends.jit.flux import \
                 get_interior_flux_mod, \
                 get_boundary_flux_mod
@@ -97,7 +97,7 @@ class CompiledFluxBatchAssign(FluxBatchAssign):
         if not self.is_boundary:
             mod = get_interior_flux_mod(
                     self.expressions, self.flux_var_info,
-                    discr, dtype)
+                    discr, dtype, ensemble)
 
             if discr.instrumented:
                 from hedge.tools import time_count_flop, gather_flops
@@ -113,7 +113,8 @@ class CompiledFluxBatchAssign(FluxBatchAssign):
 
         else:
             mod = get_boundary_flux_mod(
-                    self.expressions, self.flux_var_info, discr, dtype)
+                    self.expressions, self.flux_var_info, discr, dtype,
+                    ensemble)
 
             if discr.instrumented:
                 from pytools.log import time_and_count_function
@@ -122,6 +123,46 @@ class CompiledFluxBatchAssign(FluxBatchAssign):
 
         return mod
 
+
+class BlockedInstructionGroup(Instruction):
+    """A group of element-local instructions that is executed one block of
+    elements at a time, so that each block's data stays in cache while all
+    instructions of the group act on it. Created by
+    :meth:`OperatorCompiler.group_element_local_instructions`.
+
+    :ivar instructions: the member instructions, ordered so that each
+      comes after the members it depends on.
+    :ivar exported_names: the names assigned by members that are used
+      outside of the group. All other names assigned by members only
+      ever hold values for a single block.
+    :ivar vector_count: the number of distinct vectors read or written
+      by the group, used to size the blocks.
+    """
+
+    def get_assignees(self):
+        return set(self.exported_names)
+
+    @memoize_method
+    def get_dependencies(self):
+        from pymbolic.primitives import Variable
+        from operator import or_
+        return reduce(or_,
+                (insn.get_dependencies() for insn in self.instructions)) \
+                - set(Variable(name)
+                        for insn in self.instructions
+                        for name in insn.get_assignees())
+
+    def __str__(self):
+        lines = ["{ /* blocked, exports %s */"
+                % ", ".join(self.exported_names)]
+        for insn in self.instructions:
+            lines.extend("  " + line for line in str(insn).split("\n"))
+        lines.append("}")
+        return "\n".join(lines)
+
+    def get_executor_method(self, executor):
+        return executor.exec_blocked_instruction_group
+
 # }}}
 
 
@@ -215,6 +256,219 @@ class OperatorCompiler(OperatorCompilerBase):
 
     # }}}
 
+    # {{{ cache blocking
+
+    def __call__(self, expr, type_hints={}):
+        code = OperatorCompilerBase.__call__(self, expr, type_hints)
+
+        if self.discr.cache_block_bytes is not None:
+            code = self.group_element_local_instructions(code)
+
+        return code
+
+    def group_element_local_instructions(self, code):
+        """Return a version of *code* in which element-local instructions
+        (batched reference differentiation, element-wise linear operators
+        and vector expressions on volume vectors) are combined into
+        :class:`BlockedInstructionGroup` instances wherever they are not
+        separated by other instructions, such as flux gathers.
+
+        Flux gathers and lifts stay outside the groups. The compiled flux
+        kernels walk the global face groups, whose elements are not
+        ordered like volume vectors, so restricting them to a block of
+        elements would mean gathering each block's face data separately.
+        Their results are, however, read blockwise by the groups that
+        consume them.
+        """
+        from pymbolic.primitives import Variable, Subscript
+        from hedge.compiler import Code, DiffBatchAssign, \
+                QuadratureDiffBatchAssign
+        from hedge.optemplate import OperatorBinding
+        from hedge.optemplate.operators import (
+                ElementwiseLinearOperator,
+                ReferenceQuadratureStiffnessTOperator)
+        from hedge.optemplate.primitives import (
+                Ones, NodeCoordinateComponent)
+        from hedge.optemplate.mappers import GeometricFactorCollector
+
+        producers = dict(
+                (name, insn)
+                for insn in code.instructions
+                for name in insn.get_assignees())
+
+        def get_producers(insn):
+            return set(producers[dep.name]
+                    for dep in insn.get_dependencies()
+                    if isinstance(dep, Variable) and dep.name in producers)
+
+        def is_volume_var(expr):
+            while isinstance(expr, Subscript):
+                expr = expr.aggregate
+            return isinstance(expr, Variable)
+
+        # {{{ find element-local instructions
+
+        geometric_factors = {}
+        is_local_cache = {}
+
+        def is_local(insn):
+            try:
+                return is_local_cache[insn]
+            except KeyError:
+                pass
+
+            if isinstance(insn, VectorExprAssign):
+                geometric_factors[insn] = reduce(set.union,
+                        (GeometricFactorCollector()(expr)
+                            for expr in insn.exprs), set())
+                result = all(gf.quadrature_tag is None
+                        for gf in geometric_factors[insn])
+            elif isinstance(insn, Assign):
+                result = not insn.is_scalar_valued and all(
+                        is_volume_var(expr)
+                        or (isinstance(expr, OperatorBinding)
+                            and isinstance(expr.op, ElementwiseLinearOperator)
+                            and is_volume_var(expr.field))
+                        for expr in insn.exprs)
+            elif (isinstance(insn, DiffBatchAssign)
+                    and not isinstance(insn, QuadratureDiffBatchAssign)):
+                result = not any(
+                        isinstance(op, ReferenceQuadratureStiffnessTOperator)
+                        for op in insn.operators)
+            else:
+                result = False
+
+            # Inputs are assumed to live on the volume grid. Values
+            # computed here need to have been computed there, too.
+            result = result and all(
+                    yields_volume_vectors(prod)
+                    for prod in get_producers(insn))
+
+            is_local_cache[insn] = result
+            return result
+
+        def yields_volume_vectors(insn):
+            if isinstance(insn, FluxBatchAssign):
+                return True
+            elif (isinstance(insn, Assign) and len(insn.exprs) == 1
+                    and isinstance(insn.exprs[0],
+                        (Ones, NodeCoordinateComponent))):
+                return insn.exprs[0].quadrature_tag is None
+            else:
+                return is_local(insn)
+
+        # }}}
+
+        # {{{ group local instructions by separating non-local instructions
+
+        # The number of non-local instructions on the longest dependency
+        # chain leading up to an instruction. Local instructions at equal
+        # depth have no non-local instruction between them and may thus
+        # be executed together.
+        depth_cache = {}
+
+        def get_depth(insn):
+            try:
+                return depth_cache[insn]
+            except KeyError:
+                pass
+
+            result = 0
+            for prod in get_producers(insn):
+                if is_local(prod):
+                    result = max(result, get_depth(prod))
+                else:
+                    result = max(result, get_depth(prod) + 1)
+
+            depth_cache[insn] = result
+            return result
+
+        topological_order = {}
+
+        def add_to_order(insn):
+            if insn not in topological_order:
+                for prod in get_producers(insn):
+                    add_to_order(prod)
+                topological_order[insn] = len(topological_order)
+
+        for insn in code.instructions:
+            add_to_order(insn)
+
+        groups = {}
+        for insn in code.instructions:
+            if is_local(insn):
+                groups.setdefault(get_depth(insn), []).append(insn)
+
+        # }}}
+
+        # {{{ build groups
+
+        from hedge.optemplate.mappers import DependencyMapper
+        dm = DependencyMapper(composite_leaves=False)
+
+        result_names = set()
+
+        def add_result_names(result_expr):
+            result_names.update(var.name for var in dm(result_expr))
+
+        from hedge.tools import with_object_array_or_scalar
+        with_object_array_or_scalar(add_result_names, code.result)
+
+        insn_to_group = {}
+        for members in groups.itervalues():
+            if len(members) < 2:
+                continue
+
+            members.sort(key=lambda insn: topological_order[insn])
+            member_set = set(members)
+
+            used_names = result_names | set(
+                    dep.name
+                    for insn in code.instructions
+                    if insn not in member_set
+                    for dep in insn.get_dependencies())
+
+            assignees = [name
+                    for insn in members
+                    for name in sorted(insn.get_assignees())]
+
+            external_deps = set(
+                    dep
+                    for insn in members
+                    for dep in insn.get_dependencies()
+                    if dep.name not in assignees)
+            group_gfs = reduce(set.union,
+                    (geometric_factors.get(insn, set()) for insn in members),
+                    set())
+
+            group = BlockedInstructionGroup(
+                    instructions=members,
+                    exported_names=[name for name in assignees
+                        if name in used_names],
+                    vector_count=(len(external_deps) + len(assignees)
+                        + len(group_gfs)),
+                    priority=max(insn.priority for insn in members),
+                    dep_mapper_factory=self.dep_mapper_factory)
+
+            for insn in members:
+                insn_to_group[insn] = group
+
+        instructions = []
+        emitted_groups = set()
+        for insn in code.instructions:
+            group = insn_to_group.get(insn)
+            if group is None:
+                instructions.append(insn)
+            elif group not in emitted_groups:
+                instructions.append(group)
+                emitted_groups.add(group)
+
+        # }}}
+
+        return Code(instructions, code.result)
+
+    # }}}
+
 # }}}
 
 
@@ -57,6 +57,7 @@ class JitDifferentiator:
                 Define)
 
         from pytools import to_uncomplex_dtype
+        accum_dtype = discr.get_accumulation_dtype(dtype)
 
         from codepy.bpl import BoostPythonModule
         mod = BoostPythonModule()
@@ -78,7 +79,8 @@ class JitDifferentiator:
             Define("DIMENSIONS", discr.dimensions),
             Line(),
             Typedef(POD(dtype, "value_type")),
-            Typedef(POD(to_uncomplex_dtype(dtype), "uncomplex_type")),
+            Typedef(POD(accum_dtype, "accum_type")),
+            Typedef(POD(to_uncomplex_dtype(accum_dtype), "uncomplex_type")),
             ])
 
         fdecl = FunctionDeclaration(
@@ -149,7 +151,7 @@ class JitDifferentiator:
                         "i < ROW_COUNT",
                         "++i",
                         Block([
-                            Initializer(Value("value_type", "drst_%d" % rst), 0)
+                            Initializer(Value("accum_type", "drst_%d" % rst), 0)
                             for rst in range(discr.dimensions)
                             ]+[
                             Line(),
@@ -159,7 +161,8 @@ class JitDifferentiator:
                                 "++j",
                                 Block([
                                     S("drst_%(rst)d += "
-                                        "diffmat_rst%(rst)d(i, j)*field_it[from_el_base+j]"
+                                        "diffmat_rst%(rst)d(i, j)"
+                                        "*accum_type(field_it[from_el_base+j])"
                                         % {"rst":rst})
                                     for rst in range(discr.dimensions)
                                     ])
@@ -167,7 +170,7 @@ class JitDifferentiator:
                             Line(),
                             ]+[
                             Assign("result%d_it[to_el_base+i]" % rst,
-                                "drst_%d" % rst)
+                                "value_type(drst_%d)" % rst)
                             for rst in range(discr.dimensions)
                             ])
                         )
@@ -215,7 +218,8 @@ class JitDifferentiator:
         if not is_zero(field):
             for eg in self.discr.element_groups:
                 from pytools import to_uncomplex_dtype
-                uncomplex_dtype = to_uncomplex_dtype(field.dtype)
+                uncomplex_dtype = to_uncomplex_dtype(
+                        self.discr.get_accumulation_dtype(field.dtype))
                 matrices = rep_op.matrices(eg)
                 args = ([rep_op.preimage_ranges(eg), eg.ranges, field]
                         + [m.astype(uncomplex_dtype) for m in matrices]
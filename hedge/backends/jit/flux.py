@@ -36,9 +36,10 @@ from hedge.flux import FluxIdentityMapper
 
 # flux to code mapper ---------------------------------------------------------
 class FluxConcretizer(FluxIdentityMapper):
-    def __init__(self, flux_idx, fvi):
+    def __init__(self, flux_idx, fvi, ensemble=False):
         self.flux_idx = flux_idx
         self.flux_var_info = fvi
+        self.ensemble = ensemble
 
     def map_field_component(self, expr):
         if expr.is_interior:
@@ -52,13 +53,23 @@ class FluxConcretizer(FluxIdentityMapper):
         if not arg_name:
             return 0
         else:
+            # compute in accumulation precision, see
+            # hedge.backends.jit.Discretization.get_accumulation_dtype
             from pymbolic import var
-            return var(arg_name+"_it")[var(where+"_idx")]
+            index = var(where+"_idx")
+            if self.ensemble:
+                index = (index*var(arg_name+"_node_stride")
+                        + var("member")*var(arg_name+"_member_stride"))
+
+            return var("accum_type")(var(arg_name+"_it")[index])
 
     def map_scalar_parameter(self, expr):
         from pymbolic import var
-        return var("args._scalar_arg_%d"
-                % self.flux_var_info.scalar_parameters.index(expr))
+        arg_num = self.flux_var_info.scalar_parameters.index(expr)
+        if self.ensemble:
+            return var("_scalar_arg_%d_it" % arg_num)[var("member")]
+        else:
+            return var("args._scalar_arg_%d" % arg_num)
 
 
 
@@ -111,7 +122,7 @@ class FluxToCodeMapper(CCodeMapper):
 
 
 
-def flux_to_code(f2c, is_flipped, flux_idx, fvi, flux, prec):
+def flux_to_code(f2c, is_flipped, flux_idx, fvi, flux, prec, ensemble=False):
     # If you are intending to modify how flux flipping is done,
     # consider this: Fluxes may contain CSEs. If you do something
     # just to the result of this function, you will miss the CSEs,
@@ -123,7 +134,7 @@ def flux_to_code(f2c, is_flipped, flux_idx, fvi, flux, prec):
         from hedge.flux import FluxFlipper
         flux = FluxFlipper()(flux)
 
-    return f2c(FluxConcretizer(flux_idx, fvi)(flux), prec)
+    return f2c(FluxConcretizer(flux_idx, fvi, ensemble)(flux), prec)
 
 
 
@@ -236,7 +247,67 @@ def get_flux_toolchain(discr, fluxes):
 
 
 
-def get_interior_flux_mod(fluxes, fvi, discr, dtype):
+# ensemble support ------------------------------------------------------------
+# In ensemble mode (see hedge.backends.jit.get_ensemble_size), the
+# generated kernels loop over the ensemble members inside the loop over
+# face nodes. Fluxes on faces are stored with members innermost. Each field
+# argument comes with a member stride, which is zero for fields shared by
+# all members, and scalar parameters become arrays with one entry per
+# member.
+
+def get_ensemble_arg_struct_fields(fvi):
+    from cgen import Value
+
+    return [Value("unsigned", "member_count")] + [
+        Value("unsigned", "%s_member_stride" % arg_name)
+        for arg_name in fvi.arg_names]
+
+
+def get_ensemble_scalar_arg_type(scalar_par):
+    if scalar_par.is_complex:
+        return "numpy_array<accum_type>"
+    else:
+        return "numpy_array<uncomplex_type>"
+
+
+def get_ensemble_prelude(fvi):
+    from cgen import Const, Value, Initializer
+
+    return [
+        Initializer(Const(Value("unsigned", "member_count")),
+            "args.member_count")
+        ]+[
+        Initializer(Const(Value("unsigned", "%s_member_stride" % arg_name)),
+            "args.%s_member_stride" % arg_name)
+        for arg_name in fvi.arg_names
+        ]+[
+        Initializer(Const(Value("unsigned", "%s_node_stride" % arg_name)),
+            "%s_member_stride ? member_count : 1" % arg_name)
+        for arg_name in fvi.arg_names
+        ]+[
+        Initializer(Const(Value(
+            "%s::const_iterator" % get_ensemble_scalar_arg_type(scalar_par),
+            "_scalar_arg_%d_it" % i)),
+            "args._scalar_arg_%d.begin()" % i)
+        for i, scalar_par in enumerate(fvi.scalar_parameters)
+        ]
+
+
+def wrap_member_loop(statements, ensemble):
+    if not ensemble:
+        return statements
+
+    from cgen import For, Block
+    return [For(
+        "unsigned member = 0",
+        "member < member_count",
+        "++member",
+        Block(statements))]
+
+
+
+
+def get_interior_flux_mod(fluxes, fvi, discr, dtype, ensemble=False):
     from cgen import \
             FunctionDeclaration, FunctionBody, \
             Const, Reference, Value, MaybeUnused, Typedef, POD, \
@@ -247,6 +318,7 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
     mod = BoostPythonModule()
 
     from pytools import to_uncomplex_dtype, flatten
+    accum_dtype = discr.get_accumulation_dtype(dtype)
 
     S = Statement
     mod.add_to_preamble([
@@ -263,7 +335,8 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
         S("using namespace pyublas"),
         Line(),
         Typedef(POD(dtype, "value_type")),
-        Typedef(POD(to_uncomplex_dtype(dtype), "uncomplex_type")),
+        Typedef(POD(accum_dtype, "accum_type")),
+        Typedef(POD(to_uncomplex_dtype(accum_dtype), "uncomplex_type")),
         Line(),
         ])
 
@@ -274,10 +347,11 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
         Value("numpy_array<value_type>", arg_name)
         for arg_name in fvi.arg_names
         ]+[
-        Value("value_type" if scalar_par.is_complex else "uncomplex_type",
+        Value(get_ensemble_scalar_arg_type(scalar_par) if ensemble
+            else "accum_type" if scalar_par.is_complex else "uncomplex_type",
             "_scalar_arg_%d" % i)
         for i, scalar_par in enumerate(fvi.scalar_parameters)
-        ])
+        ]+(get_ensemble_arg_struct_fields(fvi) if ensemble else []))
 
     mod.add_struct(arg_struct, "ArgStruct")
     mod.add_to_module([Line()])
@@ -294,19 +368,25 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
     def gen_flux_code():
         f2cm = FluxToCodeMapper()
 
+        if ensemble:
+            fof_index = "(%s_fof_base+%s)*member_count+member"
+        else:
+            fof_index = "%s_fof_base+%s"
+
         result = [
-                Assign("fof%d_it[%s_fof_base+%s]" % (flux_idx, where, tgt_idx),
+                Assign("fof%d_it[%s]" % (flux_idx, fof_index % (where, tgt_idx)),
                     "uncomplex_type(fp.int_side.face_jacobian) * " +
-                    flux_to_code(f2cm, is_flipped, flux_idx, fvi, flux.op.flux, PREC_PRODUCT))
+                    flux_to_code(f2cm, is_flipped, flux_idx, fvi, flux.op.flux,
+                        PREC_PRODUCT, ensemble))
                 for flux_idx, flux in enumerate(fluxes)
                 for where, is_flipped, tgt_idx in [
                     ("int_side", False, "i"),
                     ("ext_side", True, "ext_native_write_map[i]")
                     ]]
 
-        return [
-            Initializer(Value("value_type", cse_name), cse_str)
-            for cse_name, cse_str in f2cm.cse_name_list] + result
+        return wrap_member_loop([
+            Initializer(Value("accum_type", cse_name), cse_str)
+            for cse_name, cse_str in f2cm.cse_name_list] + result, ensemble)
 
     fbody = Block([
         Initializer(
@@ -318,7 +398,7 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
             Const(Value("numpy_array<value_type>::const_iterator", "%s_it" % arg_name)),
             "args.%s.begin()" % arg_name)
         for arg_name in fvi.arg_names
-        ]+[
+        ]+(get_ensemble_prelude(fvi) if ensemble else [])+[
         Line(),
         CustomLoop("BOOST_FOREACH(const face_pair<straight_face> &fp, fg.face_pairs)", Block(
             list(flatten([
@@ -362,7 +442,7 @@ def get_interior_flux_mod(fluxes, fvi, discr, dtype):
 
 
 
-def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
+def get_boundary_flux_mod(fluxes, fvi, discr, dtype, ensemble=False):
     from cgen import \
             FunctionDeclaration, FunctionBody, Typedef, Struct, \
             Const, Reference, Value, POD, MaybeUnused, \
@@ -370,6 +450,7 @@ def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
             CustomLoop, For
 
     from pytools import to_uncomplex_dtype, flatten
+    accum_dtype = discr.get_accumulation_dtype(dtype)
 
     from codepy.bpl import BoostPythonModule
     mod = BoostPythonModule()
@@ -389,7 +470,8 @@ def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
         S("using namespace pyublas"),
         Line(),
         Typedef(POD(dtype, "value_type")),
-        Typedef(POD(to_uncomplex_dtype(dtype), "uncomplex_type")),
+        Typedef(POD(accum_dtype, "accum_type")),
+        Typedef(POD(to_uncomplex_dtype(accum_dtype), "uncomplex_type")),
         ])
 
     arg_struct = Struct("arg_struct", [
@@ -398,7 +480,11 @@ def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
         ]+[
         Value("numpy_array<value_type>", arg_name)
         for arg_name in fvi.arg_names
-        ])
+        ]+[
+        Value(get_ensemble_scalar_arg_type(scalar_par), "_scalar_arg_%d" % i)
+        for i, scalar_par in enumerate(fvi.scalar_parameters)
+        if ensemble
+        ]+(get_ensemble_arg_struct_fields(fvi) if ensemble else []))
 
     mod.add_struct(arg_struct, "ArgStruct")
     mod.add_to_module([Line()])
@@ -415,16 +501,22 @@ def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
     def gen_flux_code():
         f2cm = FluxToCodeMapper()
 
+        if ensemble:
+            fof_index = "(loc_fof_base+i)*member_count+member"
+        else:
+            fof_index = "loc_fof_base+i"
+
         result = [
-                Assign("fof%d_it[loc_fof_base+i]" % flux_idx,
+                Assign("fof%d_it[%s]" % (flux_idx, fof_index),
                     "uncomplex_type(fp.int_side.face_jacobian) * " +
-                    flux_to_code(f2cm, False, flux_idx, fvi, flux.op.flux, PREC_PRODUCT))
+                    flux_to_code(f2cm, False, flux_idx, fvi, flux.op.flux,
+                        PREC_PRODUCT, ensemble))
                 for flux_idx, flux in enumerate(fluxes)
                 ]
 
-        return [
-            Initializer(Value("value_type", cse_name), cse_str)
-            for cse_name, cse_str in f2cm.cse_name_list] + result
+        return wrap_member_loop([
+            Initializer(Value("accum_type", cse_name), cse_str)
+            for cse_name, cse_str in f2cm.cse_name_list] + result, ensemble)
 
     fbody = Block([
         Initializer(
@@ -437,7 +529,7 @@ def get_boundary_flux_mod(fluxes, fvi, discr, dtype):
                 "%s_it" % arg_name)),
             "args.%s.begin()" % arg_name)
         for arg_name in fvi.arg_names
-        ]+[
+        ]+(get_ensemble_prelude(fvi) if ensemble else [])+[
         Line(),
         CustomLoop("BOOST_FOREACH(const face_pair<straight_face> &fp, fg.face_pairs)", Block(
             list(flatten([
@@ -47,6 +47,7 @@ class JitLifter:
                 Define)
 
         from pytools import to_uncomplex_dtype
+        accum_dtype = discr.get_accumulation_dtype(dtype)
 
         from codepy.bpl import BoostPythonModule
         mod = BoostPythonModule()
@@ -68,7 +69,8 @@ class JitLifter:
             Define("DIMENSIONS", discr.dimensions),
             Line(),
             Typedef(POD(dtype, "value_type")),
-            Typedef(POD(to_uncomplex_dtype(dtype), "uncomplex_type")),
+            Typedef(POD(accum_dtype, "accum_type")),
+            Typedef(POD(to_uncomplex_dtype(accum_dtype), "uncomplex_type")),
             ])
 
         def if_(cond, result, else_=None):
@@ -122,18 +124,21 @@ class JitLifter:
                         "i < DOFS_PER_EL",
                         "++i",
                         Block([
-                            Initializer(Value("value_type", "tmp"), 0),
+                            Initializer(Value("accum_type", "tmp"), 0),
                             Line(),
                             For("unsigned j = 0",
                                 "j < FACES_PER_EL*fg.face_length()",
                                 "++j",
-                                S("tmp += matrix(i, j)*field_it[src_el_base+j]")
+                                S("tmp += matrix(i, j)"
+                                    "*accum_type(field_it[src_el_base+j])")
                                 ),
                             Line(),
                             ]+if_(with_scale,
                                 Assign("result_it[dest_el_base+i]",
-                                    "tmp * value_type(*elwise_post_scaling_it)"),
-                                Assign("result_it[dest_el_base+i]", "tmp"))
+                                    "value_type(tmp "
+                                    "* accum_type(*elwise_post_scaling_it))"),
+                                Assign("result_it[dest_el_base+i]",
+                                    "value_type(tmp)"))
                             )
                         ),
                     ]+if_(with_scale, S("elwise_post_scaling_it++"))
@@ -151,7 +156,8 @@ class JitLifter:
 
     def __call__(self, fgroup, matrix, scaling, field, out):
         from pytools import to_uncomplex_dtype
-        uncomplex_dtype = to_uncomplex_dtype(field.dtype)
+        uncomplex_dtype = to_uncomplex_dtype(
+                self.discr.get_accumulation_dtype(field.dtype))
         args = [fgroup, matrix.astype(uncomplex_dtype), field, out]
 
         if scaling is not None:
@@ -48,20 +48,65 @@ class CompiledVectorExpression(CompiledVectorExpressionBase):
                 args, instructions, name="vector_expression",
                 toolchain=self.toolchain)
 
-    def __call__(self, evaluate_subexpr, stats_callback=None):
+    def __call__(self, evaluate_subexpr, stats_callback=None,
+            result_targets=None):
+        """:param result_targets: *None*, or a dictionary mapping result
+          names to arrays that those results are computed into, provided
+          their shape and type fit.
+        """
         vectors = [evaluate_subexpr(vec_expr) 
                 for vec_expr in self.vector_deps]
         scalars = [evaluate_subexpr(scal_expr) 
                 for scal_expr in self.scalar_deps]
 
-        from pytools import single_valued
-        shape = single_valued(vec.shape for vec in vectors)
+        shapes = set(vec.shape for vec in vectors)
+        member_scalars = tuple(
+                isinstance(scal, numpy.ndarray) and scal.ndim == 2
+                for scal in scalars)
+
+        if len(shapes) == 1 and not any(member_scalars):
+            shape, = shapes
+            ensemble_layout = None
+        else:
+            # In ensemble mode, vectors shared by all members have no
+            # ensemble axis or one of length one, and scalars may have one
+            # value per member. The kernel indexes these accordingly
+            # instead of having them expanded.
+            from pytools import single_valued
+            member_count = max([1]
+                    + [vec.shape[1] for vec in vectors if vec.ndim == 2]
+                    + [scal.shape[1] for scal, per_member
+                        in zip(scalars, member_scalars) if per_member])
+            shape = (single_valued(s[0] for s in shapes), member_count)
+
+            if not all(len(s) == 1 or s[1] in [1, member_count]
+                    for s in shapes):
+                raise ValueError("vector expression arguments have "
+                        "incompatible shapes %s" % ", ".join(
+                            str(s) for s in shapes))
+
+            ensemble_layout = (member_count,
+                    tuple(vec.shape != shape for vec in vectors),
+                    member_scalars)
+            scalars = [
+                    numpy.ascontiguousarray(scal[0]) if per_member else scal
+                    for scal, per_member in zip(scalars, member_scalars)]
 
         kernel_rec = self.get_kernel(
                 tuple(v.dtype for v in vectors),
-                tuple(s.dtype for s in scalars))
+                tuple(s.dtype for s in scalars),
+                ensemble_layout)
+
+        def make_result(name):
+            if result_targets is not None:
+                target = result_targets.get(name)
+                if (target is not None and target.shape == shape
+                        and target.dtype == kernel_rec.result_dtype):
+                    return target
+
+            return numpy.empty(shape, kernel_rec.result_dtype)
 
-        results = [numpy.empty(shape, kernel_rec.result_dtype)
+        results = [make_result(vei.name)
                 for vei in self.result_vec_expr_info_list]
 
         size = results[0].size
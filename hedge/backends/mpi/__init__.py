@@ -36,7 +36,7 @@ from hedge.optemplate import \
         FluxOpReducerMixin
 from hedge.tools.futures import Future
 from hedge.backends import RunContext
-import pytools.mpiwrap as mpi
+from pytools.log import LogQuantity
 from pymbolic.mapper import CSECachingMapperMixin
 
 
@@ -63,9 +63,23 @@ class RankData(pytools.Record):
 
 
 class MPIRunContext(RunContext):
-    def __init__(self, communicator, serial_context):
+    """
+    :param mpi_module: the module supplying MPI constants (such as reduction
+      operations and data types) that match *communicator*. Defaults to
+      :mod:`pytools.mpiwrap`.
+    """
+
+    def __init__(self, communicator, serial_context, mpi_module=None):
+        if mpi_module is None:
+            import pytools.mpiwrap as mpi_module
+
         self.communicator = communicator
         self.serial_context = serial_context
+        self.mpi = mpi_module
+
+        # only available after distribute_mesh()/repartition()
+        self.global_mesh = None
+        self.global_partition = None
 
     @property
     def rank(self):
@@ -79,7 +93,17 @@ class MPIRunContext(RunContext):
     def head_rank(self):
         return 0
 
-    def distribute_mesh(self, mesh, partition=None):
+    def distribute_mesh(self, mesh, partition=None,
+            element_weights=None, face_weights=None):
+        """See :meth:`hedge.backends.RunContext.distribute_mesh`.
+
+        If Metis is used to find the partition, *element_weights* and
+        *face_weights* are passed on to
+        :func:`hedge.partition.partition_weighted`.
+
+        The head rank keeps a reference to *mesh* so that the mesh may later
+        be redistributed by :meth:`repartition`.
+        """
         assert self.is_head_rank
 
         if partition is None:
@@ -87,12 +111,22 @@ class MPIRunContext(RunContext):
 
         # compute partition using Metis, if necessary
         if isinstance(partition, int):
-            from pymetis import part_graph
-            dummy, partition = part_graph(partition,
-                    mesh.element_adjacency_graph())
+            from hedge.partition import partition_weighted
+            partition = partition_weighted(mesh, partition,
+                    element_weights=element_weights,
+                    face_weights=face_weights)
+
+        self.global_mesh = mesh
+        self.global_partition = partition
 
+        return self._send_rank_data(mesh, partition)
+
+    def _send_rank_data(self, mesh, partition):
         from hedge.partition import partition_mesh
         from hedge.mesh import TAG_RANK_BOUNDARY
+
+        result = None
+
         for part_data in partition_mesh(
                 mesh, partition, part_bdry_tag_factory=TAG_RANK_BOUNDARY):
 
@@ -117,6 +151,80 @@ class MPIRunContext(RunContext):
 
         return result
 
+    # {{{ dynamic load balancing
+
+    def repartition(self, discr, element_weights=None, face_weights=None,
+            element_cost_factors=None, min_imbalance=0):
+        """Compute a new, weighted partition of the mesh originally passed to
+        :meth:`distribute_mesh` and hand out the resulting mesh chunks.
+        Must be called on all ranks at once.
+
+        :param discr: this rank's current :class:`ParallelDiscretization`.
+        :param element_weights: *None* or an array of this rank's element
+          costs, indexed by local element id. If *None*, costs are estimated
+          by :meth:`ParallelDiscretization.estimate_element_costs`, which
+          uses measured kernel times if *discr* is instrumented.
+        :param element_cost_factors: passed on to
+          :meth:`ParallelDiscretization.estimate_element_costs`.
+        :param face_weights: *None* or a mapping from
+          *(global element id, face number)* to a face cost,
+          see :func:`hedge.partition.partition_weighted`.
+          Only significant on the head rank.
+        :param min_imbalance: if the current imbalance (as computed by
+          :func:`hedge.partition.partition_imbalance`) is below this
+          value, the partition is left unchanged.
+        :returns: *None* if the partition was left unchanged, or else a new
+          :class:`RankData` for this rank, to be passed to
+          :meth:`make_discretization`. Fields may be moved to the
+          new discretization using :func:`migrate_volume_field`.
+        """
+        if element_weights is None:
+            element_weights = discr.estimate_element_costs(element_cost_factors)
+
+        from pytools import reverse_dictionary
+        local2global_elements = reverse_dictionary(discr.global2local_elements)
+
+        weight_packet = dict(
+                (local2global_elements[local_el_id], weight)
+                for local_el_id, weight in enumerate(element_weights))
+
+        weight_packets = self.communicator.gather(
+                weight_packet, root=self.head_rank)
+
+        if self.is_head_rank:
+            mesh = self.global_mesh
+
+            global_weights = numpy.zeros(len(mesh.elements), dtype=numpy.float64)
+            for packet in weight_packets:
+                for el_id, weight in packet.iteritems():
+                    global_weights[el_id] = weight
+
+            from hedge.partition import partition_imbalance, partition_weighted
+            imbalance = partition_imbalance(self.global_partition,
+                    global_weights, len(self.ranks))
+
+            if imbalance < min_imbalance:
+                partition = None
+            else:
+                partition = partition_weighted(mesh, len(self.ranks),
+                        element_weights=global_weights,
+                        face_weights=face_weights)
+        else:
+            partition = None
+
+        partition = self.communicator.bcast(partition, root=self.head_rank)
+        if partition is None:
+            return None
+
+        self.global_partition = partition
+
+        if self.is_head_rank:
+            return self._send_rank_data(self.global_mesh, partition)
+        else:
+            return self.receive_mesh()
+
+    # }}}
+
     def receive_mesh(self):
         return self.communicator.recv(source=self.head_rank, tag=0)
         print "receive end rank", self.rank
@@ -133,6 +241,40 @@ class MPIRunContext(RunContext):
         return self.serial_context.make_linear_combiner(*args, **kwargs)
 
 
+class LoadImbalance(LogQuantity):
+    """Log the amount by which the cost of the most expensive rank exceeds
+    the average cost of a rank, relative to the average.
+
+    :param cost_getter: a callable returning this rank's cost. Defaults to
+      the sum of :meth:`ParallelDiscretization.estimate_element_costs`.
+    """
+
+    def __init__(self, pdiscr, cost_getter=None, name="load_imbalance"):
+        LogQuantity.__init__(self, name, "1",
+                "Relative excess of the maximum over the average rank cost")
+
+        self.pdiscr = pdiscr
+
+        if cost_getter is None:
+            def cost_getter():
+                return numpy.sum(pdiscr.estimate_element_costs())
+
+        self.cost_getter = cost_getter
+
+    @property
+    def default_aggregator(self):
+        return max
+
+    def __call__(self):
+        costs = self.pdiscr.context.communicator.allgather(self.cost_getter())
+
+        mean_cost = sum(costs)/len(costs)
+        if mean_cost == 0:
+            return 0
+
+        return max(costs)/mean_cost - 1
+
+
 # Subtlety here: The vectors for isend and irecv need to stay allocated
 # for as long as the request is not completed. The wrapper aids this
 # by making sure the vector outlives the request by using Boost.Python's
@@ -164,9 +306,8 @@ class MPICompletionFuture(Future):
 
     def is_ready(self):
         if self.request is not None:
-            status = mpi.Status()
-            if self.request.Test(status):
-                self.result = self.finish(status)
+            if self.request.Test():
+                self.result = self.finish(None)
                 self.request = None
                 return True
 
@@ -174,9 +315,8 @@ class MPICompletionFuture(Future):
 
     def __call__(self):
         if self.request is not None:
-            status = mpi.Status()
-            self.request.Wait(status)
-            return self.finish(status)
+            self.request.Wait()
+            return self.finish(None)
         else:
             return self.result
 
@@ -239,6 +379,120 @@ class BoundaryConvertFuture(Future):
                 for idx, name in self.indices_and_names], []
 
 
+def get_flux_exchange_dtype(fields):
+    """Return the dtype in which the (possibly scalar) components of
+    *fields* are exchanged.
+    """
+    if isinstance(fields, numpy.ndarray) and fields.dtype != object:
+        return fields.dtype
+    else:
+        return numpy.result_type(*fields)
+
+
+class FluxExchangeChannel(object):
+    """Persistent MPI requests and fixed pack/receive buffers for exchanging
+    rank boundary data of *component_count* fields of type *dtype* with
+    neighbor *rank*.
+
+    Requests and buffers are set up once, when the operator is compiled, and
+    reused by every execution of the same
+    :class:`hedge.compiler.FluxExchangeBatchAssign`, which avoids posting
+    fresh requests in each right-hand side evaluation. The buffers are
+    transferred as raw bytes, so any *dtype* may be exchanged.
+    """
+
+    def __init__(self, pdiscr, rank, component_count, dtype):
+        self.rank = rank
+        self.send_indices = pdiscr.to_neighbor_indices[rank]
+        self.read_map = pdiscr.from_neighbor_maps[rank]
+
+        self.dtype = numpy.dtype(dtype)
+        shape = (component_count, len(self.send_indices))
+        self.send_buf = numpy.empty(shape, self.dtype)
+        self.recv_buf = numpy.empty(shape, self.dtype)
+
+        comm = pdiscr.context.communicator
+        byte = pdiscr.context.mpi.BYTE
+        self.send_request = comm.Send_init(
+                [self.send_buf, self.send_buf.nbytes, byte], rank, tag=1)
+        self.recv_request = comm.Recv_init(
+                [self.recv_buf, self.recv_buf.nbytes, byte],
+                source=rank, tag=1)
+
+    def pack(self, fields):
+        if isinstance(fields, numpy.ndarray) and fields.dtype != object:
+            numpy.take(fields, self.send_indices, axis=1, out=self.send_buf)
+        else:
+            for field, send_row in zip(fields, self.send_buf):
+                if isinstance(field, numpy.ndarray):
+                    numpy.take(field, self.send_indices, out=send_row)
+                else:
+                    # a scalar, will be broadcast
+                    send_row.fill(field)
+
+    def unpack(self):
+        # Copy out: the received components outlive this exchange, while
+        # the receive buffer is overwritten by the next one.
+        return numpy.take(self.recv_buf, self.read_map, axis=1)
+
+    def start(self, fields, indices_and_names):
+        """Post the receive, pack *fields* and post the send.
+
+        :returns: a list of futures for the send and the receive.
+        """
+        self.recv_request.Start()
+        self.pack(fields)
+        self.send_request.Start()
+
+        return [PersistentSendFuture(self),
+                PersistentReceiveFuture(self, indices_and_names)]
+
+    def free(self):
+        self.send_request.Free()
+        self.recv_request.Free()
+
+
+class PersistentSendFuture(MPICompletionFuture):
+    def __init__(self, channel):
+        MPICompletionFuture.__init__(self, channel.send_request)
+
+    def finish(self, status):
+        return [], []
+
+
+class PersistentReceiveFuture(MPICompletionFuture):
+    def __init__(self, channel, indices_and_names):
+        self.channel = channel
+        self.indices_and_names = indices_and_names
+        MPICompletionFuture.__init__(self, channel.recv_request)
+
+    def finish(self, status):
+        received = self.channel.unpack()
+        return [(name, received[idx])
+                for idx, name in self.indices_and_names], []
+
+
+class ReductionCompletionFuture(MPICompletionFuture):
+    """Completes a nonblocking vector allreduce combining several scalar
+    reductions. *names_and_signs* gives, for each entry of *values*, the
+    variable receiving the result and a sign by which it is multiplied.
+    (Minima are evaluated as negated maxima.)
+    """
+
+    def __init__(self, comm, names_and_signs, values, op):
+        self.names_and_signs = names_and_signs
+        self.send_buf = numpy.array(values)
+        self.recv_buf = numpy.empty_like(self.send_buf)
+
+        MPICompletionFuture.__init__(self,
+                comm.Iallreduce(self.send_buf, self.recv_buf, op=op))
+
+    def finish(self, status):
+        return [(name, sign*value)
+                for (name, sign), value in zip(
+                    self.names_and_signs, self.recv_buf)], []
+
+
 def make_custom_exec_mapper_class(superclass):
     class ExecutionMapper(superclass):
         def __init__(self, context, executor):
@@ -256,6 +510,25 @@ def make_custom_exec_mapper_class(superclass):
             if self.discr.instrumented:
                 pdiscr.comm_flux_counter.add(
                         len(pdiscr.neighbor_ranks)*len(arg_fields))
+
+            if self.discr.compute_kind == "numpy":
+                # components of a FieldBlock are packed in one pass
+                from hedge.tools.field_block import get_field_block_view
+                block = get_field_block_view(arg_fields)
+                if block is not None:
+                    arg_fields = block
+
+                dtype = get_flux_exchange_dtype(arg_fields)
+
+                futures = []
+                for rank in pdiscr.neighbor_ranks:
+                    channel = pdiscr.get_flux_exchange_channel(
+                            insn, rank, len(arg_fields), dtype)
+                    futures.extend(channel.start(arg_fields,
+                        insn.rank_to_index_and_name[rank]))
+
+                return [], futures
+
             return ([],
                     [BoundarizeSendFuture(pdiscr, rank, arg_fields)
                         for rank in pdiscr.neighbor_ranks]
@@ -263,20 +536,80 @@ def make_custom_exec_mapper_class(superclass):
                         insn.rank_to_index_and_name[rank])
                         for rank in pdiscr.neighbor_ranks])
 
+        def wait_for_future(self, future):
+            if self.discr.instrumented:
+                sub_timer = self.discr.parallel_discr.comm_wait_timer \
+                        .start_sub_timer()
+                result = future()
+                sub_timer.stop().submit()
+                return result
+            else:
+                return future()
+
+        def exec_reduction_batch_assign(self, insn):
+            from hedge.optemplate.operators import NodalSum, NodalMin
+
+            # group all reductions into one sum and one max allreduce
+            by_mpi_op = {}
+            for name, op, field in zip(
+                    insn.names, insn.operators, insn.fields):
+                local_value = getattr(superclass, op.mapper_method)(
+                        self, op, field)
+
+                if isinstance(op, NodalSum):
+                    mpi_op_name, sign = "SUM", 1
+                elif isinstance(op, NodalMin):
+                    mpi_op_name, sign = "MAX", -1
+                else:
+                    mpi_op_name, sign = "MAX", 1
+
+                names_and_signs, values = by_mpi_op.setdefault(
+                        mpi_op_name, ([], []))
+                names_and_signs.append((name, sign))
+                values.append(sign*local_value)
+
+            rcon = self.discr.parallel_discr.context
+            comm = rcon.communicator
+
+            if not hasattr(comm, "Iallreduce"):
+                # MPI-2 implementation: no nonblocking collectives
+                assignments = []
+                for mpi_op_name, (names_and_signs, values) \
+                        in by_mpi_op.iteritems():
+                    send_buf = numpy.array(values)
+                    recv_buf = numpy.empty_like(send_buf)
+                    comm.Allreduce(send_buf, recv_buf,
+                            op=getattr(rcon.mpi, mpi_op_name))
+                    assignments.extend(
+                            (name, sign*value)
+                            for (name, sign), value in zip(
+                                names_and_signs, recv_buf))
+                return assignments, []
+
+            return [], [
+                    ReductionCompletionFuture(
+                        comm, names_and_signs, values,
+                        getattr(rcon.mpi, mpi_op_name))
+                    for mpi_op_name, (names_and_signs, values)
+                    in by_mpi_op.iteritems()]
+
         def map_nodal_sum(self, op, field_expr):
-            return self.discr.parallel_discr.context.communicator.allreduce(
+            rcon = self.discr.parallel_discr.context
+            return rcon.communicator.allreduce(
                     superclass.map_nodal_sum(self, op, field_expr),
-                    op=mpi.SUM)
+                    op=rcon.mpi.SUM)
 
         def map_nodal_max(self, op, field_expr):
-            return self.discr.parallel_discr.context.communicator.allreduce(
+            rcon = self.discr.parallel_discr.context
+            return rcon.communicator.allreduce(
                     superclass.map_nodal_max(self, op, field_expr),
-                    op=mpi.MAX)
+                    op=rcon.mpi.MAX)
 
         def map_nodal_min(self, op, field_expr):
-            return self.discr.parallel_discr.context.communicator.allreduce(
+            rcon = self.discr.parallel_discr.context
+            return rcon.communicator.allreduce(
                     superclass.map_nodal_min(self, op, field_expr),
-                    op=mpi.MIN)
+                    op=rcon.mpi.MIN)
 
     return ExecutionMapper
 
@@ -381,18 +714,56 @@ class ParallelDiscretization(hedge.discretization.TimestepCalculator):
         self._setup_neighbor_connections()
 
         self.mpi_scalar_type = {
-                numpy.float64: mpi.DOUBLE,
-                numpy.float32: mpi.FLOAT,
+                numpy.float64: rcon.mpi.DOUBLE,
+                numpy.float32: rcon.mpi.FLOAT,
                 }[self.default_scalar_type]
 
-    def add_instrumentation(self, mgr):
+    def add_instrumentation(self, mgr, log_load_imbalance=False):
+        """
+        :param log_load_imbalance: If *True*, also log
+          :class:`LoadImbalance`. This costs an allgather and an estimate
+          of all element costs every time the log manager ticks.
+        """
         self.subdiscr.add_instrumentation(mgr)
 
         from pytools.log import EventCounter
         self.comm_flux_counter = EventCounter("n_comm_flux",
                 "Number of inner flux communication runs")
 
+        self.comm_wait_timer = self.context.make_timer("t_comm_wait",
+                "Time spent waiting for communication to complete")
+
         mgr.add_quantity(self.comm_flux_counter)
+        mgr.add_quantity(self.comm_wait_timer)
+        if log_load_imbalance:
+            mgr.add_quantity(LoadImbalance(self))
+
+    def close(self):
+        for channel in self.flux_exchange_channels.itervalues():
+            channel.free()
+        self.flux_exchange_channels.clear()
+
+        self.subdiscr.close()
+
+    def estimate_element_costs(self, element_cost_factors=None):
+        """Return an array of estimated costs of this rank's elements,
+        indexed by local element id.
+
+        If this discretization is instrumented, the cost model is derived
+        from measured kernel times using
+        :meth:`hedge.partition.ElementCostModel.from_instrumentation`.
+
+        :param element_cost_factors: *None* or an array of per-element cost
+          multipliers, see :class:`hedge.partition.ElementCostModel`.
+        """
+        from hedge.partition import ElementCostModel
+        if self.subdiscr.instrumented:
+            cost_model = ElementCostModel.from_instrumentation(self.subdiscr)
+        else:
+            cost_model = ElementCostModel()
+
+        return cost_model.element_weights(self.subdiscr.mesh,
+                element_cost_factors)
 
     # property forwards -------------------------------------------------------
     def __len__(self):
@@ -408,6 +779,7 @@ class ParallelDiscretization(hedge.discretization.TimestepCalculator):
 
     def _setup_neighbor_connections(self):
         comm = self.context.communicator
+        mpi = self.context.mpi
 
         # Why is this barrier needed? Some of our ranks may arrive at this
         # point early and start sending packets to ranks that are still stuck
@@ -421,6 +793,8 @@ class ParallelDiscretization(hedge.discretization.TimestepCalculator):
         # Parallel programming is fun.
         comm.Barrier()
 
+        self.flux_exchange_channels = {}
+
         if self.neighbor_ranks:
             # send interface information to neighboring ranks -----------------
             from pytools import reverse_dictionary
@@ -477,6 +851,7 @@ class ParallelDiscretization(hedge.discretization.TimestepCalculator):
             # nb_ stands for neighbor_
 
             self.from_neighbor_maps = {}
+            self.to_neighbor_indices = {}
 
             for rank, (nb_all_facevertices_global, nb_node_coords, nb_h_values) in \
                     received_packets.iteritems():
@@ -603,27 +978,65 @@ class ParallelDiscretization(hedge.discretization.TimestepCalculator):
                 self.from_neighbor_maps[rank] = \
                         self.subdiscr.prepare_from_neighbor_map(from_indices)
 
+                # volume indices of the nodes we send, in sending order
+                self.to_neighbor_indices[rank] = numpy.asarray(
+                        rank_discr_boundary.vol_indices, dtype=numpy.intp)
+
+    def _setup_flux_exchange_channels(self, code):
+        """Set up the :class:`FluxExchangeChannel` instances for all flux
+        exchange instructions in *code*, for exchanging data of
+        :attr:`default_scalar_type`.
+        """
+        from hedge.compiler import FluxExchangeBatchAssign
+        for insn in code.instructions:
+            if isinstance(insn, FluxExchangeBatchAssign):
+                for rank in self.neighbor_ranks:
+                    self.get_flux_exchange_channel(insn, rank,
+                            len(insn.arg_fields), self.default_scalar_type)
+
+    def get_flux_exchange_channel(self, insn, rank, component_count, dtype):
+        """Return the :class:`FluxExchangeChannel` used by the flux exchange
+        instruction *insn* to talk to *rank* in *dtype*.
+
+        Channels for :attr:`default_scalar_type` are set up by
+        :meth:`compile`. Channels for other dtypes are set up when they
+        are first needed, which happens consistently on all ranks because
+        all ranks execute the same instructions on the same types.
+        """
+        key = insn, rank, numpy.dtype(dtype)
+        try:
+            return self.flux_exchange_channels[key]
+        except KeyError:
+            channel = self.flux_exchange_channels[key] = \
+                    FluxExchangeChannel(self, rank, component_count, dtype)
+            return channel
+
     # }}}
 
     # dt estimation -----------------------------------------------------------
     def dt_non_geometric_factor(self):
         return self.context.communicator.allreduce(
                 self.subdiscr.dt_non_geometric_factor(),
-                op=mpi.MIN)
+                op=self.context.mpi.MIN)
 
     def dt_geometric_factor(self):
         return self.context.communicator.allreduce(
                 self.subdiscr.dt_geometric_factor(),
-                op=mpi.MIN)
+                op=self.context.mpi.MIN)
 
     # compilation -------------------------------------------------------------
     def compile(self, optemplate, post_bind_mapper=lambda x: x, type_hints={}):
         fci = FluxCommunicationInserter(self.neighbor_ranks)
-        return self.subdiscr.compile(
+        ex = self.subdiscr.compile(
                 optemplate,
                 post_bind_mapper=lambda x: fci(post_bind_mapper(x)),
                 type_hints=type_hints)
 
+        if self.compute_kind == "numpy":
+            self._setup_flux_exchange_channels(ex.code)
+
+        return ex
+
 
 def reassemble_volume_field(rcon, global_discr, local_discr, field):
     from pytools import reverse_dictionary
@@ -652,3 +1065,52 @@ def reassemble_volume_field(rcon, global_discr, local_discr, field):
         return result
     else:
         return None
+
+
+def migrate_volume_field(rcon, old_discr, new_discr, field):
+    """Move the volume field *field* on *old_discr* to *new_discr*, where
+    *new_discr* was built from a :class:`RankData` returned by
+    :meth:`MPIRunContext.repartition`. Must be called on all ranks at once.
+    """
+    from hedge.tools import log_shape
+    ls = log_shape(field)
+
+    from pytools import reverse_dictionary
+    old_local2global_elements = reverse_dictionary(
+            old_discr.global2local_elements)
+
+    # the new owner of each element
+    partition = rcon.global_partition
+
+    send_packets = [{} for rank in rcon.ranks]
+    for eg in old_discr.element_groups:
+        for el, eslice in zip(eg.members, eg.ranges):
+            global_el_id = old_local2global_elements[el.id]
+            if ls != ():
+                el_data = [field[i][eslice] for i in numpy.ndindex(*ls)]
+            else:
+                el_data = field[eslice]
+
+            send_packets[partition[global_el_id]][global_el_id] = el_data
+
+    recv_packets = rcon.communicator.alltoall(send_packets)
+
+    if ls != ():
+        result = numpy.zeros(ls, dtype=object)
+        for i in numpy.ndindex(*ls):
+            result[i] = new_discr.volume_empty(dtype=field[i].dtype)
+    else:
+        result = new_discr.volume_empty(dtype=field.dtype)
+
+    for packet in recv_packets:
+        for global_el_id, el_data in packet.iteritems():
+            eslice = new_discr.find_el_range(
+                    new_discr.global2local_elements[global_el_id])
+
+            if ls != ():
+                for i, el_comp_data in zip(numpy.ndindex(*ls), el_data):
+                    result[i][eslice] = el_comp_data
+            else:
+                result[eslice] = el_data
+
+    return result
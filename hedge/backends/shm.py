@@ -0,0 +1,549 @@
+"""Single-node multiprocess parallelism through shared memory, without MPI.
+
+Each rank runs in its own worker process. Objects are passed between
+ranks through :class:`multiprocessing.Queue` instances, while rank boundary
+data for flux exchange travels through memory-mapped shared buffers. The
+communicator mimics the subset of the :mod:`mpi4py` interface used by
+:mod:`hedge.backends.mpi`, so that the distributed discretization code
+(and its futures) are reused unchanged. Usage::
+
+    def main(rcon):
+        if rcon.is_head_rank:
+            mesh_data = rcon.distribute_mesh(mesh)
+        else:
+            mesh_data = rcon.receive_mesh()
+
+        discr = rcon.make_discretization(mesh_data, order=4)
+        # ...
+
+    from hedge.backends.shm import run_with_shared_memory_ranks
+    run_with_shared_memory_ranks(4, main)
+"""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import numpy
+from hedge.backends.mpi import MPIRunContext
+
+
+# {{{ MPI-compatible constants
+
+ANY_SOURCE = -1
+ANY_TAG = -1
+
+# tag for messages internal to collective operations, never matched by ANY_TAG
+_COLLECTIVE_TAG = -2
+
+# Data types are only used to describe buffers. Buffers here carry their
+# own dtype, so these are merely placeholders.
+DOUBLE = "double"
+FLOAT = "float"
+BYTE = "byte"
+
+
+class Op(object):
+    """A reduction operation, usable on scalars and on arrays."""
+
+    def __init__(self, name, ufunc):
+        self.name = name
+        self.ufunc = ufunc
+
+    def __call__(self, a, b):
+        return self.ufunc(a, b)
+
+    def __repr__(self):
+        return "Op(%s)" % self.name
+
+
+SUM = Op("SUM", numpy.add)
+PROD = Op("PROD", numpy.multiply)
+MAX = Op("MAX", numpy.maximum)
+MIN = Op("MIN", numpy.minimum)
+
+
+class Status(object):
+    def __init__(self):
+        self.source = None
+        self.tag = None
+
+    def Get_source(self):
+        return self.source
+
+    def Get_tag(self):
+        return self.tag
+
+# }}}
+
+
+# {{{ requests
+
+class Request(object):
+    def Test(self, status=None):
+        raise NotImplementedError
+
+    def Wait(self, status=None):
+        from time import sleep
+        while not self.Test(status):
+            sleep(0)
+
+    def Free(self):
+        pass
+
+    @staticmethod
+    def Waitall(requests):
+        for req in requests:
+            req.Wait()
+
+
+class CompletedRequest(Request):
+    def Test(self, status=None):
+        return True
+
+
+class ReceiveRequest(Request):
+    def __init__(self, comm, buf, source, tag):
+        self.comm = comm
+        self.buf = buf
+        self.source = source
+        self.tag = tag
+
+    def Test(self, status=None):
+        found, data = self.comm._try_recv(self.source, self.tag, status)
+        if found:
+            self.buf[...] = data
+        return found
+
+
+class PersistentSendRequest(Request):
+    """Sends through a :class:`SharedBuffer`. Copying the data into the
+    buffer is deferred until the receiver has consumed the previous message,
+    which, as in MPI, forbids modifying the send buffer before completion.
+    """
+
+    def __init__(self, shared_buf, buf):
+        self.shared_buf = shared_buf
+        self.buf = buf
+        self.active = False
+
+    def Start(self):
+        self.active = True
+        self.Test()
+
+    def Test(self, status=None):
+        if self.active and self.shared_buf.try_write(self.buf):
+            self.active = False
+
+        return not self.active
+
+    def Free(self):
+        self.shared_buf.close()
+
+
+class PersistentReceiveRequest(Request):
+    def __init__(self, shared_buf, buf):
+        self.shared_buf = shared_buf
+        self.buf = buf
+        self.active = False
+
+    def Start(self):
+        self.active = True
+
+    def Test(self, status=None):
+        if self.active and self.shared_buf.try_read(self.buf):
+            self.active = False
+
+        return not self.active
+
+    def Free(self):
+        self.shared_buf.close()
+
+# }}}
+
+
+# {{{ shared buffers
+
+class SharedBuffer(object):
+    """A single-slot, single-producer, single-consumer message buffer in a
+    memory-mapped file shared between two processes.
+
+    The file starts with two :class:`numpy.int64` counters, the number of
+    messages written and the number of messages read, followed by the
+    message data. A message may be written once the previous one has been
+    read.
+
+    The counters are only accessed while holding *lock*, a
+    :class:`multiprocessing.Lock` shared by the two processes. Acquiring
+    and releasing it orders the memory accesses of both sides, so that a
+    reader that sees an incremented write counter also sees the message
+    data written before it, and vice versa for the writer.
+    """
+
+    HEADER_SIZE = 16
+
+    def __init__(self, path, nbytes, lock):
+        import mmap
+
+        self.nbytes = nbytes
+        self.lock = lock
+        size = self.HEADER_SIZE + max(nbytes, 1)
+
+        # Whichever side gets here first creates the file, with zeroed
+        # counters. Truncating to the same size again leaves it unchanged.
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        self.counters = numpy.frombuffer(self.mmap, dtype=numpy.int64, count=2)
+        self.data = numpy.frombuffer(self.mmap, dtype=numpy.uint8,
+                count=nbytes, offset=self.HEADER_SIZE)
+
+    def _get_counters(self):
+        self.lock.acquire()
+        try:
+            return tuple(self.counters)
+        finally:
+            self.lock.release()
+
+    def _increment_counter(self, which):
+        self.lock.acquire()
+        try:
+            self.counters[which] += 1
+        finally:
+            self.lock.release()
+
+    def try_write(self, buf):
+        written, read = self._get_counters()
+        if written != read:
+            return False
+
+        self.data[:] = buf.reshape(-1).view(numpy.uint8)
+        self._increment_counter(0)
+        return True
+
+    def try_read(self, buf):
+        written, read = self._get_counters()
+        if written == read:
+            return False
+
+        buf.reshape(-1).view(numpy.uint8)[:] = self.data
+        self._increment_counter(1)
+        return True
+
+    def close(self):
+        del self.counters
+        del self.data
+        self.mmap.close()
+
+
+def _get_buffer(buf_spec):
+    """Strip an mpi4py-style ``[buffer, datatype]`` specification."""
+    if isinstance(buf_spec, (list, tuple)):
+        return buf_spec[0]
+    else:
+        return buf_spec
+
+# }}}
+
+
+# {{{ communicator
+
+class SharedMemoryCommunicator(object):
+    """An MPI-like communicator among the worker processes started by
+    :func:`run_with_shared_memory_ranks`.
+
+    :param inboxes: a list of :class:`multiprocessing.Queue` instances,
+      one per rank, into which messages for that rank are put.
+    :param buffer_dir: a directory (ideally memory-backed) in which
+      :class:`SharedBuffer` files are created.
+    :param buffer_locks: a dictionary mapping pairs ``(source, dest)`` of
+      ranks to the :class:`multiprocessing.Lock` guarding the
+      :class:`SharedBuffer` instances from *source* to *dest*.
+    """
+
+    def __init__(self, rank, size, inboxes, buffer_dir, buffer_locks):
+        self.rank = rank
+        self.size = size
+        self.inboxes = inboxes
+        self.buffer_dir = buffer_dir
+        self.buffer_locks = buffer_locks
+
+        # messages received, but not yet matched
+        self.pending = []
+
+        self.shared_buffer_counts = {}
+
+    def Get_rank(self):
+        return self.rank
+
+    def Get_size(self):
+        return self.size
+
+    # {{{ point-to-point, generic objects
+
+    def send(self, obj, dest, tag=0):
+        self.inboxes[dest].put((self.rank, tag, obj))
+
+    def isend(self, obj, dest, tag=0):
+        self.send(obj, dest, tag)
+        return CompletedRequest()
+
+    @staticmethod
+    def _matches(msg_source, msg_tag, source, tag):
+        return ((source == ANY_SOURCE or source == msg_source)
+                and (tag == msg_tag
+                    or (tag == ANY_TAG and msg_tag != _COLLECTIVE_TAG)))
+
+    def _try_recv(self, source, tag, status=None, block=False):
+        for i, (msg_source, msg_tag, obj) in enumerate(self.pending):
+            if self._matches(msg_source, msg_tag, source, tag):
+                del self.pending[i]
+                break
+        else:
+            from Queue import Empty
+
+            while True:
+                try:
+                    msg_source, msg_tag, obj = \
+                            self.inboxes[self.rank].get(block)
+                except Empty:
+                    return False, None
+
+                if self._matches(msg_source, msg_tag, source, tag):
+                    break
+                else:
+                    self.pending.append((msg_source, msg_tag, obj))
+
+        if status is not None:
+            status.source = msg_source
+            status.tag = msg_tag
+
+        return True, obj
+
+    def recv(self, source=ANY_SOURCE, tag=ANY_TAG, status=None):
+        found, obj = self._try_recv(source, tag, status, block=True)
+        assert found
+        return obj
+
+    # }}}
+
+    # {{{ point-to-point, buffers
+
+    def Isend(self, buf_spec, dest, tag=0):
+        self.send(_get_buffer(buf_spec).copy(), dest, tag)
+        return CompletedRequest()
+
+    def Irecv(self, buf_spec, source=ANY_SOURCE, tag=ANY_TAG):
+        return ReceiveRequest(self, _get_buffer(buf_spec), source, tag)
+
+    def _get_shared_buffer(self, source, dest, tag, nbytes):
+        # The n-th persistent send from *source* to *dest* with a given tag
+        # and size is paired with the n-th matching persistent receive.
+        key = (source, dest, tag, nbytes)
+        seq = self.shared_buffer_counts.get(key, 0)
+        self.shared_buffer_counts[key] = seq + 1
+
+        return SharedBuffer(
+                os.path.join(self.buffer_dir,
+                    "%d-%d-%d-%d-%d" % (key + (seq,))),
+                nbytes, self.buffer_locks[source, dest])
+
+    def Send_init(self, buf_spec, dest, tag=0):
+        buf = _get_buffer(buf_spec)
+        return PersistentSendRequest(
+                self._get_shared_buffer(self.rank, dest, tag, buf.nbytes),
+                buf)
+
+    def Recv_init(self, buf_spec, source, tag=0):
+        buf = _get_buffer(buf_spec)
+        return PersistentReceiveRequest(
+                self._get_shared_buffer(source, self.rank, tag, buf.nbytes),
+                buf)
+
+    # }}}
+
+    # {{{ collectives
+
+    def bcast(self, obj=None, root=0):
+        if self.rank == root:
+            for rank in xrange(self.size):
+                if rank != root:
+                    self.send(obj, rank, _COLLECTIVE_TAG)
+            return obj
+        else:
+            return self.recv(root, _COLLECTIVE_TAG)
+
+    def gather(self, obj, root=0):
+        if self.rank == root:
+            return [obj if rank == root
+                    else self.recv(rank, _COLLECTIVE_TAG)
+                    for rank in xrange(self.size)]
+        else:
+            self.send(obj, root, _COLLECTIVE_TAG)
+            return None
+
+    def allgather(self, obj):
+        return self.bcast(self.gather(obj, root=0), root=0)
+
+    def reduce(self, obj, op=SUM, root=0):
+        objs = self.gather(obj, root)
+        if self.rank == root:
+            return reduce(op, objs)
+        else:
+            return None
+
+    def allreduce(self, obj, op=SUM):
+        return self.bcast(self.reduce(obj, op, root=0), root=0)
+
+    def alltoall(self, objs):
+        for rank, obj in enumerate(objs):
+            if rank != self.rank:
+                self.send(obj, rank, _COLLECTIVE_TAG)
+
+        return [objs[rank] if rank == self.rank
+                else self.recv(rank, _COLLECTIVE_TAG)
+                for rank in xrange(self.size)]
+
+    def Allreduce(self, sendbuf, recvbuf, op=SUM):
+        recvbuf[...] = self.allreduce(_get_buffer(sendbuf).copy(), op)
+
+    def Barrier(self):
+        self.allgather(None)
+
+    # }}}
+
+# }}}
+
+
+# {{{ run context
+
+class SharedMemoryRunContext(MPIRunContext):
+    """A run context for one worker process started by
+    :func:`run_with_shared_memory_ranks`. Behaves like
+    :class:`hedge.backends.mpi.MPIRunContext`.
+    """
+
+    def __init__(self, communicator, serial_context):
+        import hedge.backends.shm as shm_module
+        MPIRunContext.__init__(self, communicator, serial_context,
+                mpi_module=shm_module)
+
+
+_worker_run_context = None
+
+
+def get_worker_run_context():
+    """Return the :class:`SharedMemoryRunContext` of the current worker
+    process, or *None* outside of workers started by
+    :func:`run_with_shared_memory_ranks`.
+    """
+    return _worker_run_context
+
+
+def _run_rank(rank, size, inboxes, buffer_dir, buffer_locks, main, args):
+    from hedge.backends import CPURunContext
+    rcon = SharedMemoryRunContext(
+            SharedMemoryCommunicator(rank, size, inboxes, buffer_dir,
+                buffer_locks),
+            CPURunContext())
+
+    global _worker_run_context
+    _worker_run_context = rcon
+
+    main(rcon, *args)
+
+
+def run_with_shared_memory_ranks(rank_count, main, args=(),
+        poll_interval=0.1):
+    """Start *rank_count* worker processes, each of which calls
+    ``main(rcon, *args)`` with a :class:`SharedMemoryRunContext` *rcon*.
+    Return once all workers have finished.
+
+    Within the workers, :func:`hedge.backends.guess_run_context` also
+    returns *rcon* if the ``shm`` feature is allowed.
+
+    :arg poll_interval: how often, in seconds, to check for failed workers.
+    :raises RuntimeError: if any worker exits with an error. The remaining
+      workers are terminated first, since they might otherwise wait
+      forever for messages from the failed one.
+    """
+    import multiprocessing
+    import tempfile
+    import shutil
+
+    if os.path.isdir("/dev/shm"):
+        buffer_dir = tempfile.mkdtemp(prefix="hedge-shm-", dir="/dev/shm")
+    else:
+        buffer_dir = tempfile.mkdtemp(prefix="hedge-shm-")
+
+    processes = []
+    try:
+        inboxes = [multiprocessing.Queue() for rank in range(rank_count)]
+
+        # Locks must exist before the workers are started to be shared
+        # with them.
+        buffer_locks = dict(
+                ((source, dest), multiprocessing.Lock())
+                for source in range(rank_count)
+                for dest in range(rank_count))
+
+        processes = [
+                multiprocessing.Process(target=_run_rank,
+                    args=(rank, rank_count, inboxes, buffer_dir,
+                        buffer_locks, main, args))
+                for rank in range(rank_count)]
+
+        for proc in processes:
+            proc.start()
+
+        while True:
+            failed_ranks = [rank for rank, proc in enumerate(processes)
+                    if proc.exitcode not in [None, 0]]
+            running = [proc for proc in processes if proc.exitcode is None]
+            if failed_ranks or not running:
+                break
+
+            running[0].join(poll_interval)
+
+        if failed_ranks:
+            raise RuntimeError("shared-memory ranks %s failed"
+                    % ", ".join(str(rank) for rank in failed_ranks))
+    finally:
+        for proc in processes:
+            if proc.is_alive():
+                proc.terminate()
+            if proc.pid is not None:
+                proc.join()
+
+        shutil.rmtree(buffer_dir, ignore_errors=True)
+
+# }}}
+
+
+# vim: foldmethod=marker
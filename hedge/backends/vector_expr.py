@@ -190,7 +190,16 @@ class CompiledVectorExpressionBase(object):
         return [rvei.name for rvei in self.result_vec_expr_info_list]
 
     @memoize_method
-    def get_kernel(self, vector_dtypes, scalar_dtypes):
+    def get_kernel(self, vector_dtypes, scalar_dtypes, ensemble_layout=None):
+        """:param ensemble_layout: *None*, or a tuple
+          *(member_count, shared_vectors, member_scalars)* for vectors
+          with a trailing ensemble axis (see
+          :func:`hedge.backends.jit.get_ensemble_size`), where the kernel
+          runs over all nodes and members. *shared_vectors* has a flag for
+          each vector dependency that is the same for all members,
+          *member_scalars* one for each scalar dependency that is passed as
+          an array with one value per member.
+        """
         from pymbolic.mapper.stringifier import PREC_NONE
         from pymbolic.mapper.c_code import CCodeMapper
 
@@ -220,9 +229,32 @@ class CompiledVectorExpressionBase(object):
 
         code_mapper = CCodeMapper(constant_mapper=real_const_mapper)
 
+        if ensemble_layout is not None:
+            member_count, shared_vectors, member_scalars = ensemble_layout
+        else:
+            shared_vectors = member_scalars = ()
+
+        import re
+        index_subst = [
+                (re.compile(r"\b%s\[i\]" % name), "%s[hedge_node]" % name)
+                for name, shared in zip(self.vector_dep_names, shared_vectors)
+                if shared]+[
+                (re.compile(r"\b%s\b" % name), "%s[hedge_member]" % name)
+                for name, per_member in zip(
+                    self.scalar_dep_names, member_scalars)
+                if per_member]
+
         code_lines = []
+        if ensemble_layout is not None:
+            code_lines.extend([
+                "const long hedge_node = i / %d;" % member_count,
+                "const long hedge_member = i %% %d;" % member_count,
+                ])
+
         for vei in self.vec_expr_info_list:
             expr_code = code_mapper(vei.expr, PREC_NONE)
+            for regex, replacement in index_subst:
+                expr_code = regex.sub(replacement, expr_code)
             if vei.do_not_return:
                 from cgen import dtype_to_ctype
                 code_lines.append(
@@ -239,8 +271,11 @@ class CompiledVectorExpressionBase(object):
                 elwise.VectorArg(dtype, name)
                 for dtype, name in zip(vector_dtypes, self.vector_dep_names))
         args.extend(
-                elwise.ScalarArg(dtype, name)
-                for dtype, name in zip(scalar_dtypes, self.scalar_dep_names))
+                elwise.VectorArg(dtype, name) if per_member
+                else elwise.ScalarArg(dtype, name)
+                for dtype, name, per_member in zip(
+                    scalar_dtypes, self.scalar_dep_names,
+                    member_scalars or [False]*len(scalar_dtypes)))
 
         return KernelRecord(
                 kernel=self.make_kernel_internal(args, "\n".join(code_lines)),
@@ -145,6 +145,18 @@ class FluxBatchAssign(Instruction):
     :ivar repr_op: The `repr_op` on which all operators agree.
     """
 
+    @property
+    def priority(self):
+        # Fluxes on rank boundaries are computed as late as possible, so
+        # that the data exchange started by a FluxExchangeBatchAssign has
+        # time to complete while volume and interior flux work is done.
+        from hedge.mesh import TAG_RANK_BOUNDARY
+        if isinstance(getattr(self.repr_op, "boundary_tag", None),
+                TAG_RANK_BOUNDARY):
+            return -1
+        else:
+            return 0
+
     def get_assignees(self):
         return set(self.names)
 
@@ -263,6 +275,45 @@ class FluxExchangeBatchAssign(Instruction):
     def get_executor_method(self, executor):
         return executor.exec_flux_exchange_batch_assign
 
+
+class ReductionBatchAssign(Instruction):
+    """Evaluate several global nodal reductions at once.
+
+    :ivar names:
+    :ivar operators: a list of
+        :class:`hedge.optemplate.operators.NodalReductionOperator` instances.
+    :ivar fields:
+
+    Executors may return the results of this instruction as futures,
+    so that global communication may overlap with other work.
+    """
+
+    priority = 1
+
+    def get_assignees(self):
+        return set(self.names)
+
+    @memoize_method
+    def get_dependencies(self):
+        dep_mapper = self.dep_mapper_factory()
+        result = set()
+        for fld in self.fields:
+            result |= dep_mapper(fld)
+        return result
+
+    def __str__(self):
+        lines = []
+
+        lines.append("{")
+        for n, op, fld in zip(self.names, self.operators, self.fields):
+            lines.append("  %s <- %s(%s)" % (n, op, fld))
+        lines.append("}")
+
+        return "\n".join(lines)
+
+    def get_executor_method(self, executor):
+        return executor.exec_reduction_batch_assign
+
 # }}}
 
 
@@ -421,7 +472,11 @@ class Code(object):
 
                     insn = self.EvaluateFuture(future.id)
 
-                    assignments, new_futures = future()
+                    if force_future:
+                        assignments, new_futures = \
+                                exec_mapper.wait_for_future(future)
+                    else:
+                        assignments, new_futures = future()
                     force_future = False
                     break
                 else:
@@ -510,7 +565,10 @@ class Code(object):
                 future = id_to_future.pop(insn.future_id)
                 if not future.is_ready():
                     schedule_is_delay_free = False
-                assignments, new_futures = future()
+                    assignments, new_futures = \
+                            exec_mapper.wait_for_future(future)
+                else:
+                    assignments, new_futures = future()
                 del future
             else:
                 assignments, new_futures = \
@@ -591,6 +649,11 @@ class OperatorCompilerBase(IdentityMapper):
         from hedge.optemplate.mappers import FluxExchangeCollector
         return FluxExchangeCollector()(expr)
 
+    def collect_reduction_ops(self, expr):
+        from hedge.optemplate.operators import NodalReductionOperator
+        from hedge.optemplate.mappers import BoundOperatorCollector
+        return BoundOperatorCollector(NodalReductionOperator)(expr)
+
     # }}}
 
     # {{{ top-level driver ----------------------------------------------------
@@ -654,6 +717,31 @@ class OperatorCompilerBase(IdentityMapper):
         # Flux exchange also works better when batched.
         self.flux_exchange_ops = self.collect_flux_exchange_ops(expr)
 
+        # {{{ reduction batching
+        # Global reductions are latency-bound in parallel. Evaluate as many
+        # of them together as their mutual dependencies allow.
+
+        reduction_queue = list(self.collect_reduction_ops(expr))
+        reduction_deps = dict(
+                (red, self.collect_reduction_ops(red.field))
+                for red in reduction_queue)
+
+        self.reduction_batches = []
+        admissible_deps = set()
+        while reduction_queue:
+            present_batch = [red for red in reduction_queue
+                    if reduction_deps[red] <= admissible_deps]
+
+            if not present_batch:
+                raise RuntimeError("cannot resolve reduction evaluation order")
+
+            reduction_queue = [red for red in reduction_queue
+                    if not reduction_deps[red] <= admissible_deps]
+            self.reduction_batches.append(present_batch)
+            admissible_deps |= set(present_batch)
+
+        # }}}
+
         # Finally, walk the expression and build the code.
         result = IdentityMapper.__call__(self, expr)
 
@@ -740,10 +828,13 @@ class OperatorCompilerBase(IdentityMapper):
     def map_operator_binding(self, expr, name_hint=None):
         from hedge.optemplate.operators import (
                 ReferenceDiffOperatorBase,
-                FluxOperatorBase)
+                FluxOperatorBase,
+                NodalReductionOperator)
 
         if isinstance(expr.op, ReferenceDiffOperatorBase):
             return self.map_ref_diff_op_binding(expr)
+        elif isinstance(expr.op, NodalReductionOperator):
+            return self.map_reduction_op_binding(expr)
         elif isinstance(expr.op, FluxOperatorBase):
             raise RuntimeError("OperatorCompiler encountered a flux operator.\n\n"
                     "We are expecting flux operators to be converted to custom "
@@ -824,6 +915,33 @@ class OperatorCompilerBase(IdentityMapper):
 
             return self.expr_to_var[expr]
 
+    def map_reduction_op_binding(self, expr):
+        try:
+            return self.expr_to_var[expr]
+        except KeyError:
+            for batch in self.reduction_batches:
+                if expr in batch:
+                    break
+            else:
+                raise RuntimeError("reduction '%s' not in any reduction batch"
+                        % expr)
+
+            names = [self.get_var_name() for red in batch]
+            self.code.append(
+                    ReductionBatchAssign(
+                        names=names,
+                        operators=[red.op for red in batch],
+                        fields=[
+                            self.assign_to_new_var(self.rec(red.field))
+                            for red in batch],
+                        dep_mapper_factory=self.dep_mapper_factory))
+
+            from pymbolic import var
+            for n, red in zip(names, batch):
+                self.expr_to_var[red] = var(n)
+
+            return self.expr_to_var[expr]
+
     def map_flux_exchange(self, expr):
         try:
             return self.expr_to_var[expr]
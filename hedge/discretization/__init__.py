@@ -1214,6 +1214,74 @@ class Discretization(TimestepCalculator):
             for el in eg.members)
             for eg in self.element_groups)
 
+    @memoize_method
+    def element_dt_factors(self):
+        """Return a tuple *(first_nodes, dt_factors)* of arrays with one
+        entry per element, in the order of :attr:`element_groups`.
+        *first_nodes* holds the index of each element's first node in a
+        volume vector, *dt_factors* the product of the element's
+        non-geometric and geometric timestep factors.
+        """
+        first_nodes = []
+        dt_factors = []
+
+        for eg in self.element_groups:
+            ldis = eg.local_discretization
+            non_geometric_factor = ldis.dt_non_geometric_factor()
+
+            for el, rng in zip(eg.members, eg.ranges):
+                first_nodes.append(rng.start)
+                dt_factors.append(non_geometric_factor
+                        * ldis.dt_geometric_factor(
+                            [self.mesh.points[i] for i in el.vertex_indices],
+                            el))
+
+        return (np.array(first_nodes, dtype=np.intp),
+                np.array(dt_factors, dtype=np.float64))
+
+    @memoize_method
+    def element_neighborhoods(self, distance=1):
+        """Return a list that holds, for each element id, a sorted array of
+        the ids of all elements connected to it by a chain of at most
+        *distance* shared faces, including itself.
+        """
+        adjacency = self.mesh.element_adjacency_graph()
+
+        neighborhoods = []
+        for el in self.mesh.elements:
+            nearby = set([el.id])
+            frontier = [el.id]
+            for i in range(distance):
+                frontier = [nb
+                        for fr_el_id in frontier
+                        for nb in adjacency.get(fr_el_id, ())
+                        if nb not in nearby]
+                nearby.update(frontier)
+
+            neighborhoods.append(np.array(sorted(nearby), dtype=np.intp))
+
+        return neighborhoods
+
+    @memoize_method
+    def element_coloring(self, distance=1):
+        """Return an array that assigns a color (a small nonnegative integer)
+        to each element id, such that any two elements connected by a chain
+        of at most *distance* shared faces have different colors.
+        """
+        neighborhoods = self.element_neighborhoods(distance)
+
+        colors = np.empty(len(self.mesh.elements), dtype=np.intp)
+        colors.fill(-1)
+
+        for el in self.mesh.elements:
+            used_colors = set(colors[neighborhoods[el.id]])
+            color = 0
+            while color in used_colors:
+                color += 1
+            colors[el.id] = color
+
+        return colors
+
     def get_point_evaluator(self, point, use_btree=False, thresh=0):
         def make_point_evaluator(el, eg, rng):
             """For a given element *el*/element group *eg* in which *point*
@@ -101,6 +101,389 @@ class DiagonalPreconditioner(OperatorBase):
 
 
 
+class BlockJacobiPreconditioner(OperatorBase):
+    """Applies the inverses of the element-diagonal blocks of an operator
+    on volume vectors of *discr*.
+
+    :param blocks: a list with one entry per element group of *discr*, each
+      an array of shape *(element_count, node_count, node_count)* holding
+      that group's element-diagonal blocks, as returned by
+      :func:`extract_element_diagonal_blocks`.
+
+    All blocks of a group are inverted at once at construction, so that
+    applying the preconditioner is a single batched matrix-vector product
+    per element group.
+    """
+
+    def __init__(self, discr, blocks):
+        self.discr = discr
+        self.inverse_blocks = [numpy.linalg.inv(group_blocks)
+                for group_blocks in blocks]
+
+    @property
+    def dtype(self):
+        return self.inverse_blocks[0].dtype
+
+    @property
+    def shape(self):
+        n = len(self.discr)
+        return n, n
+
+    def __call__(self, operand):
+        result = numpy.empty_like(operand)
+        for eg, inverse_blocks in zip(
+                self.discr.element_groups, self.inverse_blocks):
+            eg.vol_el_view(result)[:] = numpy.einsum("eij,ej->ei",
+                    inverse_blocks, eg.vol_el_view(operand))
+
+        return result
+
+
+
+
+def extract_element_diagonal_blocks(discr, operator, stencil_distance=2,
+        dtype=None):
+    """Find the element-diagonal blocks of the linear *operator*, which maps
+    volume vectors of *discr* to volume vectors, by applying it to probe
+    vectors.
+
+    :param stencil_distance: the number of shared faces across which
+      *operator* couples elements, e.g. 1 for interior-penalty and 2 for
+      LDG discretizations of second-order operators.
+    :returns: a list of blocks as expected by :class:`BlockJacobiPreconditioner`.
+
+    Each probe is a unit vector in the same local node of every element of
+    one color of :meth:`hedge.discretization.Discretization.element_coloring`,
+    so the number of operator applications is the number of colors times
+    the number of nodes per element.
+
+    The coloring only knows about elements on this rank, so probes on
+    neighboring ranks could pollute the blocks of elements at rank
+    boundaries. This is therefore only available in serial runs.
+    """
+    rcon = discr.run_context
+    comm = getattr(rcon, "communicator", None)
+    if comm is not None and comm.size > 1:
+        raise NotImplementedError("extraction of element-diagonal blocks "
+                "of operators on distributed discretizations")
+
+    if dtype is None:
+        dtype = getattr(operator, "dtype", discr.default_scalar_type)
+
+    colors = discr.element_coloring(stencil_distance)
+    color_count = 0
+    if len(colors):
+        color_count = int(numpy.max(colors)) + 1
+
+    group_colors = [colors[eg.member_nrs] for eg in discr.element_groups]
+    node_counts = [eg.local_discretization.node_count()
+            for eg in discr.element_groups]
+    blocks = [numpy.zeros((len(eg.members), n, n), dtype=dtype)
+            for eg, n in zip(discr.element_groups, node_counts)]
+
+    for color in range(color_count):
+        masks = [eg_colors == color for eg_colors in group_colors]
+
+        for j in range(max(node_counts)):
+            probe = discr.volume_zeros(dtype=dtype)
+            for eg, mask, n in zip(discr.element_groups, masks, node_counts):
+                if j < n:
+                    eg.vol_el_view(probe)[mask, j] = 1
+
+            response = operator(probe)
+
+            for eg, mask, n, group_blocks in zip(
+                    discr.element_groups, masks, node_counts, blocks):
+                if j < n:
+                    group_blocks[mask, :, j] = eg.vol_el_view(response)[mask]
+
+    return blocks
+
+
+
+
+def make_block_jacobi_preconditioner(discr, operator, stencil_distance=2):
+    """Return a :class:`BlockJacobiPreconditioner` for the linear *operator*
+    on volume vectors of *discr*. See :func:`extract_element_diagonal_blocks`
+    for the meaning of *stencil_distance*.
+    """
+    return BlockJacobiPreconditioner(discr,
+            extract_element_diagonal_blocks(discr, operator, stencil_distance))
+
+
+
+
+def assemble_sparse_matrix(discr, operator, stencil_distance=2, dtype=None):
+    """Return the matrix of the linear *operator*, which maps volume vectors
+    of *discr* to volume vectors, as a :class:`scipy.sparse.csr_matrix`,
+    e.g. for factoring it once or for eigenvalue analysis.
+
+    :param stencil_distance: see :func:`extract_element_diagonal_blocks`.
+
+    As in :func:`extract_element_diagonal_blocks`, the matrix is found by
+    applying *operator* to probe vectors that are a unit vector in the same
+    local node of every element of one color. Here, the coloring keeps
+    elements *2*stencil_distance* faces apart, so that no two elements of a
+    color are coupled to the same element, and every entry of a response
+    belongs to a single matrix column. The number of operator applications
+    is thus the number of colors times the number of nodes per element,
+    independent of the number of elements. All entries of the sparsity
+    pattern implied by element adjacency are stored, even if they are zero.
+
+    Couplings to elements on other ranks cannot be captured, so this is
+    only available in serial runs.
+    """
+    rcon = discr.run_context
+    comm = getattr(rcon, "communicator", None)
+    if comm is not None and comm.size > 1:
+        raise NotImplementedError(
+                "sparse assembly of operators on distributed discretizations")
+
+    if dtype is None:
+        dtype = getattr(operator, "dtype", discr.default_scalar_type)
+
+    el_count = len(discr.mesh.elements)
+    el_starts = numpy.empty(el_count, dtype=numpy.intp)
+    el_node_counts = numpy.empty(el_count, dtype=numpy.intp)
+    for eg in discr.element_groups:
+        for el_id, rng in zip(eg.member_nrs, eg.ranges):
+            el_starts[el_id] = rng.start
+        el_node_counts[eg.member_nrs] = \
+                eg.local_discretization.node_count()
+
+    neighborhoods = discr.element_neighborhoods(stencil_distance)
+    colors = discr.element_coloring(2*stencil_distance)
+    color_count = 0
+    if el_count:
+        color_count = int(numpy.max(colors)) + 1
+
+    rows = []
+    columns = []
+    values = []
+    for color in range(color_count):
+        probed = numpy.nonzero(colors == color)[0]
+
+        # the nodes of all elements coupled to each probed element,
+        # and the probed element each of them is coupled to
+        coupled_nodes = []
+        owners = []
+        for el_id in probed:
+            el_nodes = numpy.hstack([
+                numpy.arange(el_starts[nb], el_starts[nb]+el_node_counts[nb])
+                for nb in neighborhoods[el_id]])
+            coupled_nodes.append(el_nodes)
+            owners.append(numpy.repeat(el_id, len(el_nodes)))
+        coupled_nodes = numpy.hstack(coupled_nodes)
+        owners = numpy.hstack(owners)
+
+        for j in range(numpy.max(el_node_counts[probed])):
+            probe = discr.volume_zeros(dtype=dtype)
+            probe[el_starts[probed[el_node_counts[probed] > j]] + j] = 1
+
+            response = operator(probe)
+
+            in_column = el_node_counts[owners] > j
+            rows.append(coupled_nodes[in_column])
+            columns.append(el_starts[owners[in_column]] + j)
+            values.append(response[coupled_nodes[in_column]])
+
+    from scipy.sparse import coo_matrix
+    n = len(discr)
+    if not rows:
+        return coo_matrix((n, n), dtype=dtype).tocsr()
+
+    return coo_matrix(
+            (numpy.hstack(values), (numpy.hstack(rows), numpy.hstack(columns))),
+            shape=(n, n), dtype=dtype).tocsr()
+
+
+
+
+class PMultigridPreconditioner(OperatorBase):
+    """A polynomial multigrid V-cycle for a linear operator on volume
+    vectors.
+
+    :param discrs: a list of discretizations on the same mesh, finest
+      (highest order) first, e.g. of orders *p*, *p/2*, ..., 1.
+    :param operators: the operator rediscretized on each of *discrs*.
+    :param block_jacobi_preconditioners: a
+      :class:`BlockJacobiPreconditioner` for each level. If not given,
+      these are built by :func:`make_block_jacobi_preconditioner` with
+      *stencil_distance*.
+    :param smoother: *"chebyshev"* for Chebyshev-accelerated or
+      *"jacobi"* for damped block-Jacobi smoothing.
+    :param coarse_solver: *"direct"* to factor the coarsest operator,
+      assembled by :func:`assemble_sparse_matrix` with *stencil_distance*,
+      or *"cg"* to solve on the coarsest level by
+      block-Jacobi-preconditioned CG to a tolerance of *coarse_tol*.
+
+    The grid transfers are the :class:`hedge.discretization.Projector`
+    interpolation from each coarse level to the next finer one, and its
+    transpose. With the same number of pre- and post-smoothing steps,
+    the cycle is symmetric, so it may serve as a preconditioner for
+    :func:`parallel_cg`. Like the operators, it is negative definite for
+    negative definite operators, in which case its negative should be used
+    along with theirs.
+
+    The coarse-level solve and the eigenvalue estimates for the Chebyshev
+    smoother only see rank-local data, so this is meant for serial runs.
+    """
+
+    def __init__(self, discrs, operators, block_jacobi_preconditioners=None,
+            stencil_distance=2, smoother="chebyshev", smoothing_steps=2,
+            chebyshev_eigenvalue_ratio=8, jacobi_damping=2/3,
+            coarse_solver="direct", coarse_tol=1e-10):
+        if len(discrs) != len(operators):
+            raise ValueError("need one operator per discretization")
+        if smoother not in ["chebyshev", "jacobi"]:
+            raise ValueError("unknown smoother: %s" % smoother)
+        if coarse_solver not in ["direct", "cg"]:
+            raise ValueError("unknown coarse solver: %s" % coarse_solver)
+
+        self.discrs = discrs
+        self.operators = operators
+
+        if block_jacobi_preconditioners is None:
+            block_jacobi_preconditioners = [
+                    make_block_jacobi_preconditioner(
+                        discr, op, stencil_distance)
+                    for discr, op in zip(discrs, operators)]
+        self.block_jacobi_preconditioners = block_jacobi_preconditioners
+
+        self.smoother = smoother
+        self.smoothing_steps = smoothing_steps
+        self.jacobi_damping = jacobi_damping
+
+        from hedge.discretization import Projector
+        self.prolongation_matrices = []
+        self.restriction_matrices = []
+        for fine_discr, coarse_discr in zip(discrs, discrs[1:]):
+            imats = Projector(coarse_discr, fine_discr).interp_matrices
+            self.prolongation_matrices.append(imats)
+            self.restriction_matrices.append([
+                numpy.asarray(imat.T, order="C") for imat in imats])
+
+        if smoother == "chebyshev":
+            self.chebyshev_intervals = []
+            for discr, op, bj in zip(
+                    discrs[:-1], operators, block_jacobi_preconditioners):
+                max_eigenvalue = 1.1*self._estimate_max_eigenvalue(
+                        discr, op, bj)
+                self.chebyshev_intervals.append(
+                        (max_eigenvalue/chebyshev_eigenvalue_ratio,
+                            max_eigenvalue))
+
+        self.coarse_solver = coarse_solver
+        self.coarse_tol = coarse_tol
+        if coarse_solver == "direct":
+            from scipy.sparse.linalg import factorized
+            self.coarse_factorization = factorized(assemble_sparse_matrix(
+                discrs[-1], operators[-1], stencil_distance,
+                dtype=self.dtype).tocsc())
+
+    @property
+    def dtype(self):
+        return self.block_jacobi_preconditioners[0].dtype
+
+    @property
+    def shape(self):
+        n = len(self.discrs[0])
+        return n, n
+
+    def _estimate_max_eigenvalue(self, discr, operator, block_jacobi,
+            iterations=15):
+        """Estimate the largest eigenvalue of the block-Jacobi-preconditioned
+        *operator* by a power iteration."""
+        v = numpy.random.RandomState(17).uniform(
+                0.5, 1, len(discr)).astype(self.dtype)
+
+        eigenvalue = 0
+        for i in range(iterations):
+            v /= numpy.sqrt(numpy.dot(v, v))
+            w = block_jacobi(operator(v))
+            eigenvalue = numpy.dot(v, w)
+            v = w
+
+        return abs(eigenvalue)
+
+    def _transfer(self, from_discr, to_discr, matrices, vec):
+        from hedge._internal import perform_elwise_operator
+
+        result = to_discr.volume_zeros(kind="numpy", dtype=vec.dtype)
+        for from_eg, to_eg, mat in zip(
+                from_discr.element_groups, to_discr.element_groups, matrices):
+            perform_elwise_operator(
+                    from_eg.ranges, to_eg.ranges, mat, vec, result)
+        return result
+
+    def _smooth(self, level, x, rhs):
+        op = self.operators[level]
+        bj = self.block_jacobi_preconditioners[level]
+
+        if self.smoother == "jacobi":
+            for i in range(self.smoothing_steps):
+                x = x + self.jacobi_damping*bj(rhs - op(x))
+            return x
+
+        # Chebyshev iteration, see Algorithm 12.1 in
+        # Y. Saad, Iterative Methods for Sparse Linear Systems, 2nd ed.
+        min_eigenvalue, max_eigenvalue = self.chebyshev_intervals[level]
+        theta = (max_eigenvalue + min_eigenvalue)/2
+        delta = (max_eigenvalue - min_eigenvalue)/2
+        sigma = theta/delta
+        rho = 1/sigma
+
+        residual = rhs - op(x)
+        d = bj(residual)/theta
+        for k in range(self.smoothing_steps):
+            x = x + d
+            if k + 1 == self.smoothing_steps:
+                break
+
+            residual -= op(d)
+            rho_new = 1/(2*sigma - rho)
+            d = rho_new*rho*d + (2*rho_new/delta)*bj(residual)
+            rho = rho_new
+
+        return x
+
+    def _solve_coarse(self, rhs):
+        if self.coarse_solver == "direct":
+            return self.coarse_factorization(rhs)
+        else:
+            # negated, so that CG sees a positive definite operator
+            # for negative definite ones
+            coarse_op = self.operators[-1]
+            coarse_bj = self.block_jacobi_preconditioners[-1]
+            cg = CGStateContainer(
+                    lambda x: -coarse_op(x), lambda r: -coarse_bj(r))
+            cg.reset(-rhs, self.discrs[-1].volume_zeros(dtype=rhs.dtype))
+            return cg.run(max_iterations=10*len(rhs), tol=self.coarse_tol)
+
+    def _v_cycle(self, level, rhs):
+        if level == len(self.discrs) - 1:
+            return self._solve_coarse(rhs)
+
+        x = self._smooth(level, self.discrs[level].volume_zeros(
+            dtype=rhs.dtype), rhs)
+
+        coarse_rhs = self._transfer(
+                self.discrs[level], self.discrs[level+1],
+                self.restriction_matrices[level],
+                rhs - self.operators[level](x))
+        x = x + self._transfer(
+                self.discrs[level+1], self.discrs[level],
+                self.prolongation_matrices[level],
+                self._v_cycle(level+1, coarse_rhs))
+
+        return self._smooth(level, x, rhs)
+
+    def __call__(self, operand):
+        return self._v_cycle(0, operand)
+
+
+
+
 class ConvergenceError(RuntimeError):
     pass
 
@@ -218,3 +601,730 @@ def parallel_cg(pcon, operator, b, precon=None, x=None, tol=1e-7, max_iterations
         debug = False
 
     return cg.run(max_iterations, tol, debug_callback, debug)
+
+
+
+
+# {{{ reduction-avoiding CG variants
+
+class GlobalSumReduction(object):
+    """Sums arrays of rank-local partial results over all ranks of the
+    run context *pcon*, several values per (nonblocking, if possible)
+    allreduce.
+    """
+
+    def __init__(self, pcon):
+        comm = getattr(pcon, "communicator", None)
+        if comm is not None and comm.size > 1:
+            self.communicator = comm
+            self.mpi = pcon.mpi
+        else:
+            self.communicator = None
+
+    def start(self, values):
+        """Start summing the array *values* across ranks and return a
+        function that waits for and returns the result.
+        """
+        values = numpy.asarray(values)
+        if self.communicator is None:
+            return lambda: values
+
+        result = numpy.empty_like(values)
+        if hasattr(self.communicator, "Iallreduce"):
+            request = self.communicator.Iallreduce(
+                    values, result, op=self.mpi.SUM)
+
+            def wait():
+                request.Wait()
+                return result
+        else:
+            self.communicator.Allreduce(values, result, op=self.mpi.SUM)
+
+            def wait():
+                return result
+
+        return wait
+
+    def __call__(self, values):
+        return self.start(values)()
+
+
+
+
+def pipelined_cg(pcon, operator, b, precon=None, x=None, tol=1e-7,
+        max_iterations=None, debug=False, debug_callback=None, local_dot=None,
+        residual_replacement_interval=50):
+    """Like :func:`parallel_cg`, but using the pipelined conjugate gradient
+    method of
+
+    P. Ghysels and W. Vanroose, Hiding global synchronization latency in the
+    preconditioned Conjugate Gradient algorithm, Parallel Computing 40
+    (2014), 224-238.
+
+    Each iteration needs a single global reduction, which is started before
+    and completed after the iteration's preconditioner and operator
+    applications, so that these hide its latency.
+
+    :param local_dot: computes the rank-local part of an inner product.
+      Its results are summed over the ranks of *pcon*. Defaults to
+      :func:`numpy.dot`.
+    :param residual_replacement_interval: the number of iterations after
+      which the recurrence residuals are replaced by true ones, to limit
+      the drift to which pipelined CG is prone. This costs three extra
+      operator and two extra preconditioner applications.
+    """
+    if precon is None:
+        precon = IdentityOperator(operator.dtype, operator.shape[0])
+    if local_dot is None:
+        local_dot = numpy.dot
+    if max_iterations is None:
+        max_iterations = 10 * operator.shape[0]
+    if x is None:
+        x = numpy.zeros((operator.shape[1],))
+    if not pcon.is_head_rank:
+        debug = False
+
+    def inner(a, b):
+        return local_dot(a, b.conj())
+
+    reduction = GlobalSumReduction(pcon)
+
+    def get_true_residuals():
+        r = b - operator(x)
+        u = precon(r)
+        return r, u, operator(u)
+
+    r, u, w = get_true_residuals()
+    p = s = q = z = None
+    gamma_0 = None
+
+    iterations = 0
+    since_replacement = 0
+    while iterations < max_iterations:
+        local_values = [inner(r, u), inner(w, u)]
+        if gamma_0 is None:
+            local_values.append(inner(b, b))
+        wait_for_reduction = reduction.start(local_values)
+
+        m = precon(w)
+        n = operator(m)
+
+        reduced = wait_for_reduction()
+        gamma, delta = reduced[:2]
+        if gamma_0 is None:
+            if reduced[2] == 0:
+                return b
+            gamma_0 = gamma
+
+        if abs(gamma) < tol*tol*abs(gamma_0):
+            r, u, w = get_true_residuals()
+            true_gamma = reduction([inner(r, u)])[0]
+            if abs(true_gamma) < tol*tol*abs(gamma_0):
+                if debug_callback is not None:
+                    debug_callback("end", iterations, x, r, p, true_gamma)
+                if debug:
+                    print "%d iterations" % iterations
+                return x
+
+            replace_residuals = True
+        else:
+            replace_residuals = (
+                    since_replacement >= residual_replacement_interval)
+            if replace_residuals:
+                r, u, w = get_true_residuals()
+
+        if replace_residuals:
+            if p is not None:
+                s = operator(p)
+                q = precon(s)
+                z = operator(q)
+            since_replacement = 0
+
+            if debug_callback is not None:
+                debug_callback("residual", iterations, x, r, p, gamma)
+
+            # restart the pipeline with the replaced residuals
+            continue
+
+        if p is None:
+            alpha = gamma/delta
+            z, q, s, p = n, m, w, u
+        else:
+            beta = gamma/gamma_old
+            alpha = gamma/(delta - beta*gamma/alpha_old)
+            z = n + beta*z
+            q = m + beta*q
+            s = w + beta*s
+            p = u + beta*p
+
+        x += alpha*p
+        r = r - alpha*s
+        u = u - alpha*q
+        w = w - alpha*z
+
+        gamma_old = gamma
+        alpha_old = alpha
+
+        if debug_callback is not None:
+            debug_callback("it", iterations, x, r, p, gamma)
+        if debug and iterations % debug == 0:
+            print "debug: delta=%g" % gamma
+
+        iterations += 1
+        since_replacement += 1
+
+    raise ConvergenceError("pipelined cg failed to converge")
+
+
+
+
+def _apply_to_columns(operator, vectors):
+    return numpy.array([operator(vectors[:, j])
+        for j in range(vectors.shape[1])]).T
+
+
+
+
+def _orthonormalize_columns(vectors, gram, drop_tol=1e-12):
+    """Return an orthonormal basis of the column space of *vectors*, given
+    their Gram matrix *gram*. Directions whose share of the Gram matrix
+    falls below *drop_tol* are dropped.
+    """
+    eigenvalues, eigenvectors = numpy.linalg.eigh(gram)
+    keep = eigenvalues > drop_tol*numpy.max(eigenvalues)
+    return numpy.dot(vectors,
+            eigenvectors[:, keep]/numpy.sqrt(eigenvalues[keep]))
+
+
+def block_cg(pcon, operator, b, precon=None, x=None, tol=1e-7,
+        max_iterations=None, debug=False):
+    """Solve ``operator(x[:, j]) = b[:, j]`` for all columns *j* of *b* at
+    once by the breakdown-free block conjugate gradient method of
+
+    H. Ji and Y. Li, A breakdown-free block conjugate gradient method,
+    BIT Numerical Mathematics 57 (2017), 379-403.
+
+    All columns share one Krylov space, so that fewer iterations are needed
+    than for solving them one by one, and each iteration needs only two
+    global reductions, independent of the number of columns. Search
+    directions that become linearly dependent as columns converge are
+    dropped.
+
+    *operator* and *precon* are applied to one column at a time. *b* and
+    *x* are arrays of shape *(n, column_count)*. Column *j* is converged
+    when its preconditioned residual norm has dropped by a factor of *tol*.
+    """
+    if precon is None:
+        precon = IdentityOperator(operator.dtype, operator.shape[0])
+    if max_iterations is None:
+        max_iterations = 10 * operator.shape[0]
+    if x is None:
+        x = numpy.zeros(b.shape, dtype=b.dtype)
+    if not pcon.is_head_rank:
+        debug = False
+
+    reduction = GlobalSumReduction(pcon)
+
+    def local_inner(a, b):
+        return numpy.dot(a.conj().T, b)
+
+    r = b - _apply_to_columns(operator, x)
+    z = _apply_to_columns(precon, r)
+
+    col_count = b.shape[1]
+    reduced = reduction(numpy.hstack([
+        local_inner(z, z).ravel(),
+        numpy.sum(r.conj()*z, axis=0)]))
+    gram = reduced[:col_count**2].reshape(col_count, col_count)
+    delta_0 = numpy.abs(reduced[col_count**2:])
+    delta_0[delta_0 == 0] = 1
+
+    p = _orthonormalize_columns(z, gram)
+
+    iterations = 0
+    while iterations < max_iterations:
+        q = _apply_to_columns(operator, p)
+
+        dir_count = p.shape[1]
+        reduced = reduction(numpy.hstack([
+            local_inner(p, q).ravel(), local_inner(p, r).ravel()]))
+        ptq = reduced[:dir_count**2].reshape(dir_count, dir_count)
+        ptr = reduced[dir_count**2:].reshape(dir_count, col_count)
+
+        alpha = numpy.linalg.solve(ptq, ptr)
+        x += numpy.dot(p, alpha)
+        r = r - numpy.dot(q, alpha)
+        z = _apply_to_columns(precon, r)
+
+        # everything needed for convergence check, new search directions
+        # and their orthonormalization, in one reduction
+        reduced = reduction(numpy.hstack([
+            numpy.sum(r.conj()*z, axis=0),
+            local_inner(q, z).ravel(),
+            local_inner(z, z).ravel(),
+            local_inner(p, z).ravel()]))
+        delta = numpy.abs(reduced[:col_count])
+        qtz, ztz, ptz = [
+                blk.reshape(shape) for blk, shape in zip(
+                    numpy.split(reduced[col_count:],
+                        numpy.cumsum([dir_count*col_count, col_count**2])),
+                    [(dir_count, col_count), (col_count, col_count),
+                        (dir_count, col_count)])]
+
+        if debug and iterations % debug == 0:
+            print "debug: max delta=%g" % numpy.max(delta/delta_0)
+
+        if (delta < tol*tol*delta_0).all():
+            if debug:
+                print "%d iterations" % iterations
+            return x
+
+        # p is orthonormal, so the Gram matrix of z + p beta follows from
+        # the reduced inner products
+        beta = -numpy.linalg.solve(ptq, qtz)
+        cross = numpy.dot(ptz.conj().T, beta)
+        gram = ztz + cross + cross.conj().T + numpy.dot(beta.conj().T, beta)
+        p = _orthonormalize_columns(z + numpy.dot(p, beta), gram)
+
+        iterations += 1
+
+    raise ConvergenceError("block cg failed to converge")
+
+# }}}
+
+
+
+
+# {{{ Krylov solvers for nonsymmetric and indefinite operators
+
+class _RecyclingCombiner(object):
+    """Forms linear combinations of vectors like *sample_vec* using the
+    linear combiners of a
+    :class:`hedge.vector_primitives.VectorPrimitiveFactory`. Vectors handed
+    back through :meth:`release` are reused as result storage, so that a
+    solver allocates its work vectors only once.
+
+    Only vectors returned by this object may be released.
+    """
+
+    def __init__(self, dtype, sample_vec, vector_primitive_factory=None):
+        if vector_primitive_factory is None:
+            from hedge.vector_primitives import VectorPrimitiveFactory
+            vector_primitive_factory = VectorPrimitiveFactory()
+
+        self.dtype = numpy.dtype(dtype)
+        self.sample_vec = sample_vec
+        self.vector_primitive_factory = vector_primitive_factory
+        self.combiners = {}
+        self.spare = []
+
+    def __call__(self, *args):
+        try:
+            combiner = self.combiners[len(args)]
+        except KeyError:
+            combiner = self.combiners[len(args)] = \
+                    self.vector_primitive_factory.make_linear_combiner(
+                            self.dtype, self.dtype, self.sample_vec, len(args))
+
+        if self.spare:
+            return combiner(*args, **dict(result=self.spare.pop()))
+        else:
+            return combiner(*args)
+
+    def release(self, *vectors):
+        for vec in vectors:
+            if vec is not None:
+                self.spare.append(vec)
+
+
+
+
+def _make_krylov_setup(pcon, operator, b, precon, x, max_iterations,
+        debug, local_dot, vector_primitive_factory):
+    if precon is None:
+        precon = IdentityOperator(operator.dtype, operator.shape[0])
+    if local_dot is None:
+        local_dot = numpy.dot
+    if max_iterations is None:
+        max_iterations = 10 * operator.shape[0]
+    if not pcon.is_head_rank:
+        debug = False
+
+    combine = _RecyclingCombiner(operator.dtype, b, vector_primitive_factory)
+
+    # work on a copy, so that the solver owns (and may recycle) x
+    if x is None:
+        x = combine((0, b))
+    else:
+        x = combine((1, x))
+
+    if numpy.dtype(operator.dtype).kind == "c":
+        def inner(a, b):
+            return local_dot(a.conj(), b)
+    else:
+        inner = local_dot
+
+    return (precon, max_iterations, debug, combine, x, inner,
+            GlobalSumReduction(pcon))
+
+
+
+
+def gmres(pcon, operator, b, precon=None, x=None, tol=1e-7, restart=30,
+        max_iterations=None, debug=False, local_dot=None,
+        vector_primitive_factory=None):
+    """Solve ``operator(x) = b`` for a general nonsingular *operator* by
+    the restarted, right-preconditioned GMRES(*restart*) method of
+
+    Y. Saad and M. H. Schultz, GMRES: A generalized minimal residual
+    algorithm for solving nonsymmetric linear systems, SIAM J. Sci. Stat.
+    Comput. 7 (1986), 856-869.
+
+    The Arnoldi basis is kept in one preallocated array, against which new
+    basis vectors are orthogonalized by classical Gram-Schmidt with one
+    reorthogonalization. The inner products of each pass are one
+    matrix-vector product and one global reduction, so that an Arnoldi step
+    needs two reductions, independent of its length. The norm of the new
+    basis vector is obtained from the second of these.
+
+    The iteration stops when the residual norm has dropped by a factor of
+    *tol*. Since the preconditioner is applied from the right, this is the
+    norm of the true, unpreconditioned residual. *b* must be a
+    :class:`numpy.ndarray`.
+
+    :param local_dot: computes the rank-local part of an inner product.
+      Defaults to :func:`numpy.dot`. If given, the inner products of a
+      Gram-Schmidt pass are formed one by one, but still reduced at once.
+    :param vector_primitive_factory: a
+      :class:`hedge.vector_primitives.VectorPrimitiveFactory` supplying the
+      linear combiners for residuals and solution updates.
+    """
+    custom_dot = local_dot is not None
+    (precon, max_iterations, debug, combine, x, inner,
+            reduction) = _make_krylov_setup(pcon, operator, b, precon, x,
+                    max_iterations, debug, local_dot,
+                    vector_primitive_factory)
+
+    def basis_inner(basis, w):
+        if custom_dot:
+            return numpy.array([inner(v_i, w) for v_i in basis])
+        else:
+            return numpy.dot(basis.conj(), w)
+
+    dtype = numpy.dtype(operator.dtype)
+    basis = numpy.empty((restart+1, b.shape[0]), dtype=dtype)
+    hessenberg = numpy.zeros((restart+1, restart), dtype=dtype)
+    rot_cos = numpy.empty(restart)
+    rot_sin = numpy.empty(restart, dtype=dtype)
+    rhs = numpy.empty(restart+1, dtype=dtype)
+
+    r = None
+    beta_0 = None
+    iterations = 0
+    while True:
+        r_new = combine((1, b), (-1, operator(x)))
+        combine.release(r)
+        r = r_new
+
+        beta = abs(reduction([inner(r, r)])[0])**0.5
+        if beta_0 is None:
+            if beta == 0:
+                return x
+            beta_0 = beta
+
+        if debug:
+            print "debug: restart, residual=%g" % (beta/beta_0)
+        if beta <= tol*beta_0:
+            if debug:
+                print "%d iterations" % iterations
+            return x
+        if iterations >= max_iterations:
+            raise ConvergenceError("gmres failed to converge")
+
+        basis[0] = r/beta
+        hessenberg.fill(0)
+        rhs.fill(0)
+        rhs[0] = beta
+
+        j = 0
+        while j < restart and iterations < max_iterations:
+            w = basis[j+1]
+            w[:] = operator(precon(basis[j]))
+
+            # classical Gram-Schmidt, twice
+            h = reduction(basis_inner(basis[:j+1], w))
+            w -= numpy.dot(h, basis[:j+1])
+            reduced = reduction(numpy.hstack([
+                basis_inner(basis[:j+1], w), [inner(w, w)]]))
+            h_2 = reduced[:j+1]
+            w -= numpy.dot(h_2, basis[:j+1])
+            h_norm = max(abs(reduced[j+1]) - numpy.sum(abs(h_2)**2), 0)**0.5
+
+            hessenberg[:j+1, j] = h + h_2
+            hessenberg[j+1, j] = h_norm
+
+            # apply previous rotations, then annihilate the subdiagonal
+            for i in range(j):
+                a, c = hessenberg[i, j], hessenberg[i+1, j]
+                hessenberg[i, j] = rot_cos[i]*a + rot_sin[i]*c
+                hessenberg[i+1, j] = -rot_sin[i].conjugate()*a + rot_cos[i]*c
+
+            a = hessenberg[j, j]
+            denom = (abs(a)**2 + h_norm**2)**0.5
+            if a == 0:
+                rot_cos[j], rot_sin[j] = 0, 1
+            else:
+                rot_cos[j] = abs(a)/denom
+                rot_sin[j] = a/abs(a)*h_norm/denom
+            hessenberg[j, j] = rot_cos[j]*a + rot_sin[j]*h_norm
+            hessenberg[j+1, j] = 0
+            rhs[j+1] = -rot_sin[j].conjugate()*rhs[j]
+            rhs[j] = rot_cos[j]*rhs[j]
+
+            iterations += 1
+            j += 1
+
+            residual = abs(rhs[j])
+            if debug and iterations % debug == 0:
+                print "debug: residual=%g" % (residual/beta_0)
+            if residual <= tol*beta_0 or h_norm <= 1e-14*beta:
+                # converged, or the Krylov space is invariant
+                break
+
+            w /= h_norm
+
+        y = numpy.linalg.solve(hessenberg[:j, :j], rhs[:j])
+        x_new = combine((1, x), (1, precon(numpy.dot(y, basis[:j]))))
+        combine.release(x)
+        x = x_new
+
+
+
+
+def bicgstab(pcon, operator, b, precon=None, x=None, tol=1e-7,
+        max_iterations=None, debug=False, local_dot=None,
+        vector_primitive_factory=None):
+    """Solve ``operator(x) = b`` for a general nonsingular *operator* by the
+    right-preconditioned BiCGStab method of
+
+    H. A. van der Vorst, Bi-CGSTAB: A fast and smoothly converging variant
+    of Bi-CG for the solution of nonsymmetric linear systems, SIAM J. Sci.
+    Stat. Comput. 13 (1992), 631-644.
+
+    The inner products of an iteration are grouped so that it needs two
+    global reductions. The residual norm is updated from them rather than
+    recomputed, and is checked against the true residual before the
+    iteration is considered converged. If the check fails, the iteration
+    restarts from the true residual.
+
+    The iteration stops when the residual norm has dropped by a factor of
+    *tol*. For *local_dot* and *vector_primitive_factory*, see
+    :func:`gmres`.
+    """
+    (precon, max_iterations, debug, combine, x, inner,
+            reduction) = _make_krylov_setup(pcon, operator, b, precon, x,
+                    max_iterations, debug, local_dot,
+                    vector_primitive_factory)
+
+    r = r_hat = p = None
+    rr_0 = None
+    iterations = 0
+    while iterations < max_iterations:
+        if p is None:
+            # (re)start from the true residual
+            r_new = combine((1, b), (-1, operator(x)))
+            combine.release(r)
+            r = r_new
+            rr = abs(reduction([inner(r, r)])[0])
+
+            if rr_0 is None:
+                if rr == 0:
+                    return x
+                rr_0 = rr
+                r_hat = combine((1, r))
+
+            if rr <= tol*tol*rr_0:
+                if debug:
+                    print "%d iterations" % iterations
+                return x
+
+            rho = reduction([inner(r_hat, r)])[0]
+            p = combine((1, r))
+        else:
+            if rr <= tol*tol*rr_0:
+                # verify the recurrence residual at the next (re)start
+                combine.release(p)
+                p = None
+                continue
+
+            beta = (rho/rho_old)*(alpha/omega)
+            p_new = combine((1, r), (beta, p), (-beta*omega, v))
+            combine.release(p)
+            p = p_new
+
+        p_hat = precon(p)
+        v = operator(p_hat)
+        rhat_v = reduction([inner(r_hat, v)])[0]
+        if rhat_v == 0:
+            raise ConvergenceError("bicgstab broke down")
+
+        alpha = rho/rhat_v
+        s = combine((1, r), (-alpha, v))
+        s_hat = precon(s)
+        t = operator(s_hat)
+        s_s, t_s, t_t, rhat_s, rhat_t = reduction([
+            inner(s, s), inner(t, s), inner(t, t),
+            inner(r_hat, s), inner(r_hat, t)])
+        ss = abs(s_s)
+
+        if ss <= tol*tol*rr_0:
+            x_new = combine((1, x), (alpha, p_hat))
+            combine.release(x, r)
+            x, r, rr = x_new, s, ss
+            iterations += 1
+            continue
+
+        if t_t == 0:
+            raise ConvergenceError("bicgstab broke down")
+
+        omega = t_s/t_t
+        x_new = combine((1, x), (alpha, p_hat), (omega, s_hat))
+        r_new = combine((1, s), (-omega, t))
+        combine.release(x, r, s)
+        x, r = x_new, r_new
+
+        rho_old = rho
+        rho = rhat_s - omega*rhat_t
+        # omega minimizes the norm of r, hence
+        rr = max(ss - abs(t_s)**2/abs(t_t), 0)
+
+        if debug and iterations % debug == 0:
+            print "debug: residual=%g" % (rr/rr_0)**0.5
+
+        if rho == 0 or omega == 0:
+            raise ConvergenceError("bicgstab broke down")
+
+        iterations += 1
+
+    raise ConvergenceError("bicgstab failed to converge")
+
+
+
+
+def minres(pcon, operator, b, precon=None, x=None, tol=1e-7,
+        max_iterations=None, debug=False, local_dot=None,
+        vector_primitive_factory=None):
+    """Solve ``operator(x) = b`` for a symmetric (Hermitian), possibly
+    indefinite *operator* by the MINRES method of
+
+    C. C. Paige and M. A. Saunders, Solution of sparse indefinite systems of
+    linear equations, SIAM J. Numer. Anal. 12 (1975), 617-629.
+
+    *precon* must be symmetric positive definite. Each iteration needs two
+    global reductions. (Computing the norm of the next Lanczos vector from
+    the first one instead is unstable.)
+
+    The iteration stops when the preconditioned residual norm has dropped
+    by a factor of *tol*, which is checked against the true residual. If
+    the check fails, the iteration restarts from the true residual. For
+    *local_dot* and *vector_primitive_factory*, see :func:`gmres`.
+    """
+    (precon, max_iterations, debug, combine, x, inner,
+            reduction) = _make_krylov_setup(pcon, operator, b, precon, x,
+                    max_iterations, debug, local_dot,
+                    vector_primitive_factory)
+
+    from math import sqrt
+
+    beta_0 = None
+    iterations = 0
+    while True:
+        r2 = combine((1, b), (-1, operator(x)))
+        z = precon(r2)
+        beta = reduction([inner(r2, z)])[0].real
+        if beta < 0:
+            raise ValueError("minres requires a positive definite "
+                    "preconditioner")
+        beta = sqrt(beta)
+
+        if beta_0 is None:
+            if beta == 0:
+                return x
+            beta_0 = beta
+
+        if beta <= tol*beta_0:
+            if debug:
+                print "%d iterations" % iterations
+            return x
+        if iterations >= max_iterations:
+            raise ConvergenceError("minres failed to converge")
+
+        r1 = None
+        w = w_prev = None
+        old_beta = 0
+        dbar = 0
+        epsilon = 0
+        phibar = beta
+        cs = -1
+        sn = 0
+
+        while iterations < max_iterations and phibar > tol*beta_0:
+            v = combine((1/beta, z))
+
+            # Lanczos step
+            if r1 is None:
+                y = operator(v)
+                y_owned = False
+            else:
+                y = combine((1, operator(v)), (-beta/old_beta, r1))
+                y_owned = True
+                combine.release(r1)
+
+            alpha = reduction([inner(v, y)])[0].real
+
+            r1 = r2
+            r2 = combine((1, y), (-alpha/beta, r1))
+            if y_owned:
+                combine.release(y)
+            z = precon(r2)
+
+            old_beta = beta
+            beta = sqrt(max(reduction([inner(r2, z)])[0].real, 0))
+
+            # apply the previous rotation, then compute the next one
+            old_epsilon = epsilon
+            delta = cs*dbar + sn*alpha
+            gbar = sn*dbar - cs*alpha
+            epsilon = sn*beta
+            dbar = -cs*beta
+            gamma = max(sqrt(gbar**2 + beta**2), numpy.finfo(float).eps)
+            cs = gbar/gamma
+            sn = beta/gamma
+            phi = cs*phibar
+            phibar = sn*phibar
+
+            w_args = [(1/gamma, v)]
+            if w is not None:
+                w_args.append((-delta/gamma, w))
+            if w_prev is not None:
+                w_args.append((-old_epsilon/gamma, w_prev))
+            w_new = combine(*w_args)
+            combine.release(w_prev, v)
+            w_prev, w = w, w_new
+
+            x_new = combine((1, x), (phi, w))
+            combine.release(x)
+            x = x_new
+
+            iterations += 1
+
+            if debug and iterations % debug == 0:
+                print "debug: residual=%g" % (phibar/beta_0)
+
+            if beta == 0:
+                # the Krylov space is invariant
+                break
+
+        combine.release(r1, r2, w, w_prev)
+
+# }}}
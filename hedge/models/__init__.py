@@ -50,13 +50,51 @@ class TimeDependentOperator(Operator):
 class HyperbolicOperator(Operator):
     """A base class for hyperbolic Discontinuous Galerkin operators."""
 
+    spectral_timestep_safety = 0.9
+
     def estimate_timestep(self, discr,
             stepper=None, stepper_class=None, stepper_args=None,
-            t=None, fields=None):
+            t=None, fields=None, spectral=False, cfl_estimator=None):
         u"""Estimate the largest stable timestep, given a time stepper
         `stepper_class`. If none is given, RK4 is assumed.
+
+        If *spectral* is true, the extreme eigenvalues of the right-hand
+        side returned by :meth:`bind`, linearized about *fields* at *t*,
+        are estimated by
+        :func:`hedge.timestep.stability.estimate_rhs_eigenvalues`, and the
+        timestep is the largest one that keeps them within the stepper's
+        stability region, times :attr:`spectral_timestep_safety`. This is
+        usually less conservative than the default estimate, which relies
+        on :meth:`max_eigenvalue` and empirical geometric factors. The
+        eigenvalue estimate is cached per discretization and reused by
+        later calls, so this is meant for operators whose spectrum does
+        not depend on *t* and *fields*.
+
+        If *cfl_estimator* (see :meth:`make_cfl_estimator`) is given, the
+        estimate uses per-element geometric factors instead of the smallest
+        one in *discr*, and, on more than one rank, reduces across ranks
+        only as often as the estimator is configured to. The wave speed is
+        taken from :meth:`max_eigenvalue` at *t* and *fields* on every call,
+        so operators whose wave speeds depend on the state need the current
+        *fields*.
         """
 
+        if cfl_estimator is not None:
+            cfl_estimator.submit_wave_speeds(
+                    self.max_eigenvalue(t, fields, discr))
+            return cfl_estimator(t)
+
+        if spectral:
+            if fields is None:
+                raise ValueError("spectral timestep estimation needs fields")
+
+            from hedge.timestep.stability import \
+                    stable_timestep_for_eigenvalues
+            return self.spectral_timestep_safety \
+                    * stable_timestep_for_eigenvalues(
+                            self._estimate_eigenvalues(discr, t, fields),
+                            stepper, stepper_class, stepper_args or ())
+
         rk4_dt = 1 / self.max_eigenvalue(t, fields, discr) \
                 * (discr.dt_non_geometric_factor()
                 * discr.dt_geometric_factor())
@@ -65,3 +103,34 @@ class HyperbolicOperator(Operator):
                 approximate_rk4_relative_imag_stability_region
         return rk4_dt * approximate_rk4_relative_imag_stability_region(
                 stepper, stepper_class, stepper_args)
+
+    def make_cfl_estimator(self, discr,
+            stepper=None, stepper_class=None, stepper_args=None, **kwargs):
+        """Return a :class:`hedge.timestep.cfl.CFLTimestepEstimator` to pass
+        to :meth:`estimate_timestep` as *cfl_estimator*. *kwargs* are passed
+        on to the estimator.
+        """
+        from hedge.timestep.cfl import CFLTimestepEstimator
+        return CFLTimestepEstimator(discr, stepper=stepper,
+                stepper_class=stepper_class, stepper_args=stepper_args,
+                **kwargs)
+
+    def _estimate_eigenvalues(self, discr, t, fields):
+        try:
+            cache = self._eigenvalue_cache
+        except AttributeError:
+            from weakref import WeakKeyDictionary
+            cache = self._eigenvalue_cache = WeakKeyDictionary()
+
+        try:
+            return cache[discr]
+        except KeyError:
+            pass
+
+        if t is None:
+            t = 0
+
+        from hedge.timestep.stability import estimate_rhs_eigenvalues
+        result = cache[discr] = estimate_rhs_eigenvalues(
+                self.bind(discr), t, fields, pcon=discr.run_context)
+        return result
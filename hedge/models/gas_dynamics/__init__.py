@@ -799,7 +799,16 @@ class GasDynamicsOperator(TimeDependentOperator):
     # }}}
 
     # {{{ operator binding ----------------------------------------------------
-    def bind(self, discr, sensor=None, sensor_scaling=None, viscosity_only=False):
+    def bind(self, discr, sensor=None, sensor_scaling=None, viscosity_only=False,
+            cfl_estimator=None):
+        """
+        :param cfl_estimator: if not *None*, a
+          :class:`hedge.timestep.cfl.CFLTimestepEstimator` (see
+          :meth:`make_cfl_estimator`) that receives the element-wise
+          wave speeds computed as part of each right-hand side evaluation.
+          The right-hand side then returns the largest wave speed on this
+          rank only, leaving reductions across ranks to the estimator.
+        """
         if (sensor is None and 
                 self.artificial_viscosity_mode is not None):
             raise ValueError("must specify a sensor if using "
@@ -847,7 +856,12 @@ class GasDynamicsOperator(TimeDependentOperator):
 
             max_speed = opt_result[-1]
             ode_rhs = opt_result[:-1]
-            return ode_rhs, discr.nodewise_max(max_speed)
+
+            if cfl_estimator is not None:
+                cfl_estimator.submit_wave_speeds(max_speed)
+                return ode_rhs, cfl_estimator.max_wave_speed()
+            else:
+                return ode_rhs, discr.nodewise_max(max_speed)
 
         return rhs
 
@@ -857,11 +871,18 @@ class GasDynamicsOperator(TimeDependentOperator):
 
     def estimate_timestep(self, discr, 
             stepper=None, stepper_class=None, stepper_args=None,
-            t=None, max_eigenvalue=None):
+            t=None, max_eigenvalue=None, cfl_estimator=None):
         u"""Estimate the largest stable timestep, given a time stepper
         `stepper_class`. If none is given, RK4 is assumed.
+
+        If *cfl_estimator* (see :meth:`make_cfl_estimator`) is given, its
+        element-wise estimate from the wave speeds last submitted by the
+        right-hand side is returned, and *max_eigenvalue* is not needed.
         """
 
+        if cfl_estimator is not None:
+            return cfl_estimator(t)
+
         dg_factor = (discr.dt_non_geometric_factor()
                 * discr.dt_geometric_factor())
 
@@ -873,6 +894,19 @@ class GasDynamicsOperator(TimeDependentOperator):
         return rk4_dt * approximate_rk4_relative_imag_stability_region(
                 stepper, stepper_class, stepper_args)
 
+    def make_cfl_estimator(self, discr,
+            stepper=None, stepper_class=None, stepper_args=None, **kwargs):
+        """Return a :class:`hedge.timestep.cfl.CFLTimestepEstimator` that
+        computes the same estimate as :meth:`estimate_timestep`, but on each
+        element separately and from the wave speeds submitted by the
+        right-hand side returned by :meth:`bind`. Pass it to :meth:`bind`
+        as *cfl_estimator*. *kwargs* are passed on to the estimator.
+        """
+        from hedge.timestep.cfl import CFLTimestepEstimator
+        return CFLTimestepEstimator(discr, stepper=stepper,
+                stepper_class=stepper_class, stepper_args=stepper_args,
+                diffusivity=self.mu, **kwargs)
+
     # }}}
 
 
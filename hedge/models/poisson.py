@@ -180,12 +180,15 @@ class BoundPoissonOperator(hedge.iterative.OperatorBase):
         nodes = len(self.discr)
         return nodes, nodes
 
-    def op(self, u):
+    def _apply_compiled_op(self, u):
         context = {"u": u}
         if not isinstance(self.poisson_op.diffusion_tensor, np.ndarray):
             context["diffusion"] = self.diffusion
 
-        result = self.compiled_op(**context)
+        return self.compiled_op(**context)
+
+    def op(self, u):
+        result = self._apply_compiled_op(u)
 
         if self.poincare_mean_value_hack:
             state_int = self.discr.integral(u)
@@ -196,6 +199,49 @@ class BoundPoissonOperator(hedge.iterative.OperatorBase):
 
     __call__ = op
 
+    def block_jacobi_preconditioner(self):
+        """Return a :class:`hedge.iterative.BlockJacobiPreconditioner`
+        built from the element-diagonal blocks of this operator. The
+        mean-value term added for pure Neumann problems is not included.
+        Use its negative along with the negative of this operator.
+        Like :meth:`sparse_matrix`, this is only available in serial runs.
+        """
+        from hedge.iterative import make_block_jacobi_preconditioner
+        return make_block_jacobi_preconditioner(
+                self.discr, self._apply_compiled_op,
+                self.poisson_op.scheme.element_stencil_distance)
+
+    def sparse_matrix(self):
+        """Return the matrix of this operator as a
+        :class:`scipy.sparse.csr_matrix`, assembled by
+        :func:`hedge.iterative.assemble_sparse_matrix`. The mean-value term
+        added for pure Neumann problems is not included.
+        """
+        from hedge.iterative import assemble_sparse_matrix
+        return assemble_sparse_matrix(
+                self.discr, self._apply_compiled_op,
+                self.poisson_op.scheme.element_stencil_distance,
+                dtype=self.dtype)
+
+    def p_multigrid_preconditioner(self, coarse_discrs, **kwargs):
+        """Return a :class:`hedge.iterative.PMultigridPreconditioner` for
+        this operator that rediscretizes it on *coarse_discrs*, a list of
+        lower-order discretizations of the same mesh ordered from fine to
+        coarse. *kwargs* are passed on to the preconditioner.
+        Use its negative along with the negative of this operator.
+        """
+        bound_ops = [self] + [self.poisson_op.bind(discr)
+                for discr in coarse_discrs]
+        kwargs.setdefault("stencil_distance",
+                self.poisson_op.scheme.element_stencil_distance)
+
+        from hedge.iterative import PMultigridPreconditioner
+        return PMultigridPreconditioner(
+                [self.discr] + list(coarse_discrs), bound_ops,
+                [bound_op.block_jacobi_preconditioner()
+                    for bound_op in bound_ops],
+                **kwargs)
+
     def prepare_rhs(self, rhs):
         """Prepare the right-hand side for the linear system op(u)=rhs(f).
 
@@ -68,6 +68,196 @@ def partition_from_tags(mesh, tag_to_number):
 
 
 
+# {{{ weighted partitioning
+
+class ElementCostModel(object):
+    r"""Estimates the relative cost of evaluating an operator on each element
+    of a mesh, for use as vertex weights in :func:`partition_weighted`.
+
+    The cost of an element is modeled as
+
+    .. math::
+
+        c_i = f_i (c_{\text{vol}} + n^{\text{face}}_i c_{\text{face}}
+          + n^{\text{bdry}}_i c_{\text{bdry}}),
+
+    where :math:`f_i` is an optional per-element cost factor (which may
+    be used, for example, to account for elements on which a shock
+    sensor switched on artificial viscosity).
+
+    :param volume_cost: cost of the element-local (volume) work
+      on one element.
+    :param face_cost: cost of computing the flux through one face.
+    :param boundary_face_cost: *additional* cost of a face that lies on
+      a (domain or rank) boundary. Defaults to *face_cost*.
+    """
+
+    def __init__(self, volume_cost=1, face_cost=0.25, boundary_face_cost=None):
+        if boundary_face_cost is None:
+            boundary_face_cost = face_cost
+
+        self.volume_cost = volume_cost
+        self.face_cost = face_cost
+        self.boundary_face_cost = boundary_face_cost
+
+    @classmethod
+    def from_instrumentation(cls, discr):
+        """Derive volume and face costs from the kernel times measured by
+        the instrumented :class:`hedge.discretization.Discretization` *discr*.
+
+        The measurement covers the time accumulated in *discr*'s timers since
+        the last tick of the :class:`pytools.log.LogManager`. If no time has
+        been recorded yet, a default-constructed model is returned.
+        """
+        if not discr.instrumented:
+            raise ValueError("discretization is not instrumented")
+
+        volume_time = (discr.diff_timer.elapsed
+                + discr.el_local_timer.elapsed
+                + discr.vector_math_timer.elapsed)
+        face_time = discr.gather_timer.elapsed + discr.lift_timer.elapsed
+
+        if volume_time <= 0 or face_time <= 0:
+            return cls()
+
+        el_count = len(discr.mesh.elements)
+        face_count = sum(len(el.faces) for el in discr.mesh.elements)
+
+        return cls(
+                volume_cost=volume_time/el_count,
+                face_cost=face_time/face_count)
+
+    def element_weights(self, mesh, element_cost_factors=None):
+        """Return a :mod:`numpy` array of element costs, indexed by
+        element id within *mesh*.
+
+        :param element_cost_factors: *None* or an array of per-element
+          multipliers :math:`f_i`, indexed by element id.
+        """
+        bdry_face_counts = numpy.zeros(len(mesh.elements), dtype=numpy.intp)
+        for el, face_nr in mesh.tag_to_boundary.get(
+                hedge.mesh.TAG_REALLY_ALL, []):
+            bdry_face_counts[el.id] += 1
+
+        face_counts = numpy.array(
+                [len(el.faces) for el in mesh.elements], dtype=numpy.intp)
+
+        result = (self.volume_cost
+                + self.face_cost*face_counts
+                + self.boundary_face_cost*bdry_face_counts)
+
+        if element_cost_factors is not None:
+            result = result*numpy.asarray(element_cost_factors)
+
+        return result
+
+
+def _make_metis_weights(weights, typical_value=100):
+    """Turn the positive floating point *weights* into the positive integers
+    that METIS requires, scaled so that their mean is *typical_value*.
+    """
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    if not len(weights):
+        return []
+
+    mean = numpy.mean(weights)
+    if mean <= 0:
+        raise ValueError("weights must be positive")
+
+    return [int(w) for w in numpy.maximum(
+        1, numpy.round(weights*(typical_value/mean)))]
+
+
+def partition_weighted(mesh, part_count,
+        element_weights=None, face_weights=None):
+    """Use PyMetis to partition *mesh* into *part_count* parts.
+
+    :param element_weights: *None* or an array of per-element costs,
+      indexed by element id, such as that returned by
+      :meth:`ElementCostModel.element_weights`. METIS balances the sum of
+      these weights across parts.
+    :param face_weights: *None* or a mapping from *(element id, face number)*
+      to the cost of cutting the partition at this face (for example, the
+      amount of data exchanged across it). Faces not in the mapping have
+      cost 1.
+    :returns: a list mapping element ids to part numbers.
+    """
+
+    if part_count == 1:
+        return [0]*len(mesh.elements)
+
+    # {{{ build weighted CSR adjacency
+
+    adjacency = [{} for el in mesh.elements]
+
+    for (e1, f1), (e2, f2) in mesh.interfaces:
+        if e1.id == e2.id:
+            # can happen with periodicity on one-element-wide meshes
+            continue
+
+        if face_weights is None:
+            weight = 1
+        else:
+            weight = max(
+                    face_weights.get((e1.id, f1), 1),
+                    face_weights.get((e2.id, f2), 1))
+
+        # Multiple faces may connect the same pair of elements--METIS
+        # does not tolerate duplicate edges, so merge their weights.
+        adjacency[e1.id][e2.id] = adjacency[e1.id].get(e2.id, 0) + weight
+        adjacency[e2.id][e1.id] = adjacency[e2.id].get(e1.id, 0) + weight
+
+    xadj = [0]
+    adjncy = []
+    edge_weights = []
+    for el_adjacency in adjacency:
+        for nb_id, weight in sorted(el_adjacency.iteritems()):
+            adjncy.append(nb_id)
+            edge_weights.append(weight)
+        xadj.append(len(adjncy))
+
+    # }}}
+
+    kwargs = {}
+    if element_weights is not None:
+        if len(element_weights) != len(mesh.elements):
+            raise ValueError("element_weights must have one entry per element")
+        kwargs["vweights"] = _make_metis_weights(element_weights)
+
+    if face_weights is not None:
+        kwargs["eweights"] = _make_metis_weights(edge_weights)
+
+    from pymetis import part_graph
+    dummy, partition = part_graph(part_count,
+            xadj=xadj, adjncy=adjncy, **kwargs)
+
+    return partition
+
+
+def partition_imbalance(partition, element_weights, part_count=None):
+    """Return the load imbalance of *partition*, i.e. the amount by which
+    the cost of the most expensive part exceeds the average part cost,
+    relative to the average. A perfectly balanced partition has an imbalance
+    of zero.
+    """
+    partition = numpy.asarray(partition)
+    if part_count is None:
+        part_count = numpy.max(partition) + 1
+
+    part_costs = numpy.zeros(part_count, dtype=numpy.float64)
+    numpy.add.at(part_costs, partition, element_weights)
+
+    mean_cost = numpy.mean(part_costs)
+    if mean_cost == 0:
+        return 0
+
+    return numpy.max(part_costs)/mean_cost - 1
+
+# }}}
+
+
+
+
 def partition_mesh(mesh, partition, part_bdry_tag_factory):
     """*partition* is a mapping that maps element id to
     integers that represent different pieces of the mesh.
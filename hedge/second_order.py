@@ -320,6 +320,10 @@ class SecondDerivativeTarget(object):
 # {{{ second derivative schemes
 
 class SecondDerivativeBase(object):
+    # number of shared faces across which the resulting operator
+    # couples elements
+    element_stencil_distance = 2
+
     def grad(self, tgt, bc_getter, dirichlet_tags, neumann_tags):
         """
         :param bc_getter: a function (tag, volume_expr) -> boundary expr.
@@ -455,6 +459,8 @@ class CentralSecondDerivative(LDGSecondDerivative):
 
 
 class IPDGSecondDerivative(SecondDerivativeBase):
+    element_stencil_distance = 1
+
     def __init__(self, stab_coefficient=1):
         self.stab_coefficient = stab_coefficient
 
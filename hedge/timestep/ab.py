@@ -128,8 +128,22 @@ def make_ab_coefficients(order):
 class AdamsBashforthTimeStepper(TimeStepper):
     dt_fudge_factor = 0.95
 
-    def __init__(self, order, startup_stepper=None, dtype=numpy.float64, rcon=None):
+    def __init__(self, order, startup_stepper=None, dtype=numpy.float64, rcon=None,
+            vector_primitive_factory=None):
+        # Right-hand side history, newest first while starting up. Once full,
+        # it is used as a ring buffer, with the newest entry at
+        # f_history_head. It holds the vectors returned by the right-hand
+        # side themselves, not copies, so these must not be reused by the
+        # right-hand side in later calls. The only vector allocated per
+        # step is the new state, by the linear combiner.
         self.f_history = []
+        self.f_history_head = 0
+
+        if vector_primitive_factory is None:
+            from hedge.vector_primitives import VectorPrimitiveFactory
+            self.vector_primitive_factory = VectorPrimitiveFactory()
+        else:
+            self.vector_primitive_factory = vector_primitive_factory
 
         from pytools import match_precision
         self.dtype = numpy.dtype(dtype)
@@ -168,6 +182,30 @@ class AdamsBashforthTimeStepper(TimeStepper):
     def __getinitargs__(self):
         return (self.order, self.startup_stepper)
 
+    def get_checkpoint_state(self):
+        return ({"f_history": list(self.f_history)}, {
+            "order": self.order,
+            "f_history_head": self.f_history_head,
+            "dof_count": getattr(self, "dof_count", None),
+            })
+
+    def set_checkpoint_state(self, vectors, meta):
+        if meta["order"] != self.order:
+            raise ValueError("checkpoint is for order %d, not %d"
+                    % (meta["order"], self.order))
+
+        self.f_history = list(vectors["f_history"])
+        self.f_history_head = meta["f_history_head"]
+        if meta["dof_count"] is not None:
+            self.dof_count = meta["dof_count"]
+
+        if len(self.f_history) == self.order:
+            # startup is complete
+            try:
+                del self.startup_stepper
+            except AttributeError:
+                pass
+
     def __call__(self, y, t, dt, rhs):
         if len(self.f_history) == 0:
             # insert IC
@@ -176,26 +214,37 @@ class AdamsBashforthTimeStepper(TimeStepper):
             from hedge.tools import count_dofs
             self.dof_count = count_dofs(self.f_history[0])
 
-        if len(self.f_history) < len(self.coefficients):
+        order = len(self.coefficients)
+
+        if len(self.f_history) < order:
             ynew = self.startup_stepper(y, t, dt, rhs)
-            if len(self.f_history) == len(self.coefficients) - 1:
+            if len(self.f_history) == order - 1:
                 # here's some memory we won't need any more
                 del self.startup_stepper
 
+            self.f_history.insert(0, rhs(t+dt, ynew))
+
         else:
-            from operator import add
+            try:
+                lc = self.linear_combiner
+            except AttributeError:
+                lc = self.linear_combiner = self.vector_primitive_factory\
+                        .make_linear_combiner(self.dtype, self.scalar_dtype,
+                                y, arg_count=order+1)
 
             sub_timer = self.timer.start_sub_timer()
-            assert len(self.coefficients) == len(self.f_history)
-            ynew = y + dt * reduce(add,
-                    (coeff * f 
-                        for coeff, f in 
-                        zip(self.coefficients, self.f_history)))
-
-            self.f_history.pop()
+            head = self.f_history_head
+            ynew = lc((1, y), *[
+                (dt*coeff, self.f_history[(head+i) % order])
+                for i, coeff in enumerate(self.coefficients)])
             sub_timer.stop().submit()
 
+            # The oldest entry becomes the newest. Drop it before evaluating
+            # the right-hand side to keep only *order* of them alive.
+            head = self.f_history_head = (head-1) % order
+            self.f_history[head] = None
+            self.f_history[head] = rhs(t+dt, ynew)
+
         self.flop_counter.add((2+2*len(self.coefficients)-1)*self.dof_count)
 
-        self.f_history.insert(0, rhs(t+dt, ynew))
         return ynew
@@ -28,4 +28,68 @@ THE SOFTWARE.
 
 
 class TimeStepper(object):
-    pass
+    # {{{ checkpointing
+
+    def get_checkpoint_state(self):
+        """Return a tuple *(vectors, meta)* describing the state that this
+        time stepper carries from one step to the next. *vectors* maps
+        names to state vectors (or lists of them), *meta* is a picklable
+        :class:`dict` of everything else.
+        """
+        raise NotImplementedError("%s does not support checkpointing"
+                % type(self).__name__)
+
+    def set_checkpoint_state(self, vectors, meta):
+        """Restore state obtained from :meth:`get_checkpoint_state`."""
+        raise NotImplementedError("%s does not support checkpointing"
+                % type(self).__name__)
+
+    def write_checkpoint(self, filename_base, y, t, rcon=None):
+        """Write the state *y* at time *t*, together with the state of this
+        time stepper, to files starting with *filename_base*. If *rcon*
+        runs more than one rank, each rank writes its own files.
+        """
+        from hedge.timestep.checkpoint import \
+                get_checkpoint_filename_base, write_checkpoint
+
+        vectors, meta = self.get_checkpoint_state()
+        if "y" in vectors or "t" in meta or "stepper_class" in meta:
+            raise ValueError("checkpoint state of %s uses reserved names"
+                    % type(self).__name__)
+
+        vectors = dict(vectors, y=y)
+        meta = dict(meta, t=t, stepper_class=type(self).__name__)
+        write_checkpoint(
+                get_checkpoint_filename_base(filename_base, rcon),
+                vectors, meta)
+
+    def read_checkpoint(self, filename_base, rcon=None, use_mmap=False):
+        """Restore the state saved by :meth:`write_checkpoint` into this
+        time stepper, which must have been constructed with the same
+        arguments as the one that wrote the checkpoint.
+
+        :param use_mmap: passed on to
+          :func:`hedge.timestep.checkpoint.read_checkpoint`.
+        :returns: a tuple *(y, t)* of the state and time passed to
+          :meth:`write_checkpoint`.
+        """
+        from hedge.timestep.checkpoint import \
+                get_checkpoint_filename_base, read_checkpoint
+
+        vectors, meta = read_checkpoint(
+                get_checkpoint_filename_base(filename_base, rcon),
+                use_mmap=use_mmap)
+
+        meta = meta.copy()
+        stepper_class = meta.pop("stepper_class")
+        if stepper_class != type(self).__name__:
+            raise ValueError("checkpoint was written by a %s, not a %s"
+                    % (stepper_class, type(self).__name__))
+
+        t = meta.pop("t")
+        y = vectors.pop("y")
+
+        self.set_checkpoint_state(vectors, meta)
+        return y, t
+
+    # }}}
@@ -0,0 +1,196 @@
+"""Cheap CFL timestep estimation from element-wise wave speeds."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+
+import numpy
+
+
+
+
+class CFLTimestepEstimator(object):
+    """Estimate the largest stable timestep from element-wise maximum wave
+    speeds that the right-hand side computes anyway, instead of binding and
+    running a separate characteristic velocity operator.
+
+    The right-hand side passes its element-wise maximum wave speed (a volume
+    vector, as produced by
+    :class:`hedge.optemplate.operators.ElementwiseMaxOperator`) to
+    :meth:`submit_wave_speeds`. Since that vector is constant on each
+    element, only one node per element is examined, together with cached
+    per-element timestep factors from
+    :meth:`hedge.discretization.Discretization.element_dt_factors`.
+
+    On a single rank, every call returns the current estimate. With more
+    than one rank, a global minimum is only computed every
+    *reduction_interval* calls. In between, the last reduced timestep is
+    used, divided by *growth_bound*, i.e. wave speeds are assumed to grow
+    by no more than that factor over one interval. Calls that perform a
+    reduction return its result unchanged.
+
+    To catch wave speeds that grow faster than that, the first submission
+    of wave speeds after each call starts a nonblocking global minimum of
+    :meth:`local_timestep`, which the next call completes. If it finds a
+    timestep below the one about to be returned, that call reduces
+    immediately instead, and the interval is halved.
+
+    Instances are callable with a time argument and may be passed as
+    *max_dt_getter* to :func:`hedge.timestep.times_and_steps`.
+    """
+
+    def __init__(self, discr, stepper=None, stepper_class=None,
+            stepper_args=None, diffusivity=0, reduction_interval=10,
+            growth_bound=1.1):
+        self.discr = discr
+        self.first_nodes, self.dt_factors = discr.element_dt_factors()
+        self.diffusivity = diffusivity
+
+        from hedge.timestep.stability import \
+                approximate_rk4_relative_imag_stability_region
+        self.stability_factor = approximate_rk4_relative_imag_stability_region(
+                stepper, stepper_class, stepper_args)
+
+        if reduction_interval < 1:
+            raise ValueError("reduction_interval must be positive")
+        if growth_bound < 1:
+            raise ValueError("growth_bound must be at least 1")
+
+        self.reduction_interval = reduction_interval
+        self.growth_bound = growth_bound
+
+        rcon = discr.run_context
+        comm = getattr(rcon, "communicator", None)
+        if comm is not None and comm.size > 1:
+            self.communicator = comm
+            self.mpi = rcon.mpi
+        else:
+            self.communicator = None
+
+        self.element_wave_speeds = None
+        self.reduced_dt = None
+        self.calls_since_reduction = 0
+        self.pending_check = None
+        self.check_after_submit = False
+
+    def submit_wave_speeds(self, wave_speeds):
+        """Record the element-wise maximum wave speeds *wave_speeds* of the
+        current state. A scalar *wave_speeds* applies to every element.
+        """
+        if numpy.isscalar(wave_speeds):
+            self.element_wave_speeds = numpy.empty(
+                    len(self.first_nodes), dtype=numpy.float64)
+            self.element_wave_speeds.fill(abs(wave_speeds))
+        else:
+            if not isinstance(wave_speeds, numpy.ndarray):
+                wave_speeds = self.discr.convert_volume(
+                        wave_speeds, kind="numpy")
+
+            self.element_wave_speeds = numpy.abs(
+                    wave_speeds[self.first_nodes])
+
+        if self.check_after_submit:
+            self.check_after_submit = False
+            self._start_check()
+
+    def max_wave_speed(self):
+        """Return the largest submitted wave speed on this rank."""
+        if not len(self.element_wave_speeds):
+            return 0
+        return numpy.max(self.element_wave_speeds)
+
+    def local_timestep(self):
+        """Return the largest stable timestep on this rank, given the most
+        recently submitted wave speeds.
+        """
+        if self.element_wave_speeds is None:
+            raise RuntimeError("no wave speeds submitted yet--evaluate "
+                    "the right-hand side first")
+
+        if not len(self.dt_factors):
+            return numpy.inf
+
+        # see JSH/TW, eq. (7.32)
+        element_dts = self.dt_factors / (self.element_wave_speeds
+                + self.diffusivity / self.dt_factors)
+        return self.stability_factor * numpy.min(element_dts)
+
+    # {{{ growth check
+
+    def _start_check(self):
+        send_buf = numpy.array([self.local_timestep()])
+        recv_buf = numpy.empty_like(send_buf)
+
+        if hasattr(self.communicator, "Iallreduce"):
+            request = self.communicator.Iallreduce(
+                    send_buf, recv_buf, op=self.mpi.MIN)
+        else:
+            self.communicator.Allreduce(send_buf, recv_buf, op=self.mpi.MIN)
+            request = None
+
+        self.pending_check = request, send_buf, recv_buf
+
+    def _finish_check(self):
+        """Return the global minimum of the timesteps started by
+        :meth:`_start_check`, or *None* if no check is pending.
+        """
+        if self.pending_check is None:
+            return None
+
+        request, send_buf, recv_buf = self.pending_check
+        self.pending_check = None
+        if request is not None:
+            request.Wait()
+        return recv_buf[0]
+
+    # }}}
+
+    def __call__(self, t=None):
+        if self.communicator is None:
+            return self.local_timestep()
+
+        checked_dt = self._finish_check()
+        self.check_after_submit = True
+
+        if self.reduced_dt is not None:
+            dt = self.reduced_dt / self.growth_bound
+            # wave speeds on some rank may have outgrown growth_bound
+            outgrown = checked_dt is not None and checked_dt < dt
+
+            if (not outgrown
+                    and self.calls_since_reduction < self.reduction_interval):
+                self.calls_since_reduction += 1
+                return dt
+
+        reduced_dt = self.communicator.allreduce(
+                self.local_timestep(), op=self.mpi.MIN)
+
+        if self.reduced_dt is not None and (outgrown
+                or reduced_dt < self.reduced_dt / self.growth_bound):
+            self.reduction_interval = max(1, self.reduction_interval // 2)
+
+        self.reduced_dt = reduced_dt
+        self.calls_since_reduction = 1
+        return reduced_dt
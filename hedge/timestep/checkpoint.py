@@ -0,0 +1,173 @@
+"""Checkpoint files for time stepper state."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+
+import numpy
+
+
+
+
+# Leaf arrays start on multiples of this many bytes, so that they may be
+# used straight out of a memory map.
+_ALIGNMENT = 64
+
+
+
+
+def get_checkpoint_filename_base(filename_base, rcon=None):
+    """Return *filename_base*, with the rank appended if *rcon* runs more
+    than one rank, so that each rank writes its own files.
+    """
+    if rcon is not None and getattr(rcon, "communicator", None) is not None:
+        return "%s-rank%04d" % (filename_base, rcon.rank)
+    else:
+        return filename_base
+
+
+def _encode(value, leaves):
+    from hedge.tools.field_block import FieldBlock
+
+    if value is None:
+        return ("none",)
+    elif isinstance(value, list):
+        return ("list", [_encode(v, leaves) for v in value])
+    elif isinstance(value, tuple):
+        return ("tuple", [_encode(v, leaves) for v in value])
+    elif isinstance(value, numpy.ndarray) and value.dtype == object:
+        return ("object_array", value.shape,
+                [_encode(value[i], leaves) for i in numpy.ndindex(value.shape)])
+    elif isinstance(value, FieldBlock):
+        leaves.append(value)
+        return ("field_block", len(leaves)-1)
+    elif isinstance(value, numpy.ndarray):
+        leaves.append(value)
+        return ("array", len(leaves)-1)
+    else:
+        raise TypeError("cannot checkpoint values of type '%s'--only numpy "
+                "arrays, object arrays and lists or tuples of them are "
+                "supported"
+                % type(value).__name__)
+
+
+def _decode(descr, leaves):
+    from hedge.tools.field_block import FieldBlock
+
+    kind = descr[0]
+    if kind == "none":
+        return None
+    elif kind == "list":
+        return [_decode(d, leaves) for d in descr[1]]
+    elif kind == "tuple":
+        return tuple(_decode(d, leaves) for d in descr[1])
+    elif kind == "object_array":
+        shape, sub_descrs = descr[1:]
+        result = numpy.empty(shape, dtype=object)
+        for i, d in zip(numpy.ndindex(shape), sub_descrs):
+            result[i] = _decode(d, leaves)
+        return result
+    elif kind == "array":
+        return leaves[descr[1]]
+    elif kind == "field_block":
+        return leaves[descr[1]].view(FieldBlock)
+    else:
+        raise ValueError("invalid checkpoint entry '%s'" % kind)
+
+
+def write_checkpoint(filename_base, vectors, meta):
+    """Write *vectors*, a :class:`dict` mapping names to numpy arrays,
+    object arrays of those, or lists or tuples of either, to the raw binary file
+    *filename_base* + ``".dat"``. Their layout and the picklable
+    :class:`dict` *meta* go to *filename_base* + ``".meta"``.
+    """
+    leaves = []
+    descrs = dict(
+            (name, _encode(value, leaves))
+            for name, value in vectors.iteritems())
+
+    leaf_info = []
+    offset = 0
+
+    outf = open(filename_base + ".dat", "wb")
+    try:
+        for leaf in leaves:
+            leaf = numpy.ascontiguousarray(leaf)
+            padding = -offset % _ALIGNMENT
+            outf.write("\0" * padding)
+            offset += padding
+
+            leaf_info.append((leaf.dtype.str, leaf.shape, offset))
+            outf.write(leaf.tostring())
+            offset += leaf.nbytes
+    finally:
+        outf.close()
+
+    from cPickle import dump, HIGHEST_PROTOCOL
+    outf = open(filename_base + ".meta", "wb")
+    try:
+        dump((descrs, leaf_info, meta), outf, HIGHEST_PROTOCOL)
+    finally:
+        outf.close()
+
+
+def read_checkpoint(filename_base, use_mmap=False):
+    """Read back data written by :func:`write_checkpoint`.
+
+    :param use_mmap: if *True*, the returned arrays are copy-on-write
+      views of a memory map of the data file, so that only the parts that
+      are actually used are read. These keep the file open and are read
+      lazily, page by page, on first use. Otherwise, the file is read at
+      once into ordinary arrays.
+    :returns: a tuple *(vectors, meta)*.
+    """
+    from cPickle import load
+    inf = open(filename_base + ".meta", "rb")
+    try:
+        descrs, leaf_info, meta = load(inf)
+    finally:
+        inf.close()
+
+    from os.path import getsize
+    data_filename = filename_base + ".dat"
+    if not getsize(data_filename):
+        # cannot map empty files
+        data = numpy.zeros(0, dtype=numpy.uint8)
+    elif use_mmap:
+        data = numpy.memmap(data_filename, dtype=numpy.uint8, mode="c")
+    else:
+        data = numpy.fromfile(data_filename, dtype=numpy.uint8)
+
+    leaves = []
+    for dtype, shape, offset in leaf_info:
+        dtype = numpy.dtype(dtype)
+        nbytes = dtype.itemsize * int(numpy.prod(shape))
+        leaves.append(data[offset:offset+nbytes].view(dtype).reshape(shape))
+
+    vectors = dict(
+            (name, _decode(descr, leaves))
+            for name, descr in descrs.iteritems())
+
+    return vectors, meta
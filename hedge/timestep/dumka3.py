@@ -37,11 +37,12 @@ BIT1998, Vol. 38, No.2, pp.372-390
 
 import numpy
 import numpy.linalg as la
+from hedge.timestep.base import TimeStepper
 
 
 
 
-class Dumka3TimeStepper(object):
+class Dumka3TimeStepper(TimeStepper):
     """Third-order "DUMKA" timesteppers.
 
     Alexei A. Medovikov, "High order explicit methods for parabolic equations"
@@ -57,8 +58,25 @@ class Dumka3TimeStepper(object):
     # 14 polynomials are available, but polynomial 13 fails
     # accuracy test?
 
+    power_iteration_max_steps = 30
+    power_iteration_tolerance = 0.01
+
     def __init__(self, pol_index=None, dtype=numpy.float64, rcon=None, 
-            vector_primitive_factory=None, atol=0, rtol=0):
+            vector_primitive_factory=None, atol=0, rtol=0,
+            eigenvalue_interval=None, eigenvalue_safety=1.2,
+            eigenvalue_growth_bound=1.1):
+        """
+        :param eigenvalue_interval: If not *None*, estimate the spectral
+          radius of the right-hand side's Jacobian by a power iteration
+          every *eigenvalue_interval* steps and choose the polynomial
+          in each step from that estimate, as in Medovikov's code.
+          The iteration is warm-started from the previous eigenvector
+          estimate. It is also rerun right after a rejected step
+          and after an estimate that grew by more than a factor of
+          *eigenvalue_growth_bound*.
+        :param eigenvalue_safety: factor by which the spectral radius
+          estimate is enlarged before it is used.
+        """
         from warnings import warn
         warn("The DUMKA3 time stepper, unlike the rest of hedge, is "
                 "provided under the GPLv3 license.")
@@ -82,7 +100,16 @@ class Dumka3TimeStepper(object):
         self.atol = atol
         self.rtol = rtol
 
-        self.coeff = numpy.array(_COEF, dtype=self.scalar_type)
+        self.stage_tables = [
+                numpy.asarray(table, dtype=self.scalar_type)
+                for table in _STAGE_TABLES]
+
+        self.eigenvalue_interval = eigenvalue_interval
+        self.eigenvalue_safety = eigenvalue_safety
+        self.eigenvalue_growth_bound = eigenvalue_growth_bound
+        self.spectral_radius = None
+        self.eigenvector = None
+        self.steps_since_estimate = None
 
         # diagnostics init
         from pytools.log import IntervalTimer, EventCounter
@@ -94,6 +121,9 @@ class Dumka3TimeStepper(object):
                 "t_dumka3", "Time spent doing algebra in Dumka3")
         self.flop_counter = EventCounter(
                 "n_flops_dumka3", "Floating point operations performed in Dumka3")
+        self.eigenvalue_rhs_counter = EventCounter(
+                "n_rhs_dumka3_eigenvalue",
+                "RHS evaluations spent on eigenvalue estimation in Dumka3")
 
         self.last_eps = 0
         self.last_dt = 0
@@ -104,21 +134,19 @@ class Dumka3TimeStepper(object):
     def setup(self, eigenvalue_estimate, dt, pol_index=None):
         # find degree of the polynomials to be used
         if pol_index is None:
-            pol_index = 0
-            while (pol_index!=self.POLYNOMIAL_COUNT-1) \
-                    and 2*dt/eigenvalue_estimate > _STAB_REG[pol_index]:
-                pol_index += 1
+            stab_needed = 2*dt/eigenvalue_estimate
+            pol_index = min(
+                    int(numpy.searchsorted(_STAB_REG_ARRAY, stab_needed)),
+                    self.POLYNOMIAL_COUNT-1)
 
             if pol_index > 0 and (
-                (_STAB_REG[pol_index-1]/_N_DEG[pol_index-1])*_N_DEG[pol_index]
-                > 2*dt/eigenvalue_estimate):
+                    _STAB_REG_PER_DEGREE[pol_index-1]*_N_DEG[pol_index]
+                    > stab_needed):
                 pol_index -= 1
         else:
             if pol_index > self.POLYNOMIAL_COUNT:
                 raise ValueError("invalid polynomial index specified")
 
-        n_pol_degree = _N_DEG[pol_index]
-
         if (dt is not None and eigenvalue_estimate is not None) and \
                 dt > _STAB_REG[pol_index]*eigenvalue_estimate/2:
             from warnings import warn
@@ -129,6 +157,85 @@ class Dumka3TimeStepper(object):
     def add_instrumentation(self, logmgr):
         logmgr.add_quantity(self.timer)
         logmgr.add_quantity(self.flop_counter)
+        logmgr.add_quantity(self.eigenvalue_rhs_counter)
+
+    def get_checkpoint_state(self):
+        return {"eigenvector": self.eigenvector}, {
+                "pol_index": self.pol_index,
+                "last_eps": self.last_eps,
+                "last_dt": self.last_dt,
+                "spectral_radius": self.spectral_radius,
+                "steps_since_estimate": self.steps_since_estimate,
+                }
+
+    def set_checkpoint_state(self, vectors, meta):
+        self.pol_index = meta["pol_index"]
+        self.last_eps = meta["last_eps"]
+        self.last_dt = meta["last_dt"]
+        self.eigenvector = vectors["eigenvector"]
+        self.spectral_radius = meta["spectral_radius"]
+        self.steps_since_estimate = meta["steps_since_estimate"]
+
+    def estimate_spectral_radius(self, y, t, rhs, rhs_func):
+        """Estimate the spectral radius of the Jacobian of *rhs_func* at
+        *y* by a power iteration on finite differences, as in ROCK and
+        RKC. *rhs* must be *rhs_func(t, y)*.
+
+        The iteration starts from the eigenvector estimate of the
+        previous call, if any, so that it usually converges within
+        a few right-hand side evaluations.
+        """
+        lc2 = self.linear_combiner_2
+        ip = self.ip
+
+        def norm(a):
+            return numpy.sqrt(ip(a, a))
+
+        v = self.eigenvector
+        if v is None:
+            v = rhs
+        norm_v = norm(v)
+        if norm_v == 0:
+            v = y
+            norm_v = norm(v)
+        if norm_v == 0:
+            if self.spectral_radius is None:
+                raise RuntimeError("cannot start power iteration: "
+                        "state and right-hand side are both zero")
+            return self.spectral_radius
+
+        radius = numpy.sqrt(numpy.finfo(self.dtype).eps)*max(norm(y), 1)
+
+        last_lambda = self.spectral_radius
+        for i in range(self.power_iteration_max_steps):
+            perturbed_rhs = rhs_func(t, lc2((1, y), (radius/norm_v, v)))
+            self.eigenvalue_rhs_counter.add()
+
+            v = lc2((1, perturbed_rhs), (-1, rhs))
+            norm_v = norm(v)
+            lam = norm_v/radius
+
+            if norm_v == 0:
+                break
+            if last_lambda is not None and abs(lam-last_lambda) \
+                    <= self.power_iteration_tolerance*abs(lam):
+                break
+            last_lambda = lam
+
+        if norm_v != 0:
+            self.eigenvector = v
+
+        lam = max(lam, numpy.finfo(self.dtype).tiny)
+
+        if self.spectral_radius is not None and \
+                lam > self.eigenvalue_growth_bound*self.spectral_radius:
+            # spectrum is moving quickly, check again on the next step
+            self.steps_since_estimate = None
+        else:
+            self.steps_since_estimate = 0
+
+        self.spectral_radius = lam
+        return lam
 
     def __call__(self, y, t, dt, rhs_func):
         try:
@@ -145,7 +252,7 @@ class Dumka3TimeStepper(object):
             lc3 = self.linear_combiner_3 = vpf.make_linear_combiner(
                     self.dtype, self.scalar_type, y, arg_count=3)
 
-            if self.adaptive:
+            if self.adaptive or self.eigenvalue_interval is not None:
                 ip = self.ip = vpf.make_inner_product(y)
 
         def norm(a):
@@ -153,16 +260,23 @@ class Dumka3TimeStepper(object):
 
         dt = self.scalar_type(dt)
 
+        rhs = rhs_func(t, y)
+
+        if self.eigenvalue_interval is not None:
+            if (self.steps_since_estimate is None
+                    or self.steps_since_estimate >= self.eigenvalue_interval):
+                self.estimate_spectral_radius(y, t, rhs, rhs_func)
+
+            if self.steps_since_estimate is not None:
+                self.steps_since_estimate += 1
+            self.setup(2/(self.eigenvalue_safety*self.spectral_radius), dt)
+
         pol_index = self.pol_index
         if pol_index is None:
             raise RuntimeError("must call setup() or set pol_index before timestepping")
 
-        rhs = rhs_func(t, y)
-
-        coeff = self.coeff
-
-        start_index = _INDEX_FIRST[pol_index]-1
-        end_index = _INDEX_LAST[pol_index]
+        stage_table = self.stage_tables[pol_index]
+        stage_count = len(stage_table)
 
         start_y = y
         start_rhs = rhs
@@ -172,22 +286,13 @@ class Dumka3TimeStepper(object):
 
         retry_step = True
         while retry_step:
-            n_pol = 0
+            stage_coeffs = dt*stage_table
 
-            for k in range(start_index, end_index):
+            for k in range(stage_count):
                 sub_timer = self.timer.start_sub_timer()
 
-                n_pol = n_pol+3
-                idx = 6*k
-                a_21 = dt*coeff[idx]
-                c_2 = a_21
-                a_31 = dt*coeff[idx+1]
-                a_32 = dt*coeff[idx+2]
-                c_3 = a_31+a_32
-                a_41 = dt*coeff[idx+3]
-                a_42 = dt*coeff[idx+4]
-                a_43 = dt*coeff[idx+5]
-                c_4 = a_41+a_42+a_43
+                last_stage = k+1 == stage_count
+                a_21, r, a_32, a_43, c_2, c_3, c_4 = stage_coeffs[k]
 
                 y = lc2((1, y), (a_21, rhs))
 
@@ -201,14 +306,13 @@ class Dumka3TimeStepper(object):
                 z1 = rhs_func(t2, y)
 
                 sub_timer = self.timer.start_sub_timer()
-                if n_pol == _N_DEG[pol_index]:
-                    r = dt*(coeff[idx+1]-coeff[idx])
+                if last_stage:
                     y = lc3((1, y), (r, rhs), (a_32, z1))
                 else:
                     y = lc2((1, y), (a_32, z1))
 
                 # marker X ******************************
-                if self.adaptive and n_pol == _N_DEG[pol_index]:
+                if self.adaptive and last_stage:
                     tmp_2 = (c_4-c_2)/2
                     z1 = lc2((c_3/2,z1), (-tmp_2,rhs));
                 sub_timer.stop().submit()
@@ -217,7 +321,7 @@ class Dumka3TimeStepper(object):
                 rhs = rhs_func(t+c_3, y)
 
                 sub_timer = self.timer.start_sub_timer()
-                if self.adaptive and n_pol == _N_DEG[pol_index]:
+                if self.adaptive and last_stage:
                     z1 = lc2((tmp_2, rhs), (1,z1))
 
                 # marker Z ******************************
@@ -225,7 +329,7 @@ class Dumka3TimeStepper(object):
                 sub_timer.stop().submit()
 
                 t += c_4
-                if k+1 != end_index or self.adaptive:
+                if not last_stage or self.adaptive:
                     rhs = rhs_func(t, y)
 
             if self.adaptive:
@@ -241,6 +345,9 @@ class Dumka3TimeStepper(object):
                     raise TimeStepUnderflow()
 
                 if retry_step:
+                    if self.eigenvalue_interval is not None:
+                        self.steps_since_estimate = None
+
                     y = start_y
                     rhs = start_rhs
                     dt = next_dt
@@ -250,7 +357,7 @@ class Dumka3TimeStepper(object):
             else:
                 retry_step = False
 
-        self.flop_counter.add((end_index-start_index)*self.dof_count*9)
+        self.flop_counter.add(stage_count*self.dof_count*9)
 
         if self.adaptive:
             return y, t, dt, next_dt
@@ -1103,3 +1210,27 @@ _COEF = [
 _N_DEG = [3,6,9,15,21,27,36,48,63,81,135,189,243,324]
 _INDEX_FIRST = [1,2,4,7,12,19,28,40,56,77,104,149,212,293]
 _INDEX_LAST = [1,3,6,11,18,27,39,55,76,103,148,211,292,400]
+
+
+
+def _make_stage_tables():
+    """Precompute, for each polynomial, the per-stage coefficients
+    *(a_21, a_31-a_21, a_32, a_43, c_2, c_3, c_4)* used by
+    :meth:`Dumka3TimeStepper.__call__`, for unit time step.
+    """
+    coeff = numpy.array(_COEF, dtype=numpy.float64).reshape(-1, 6)
+    a_21, a_31, a_32, a_41, a_42, a_43 = coeff.T
+
+    all_stages = numpy.array([
+        a_21, a_31-a_21, a_32, a_43,
+        a_21, a_31+a_32, a_41+a_42+a_43]).T.copy()
+
+    return [all_stages[first-1:last]
+            for first, last in zip(_INDEX_FIRST, _INDEX_LAST)]
+
+
+
+
+_STAB_REG_ARRAY = numpy.array(_STAB_REG)
+_STAB_REG_PER_DEGREE = _STAB_REG_ARRAY/numpy.array(_N_DEG)
+_STAGE_TABLES = _make_stage_tables()
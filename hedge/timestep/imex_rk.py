@@ -60,6 +60,9 @@ class KennedyCarpenterIMEXRungeKuttaBase(EmbeddedRungeKuttaTimeStepperBase):
             .. math::
 
                 (Id-\alpha A)k = A y_0.
+
+          A :class:`NewtonKrylovStageSolver` solves this for a general
+          right-hand side *f*.
         """
         from hedge.tools import count_dofs
 
@@ -233,3 +236,324 @@ class KennedyCarpenterIMEXARK4(KennedyCarpenterIMEXRungeKuttaBase):
             == len(low_order_coeffs)
             == len(high_order_coeffs)
             == len(c))
+
+
+
+
+class _FlatFieldOperator(object):
+    """Applies an *operator* on (object arrays of) fields to flat vectors
+    as produced by :class:`_FieldFlattener`."""
+
+    def __init__(self, operator, flattener):
+        self.operator = operator
+        self.flattener = flattener
+
+    @property
+    def dtype(self):
+        return self.flattener.dtype
+
+    @property
+    def shape(self):
+        return self.flattener.size, self.flattener.size
+
+    def __call__(self, operand):
+        return self.flattener.flatten(
+                self.operator(self.flattener.unflatten(operand)))
+
+
+
+
+class _FieldFlattener(object):
+    def __init__(self, sample):
+        from hedge.tools import is_obj_array
+        if is_obj_array(sample):
+            self.shapes = [fld.shape for fld in sample]
+            self.dtype = sample[0].dtype
+        else:
+            # e.g. a FieldBlock
+            self.shape = sample.shape
+            self.array_type = type(sample)
+            self.shapes = None
+            self.dtype = sample.dtype
+        self.size = len(self.flatten(sample))
+
+    def flatten(self, fields):
+        if self.shapes is None:
+            return numpy.asarray(fields).ravel()
+        return numpy.hstack([numpy.ravel(fld) for fld in fields])
+
+    def unflatten(self, vec):
+        if self.shapes is None:
+            return vec.reshape(self.shape).view(self.array_type)
+
+        result = numpy.empty(len(self.shapes), dtype=object)
+        start = 0
+        for i, shape in enumerate(self.shapes):
+            size = int(numpy.prod(shape))
+            result[i] = vec[start:start+size].reshape(shape)
+            start += size
+        return result
+
+
+
+
+class _JacobianFreeStageOperator(object):
+    """Applies :math:`Id - \\alpha \\partial f/\\partial y` at *y* to flat
+    vectors, using a finite difference of *solver.rhs*."""
+
+    def __init__(self, solver, t, y, flat_f, y_norm, alpha):
+        self.solver = solver
+        self.t = t
+        self.y = y
+        self.flat_f = flat_f
+        self.alpha = alpha
+
+        from math import sqrt
+        self.fd_scale = sqrt(numpy.finfo(solver.flattener.dtype).eps) \
+                * max(y_norm, 1)
+
+    @property
+    def dtype(self):
+        return self.solver.flattener.dtype
+
+    @property
+    def shape(self):
+        return self.solver.flattener.size, self.solver.flattener.size
+
+    def __call__(self, operand):
+        solver = self.solver
+        solver.jacobian_product_counter.add()
+
+        operand_norm, = solver._norms(operand)
+        if operand_norm == 0:
+            return operand
+
+        eps = self.fd_scale/operand_norm
+        flattener = solver.flattener
+        return operand - self.alpha/eps*(flattener.flatten(solver.rhs(
+            self.t, self.y + eps*flattener.unflatten(operand)))
+            - self.flat_f)
+
+
+
+
+class NewtonKrylovStageSolver(object):
+    """Solves the implicit stage equations
+
+    .. math::
+
+        k = f(t, y_0 + \\alpha k)
+
+    of :class:`KennedyCarpenterIMEXRungeKuttaBase` by a Jacobian-free
+    Newton-Krylov method, so that an instance may be passed as
+    *rhs_impl*.
+
+    :param rhs: the implicit right-hand side *f(t, y)*, taking and
+      returning volume vectors or object arrays of them.
+    :param precon_factory: if given, called as *precon_factory(t, y0,
+      alpha)* to obtain an approximate inverse of
+      :math:`Id - \\alpha \\partial f/\\partial y`, which is applied to
+      fields like *y0*. It is reused across the stages of a step (which
+      share *alpha* in the SDIRK schemes of Kennedy and Carpenter) and
+      across steps of equal size, and rebuilt when *alpha* changes, when
+      it has been used for *precon_max_age* stage solves (if given), or
+      when it appears to have gone stale, see *precon_growth_factor*.
+    :param precon_growth_factor: the preconditioner is rebuilt before the
+      next stage solve once a solve needs more than this factor times the
+      Newton iterations or Jacobian-vector products of the first solve
+      after the last rebuild, or fails to converge.
+    :param rcon: the run context, across whose ranks inner products are
+      summed.
+
+    Jacobian-vector products are taken as finite differences of *rhs*.
+    Each Newton correction is found by :func:`hedge.iterative.gmres` to a
+    relative residual of *krylov_tol*. Its initial guess is the best
+    combination of the last *recycle_count* corrections, judged by the
+    right-hand sides they were solved for, and the Newton iteration
+    starts from the previous stage value. Newton iterations and
+    Jacobian-vector products are counted by log quantities, see
+    :meth:`add_instrumentation`.
+    """
+
+    def __init__(self, rhs, newton_tol=1e-8, max_newton_iterations=10,
+            krylov_tol=1e-3, krylov_restart=20, max_krylov_iterations=None,
+            recycle_count=4, precon_factory=None, precon_max_age=None,
+            precon_growth_factor=2, rcon=None):
+        self.rhs = rhs
+        self.newton_tol = newton_tol
+        self.max_newton_iterations = max_newton_iterations
+        self.krylov_tol = krylov_tol
+        self.krylov_restart = krylov_restart
+        self.max_krylov_iterations = max_krylov_iterations
+        self.recycle_count = recycle_count
+        self.precon_factory = precon_factory
+        self.precon_max_age = precon_max_age
+        self.precon_growth_factor = precon_growth_factor
+
+        if rcon is None:
+            from hedge.backends import SerialRunContext
+            rcon = SerialRunContext()
+        self.rcon = rcon
+
+        from hedge.iterative import GlobalSumReduction
+        self.reduction = GlobalSumReduction(rcon)
+
+        from pytools.log import EventCounter
+        self.newton_counter = EventCounter("n_newton_imex",
+                "Newton iterations in implicit IMEX stage solves")
+        self.jacobian_product_counter = EventCounter("n_jac_vec_imex",
+                "Jacobian-vector products in implicit IMEX stage solves")
+
+        self.flattener = None
+        self.precon = None
+        self.precon_alpha = None
+        self.precon_age = 0
+        self.precon_baseline = None
+        self.precon_stale = False
+        self.last_stage_value = None
+        self.recycled = []
+
+    def add_instrumentation(self, logmgr):
+        logmgr.add_quantity(self.newton_counter)
+        logmgr.add_quantity(self.jacobian_product_counter)
+
+    def _norms(self, *vectors):
+        return numpy.sqrt(numpy.abs(self.reduction(
+            [numpy.vdot(vec, vec) for vec in vectors])))
+
+    def _recycled_guess(self, b):
+        """Return the combination of recycled corrections whose
+        right-hand sides best approximate *b*."""
+        if not self.recycled:
+            return None
+
+        corrections, rhss = [numpy.array(x) for x in zip(*self.recycled)]
+        count = len(rhss)
+        reduced = self.reduction(numpy.hstack([
+            numpy.dot(rhss.conj(), rhss.T).ravel(),
+            numpy.dot(rhss.conj(), b)]))
+        coefficients = numpy.linalg.lstsq(
+                reduced[:count**2].reshape(count, count),
+                reduced[count**2:], rcond=1e-10)[0]
+        return numpy.dot(coefficients, corrections)
+
+    def _precon_needs_rebuild(self, alpha):
+        return (alpha != self.precon_alpha
+                or self.precon_stale
+                or (self.precon_max_age is not None
+                    and self.precon_age >= self.precon_max_age))
+
+    def _record_solve_cost(self, costs, converged=True):
+        """Mark the preconditioner as stale if the stage solve that took
+        *costs*, a tuple of Newton iteration and Jacobian-vector product
+        counts, was much more expensive than the first one using it."""
+        self.precon_age += 1
+        if self.precon is None:
+            return
+
+        if not converged:
+            self.precon_stale = True
+        elif not costs[0]:
+            # converged right away, says nothing about the preconditioner
+            pass
+        elif self.precon_baseline is None:
+            self.precon_baseline = costs
+        elif any(cost > self.precon_growth_factor*max(baseline, 1)
+                for cost, baseline in zip(costs, self.precon_baseline)):
+            self.precon_stale = True
+
+    def __call__(self, t, y0, alpha):
+        if not alpha:
+            return self.rhs(t, y0)
+
+        if self.flattener is None:
+            self.flattener = _FieldFlattener(y0)
+        flatten = self.flattener.flatten
+        unflatten = self.flattener.unflatten
+
+        if (self.precon_factory is not None
+                and self._precon_needs_rebuild(alpha)):
+            self.precon = _FlatFieldOperator(
+                    self.precon_factory(t, y0, alpha), self.flattener)
+            self.precon_alpha = alpha
+            self.precon_age = 0
+            self.precon_baseline = None
+            self.precon_stale = False
+
+        start_events = (self.newton_counter.events,
+                self.jacobian_product_counter.events)
+
+        def solve_costs():
+            return (self.newton_counter.events - start_events[0],
+                    self.jacobian_product_counter.events - start_events[1])
+
+        def residual(k):
+            y = y0 + alpha*k
+            flat_f = flatten(self.rhs(t, y))
+            b = flat_f - flatten(k)
+            return (y, flat_f, b) + tuple(self._norms(b, flat_f, flatten(y)))
+
+        # predict the stage value to be the previous one
+        if self.last_stage_value is None:
+            k = 0*y0
+        else:
+            k = (self.last_stage_value - y0)/alpha
+        y, flat_f, b, b_norm, f_norm, y_norm = residual(k)
+
+        from hedge.iterative import gmres, ConvergenceError
+        try:
+            for newton_it in range(self.max_newton_iterations):
+                if b_norm <= self.newton_tol*f_norm:
+                    self.last_stage_value = y
+                    self._record_solve_cost(solve_costs())
+                    return k
+
+                self.newton_counter.add()
+
+                jacobian = _JacobianFreeStageOperator(self, t, y, flat_f,
+                        y_norm, alpha)
+
+                # solve for the deviation from the recycled guess, to a
+                # tolerance relative to b
+                guess = self._recycled_guess(b)
+                if guess is None:
+                    correction_rhs = b
+                    correction_norm = b_norm
+                else:
+                    correction_rhs = b - jacobian(guess)
+                    correction_norm, = self._norms(correction_rhs)
+
+                if correction_norm <= self.krylov_tol*b_norm:
+                    correction = guess
+                else:
+                    correction = gmres(self.rcon, jacobian, correction_rhs,
+                            precon=self.precon,
+                            tol=self.krylov_tol*b_norm/correction_norm,
+                            restart=self.krylov_restart,
+                            max_iterations=self.max_krylov_iterations)
+                    if guess is not None:
+                        correction = correction + guess
+
+                if self.recycle_count:
+                    self.recycled.append((correction, b))
+                    del self.recycled[:-self.recycle_count]
+
+                # backtrack until the residual decreases sufficiently
+                correction = unflatten(correction)
+                step = 1
+                while True:
+                    new_k = k + step*correction
+                    new_residual = residual(new_k)
+                    if new_residual[3] <= (1-1e-4*step)*b_norm or step < 1e-3:
+                        break
+                    step /= 2
+
+                k = new_k
+                y, flat_f, b, b_norm, f_norm, y_norm = new_residual
+
+            raise ConvergenceError("Newton iteration for implicit stage "
+                    "failed to converge")
+        except ConvergenceError:
+            # also if GMRES failed: a better preconditioner might help
+            self._record_solve_cost(solve_costs(), converged=False)
+            raise
@@ -0,0 +1,522 @@
+"""Local time stepping: multirate Adams-Bashforth on element rate classes."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import numpy
+from pytools import Record
+from hedge.timestep.base import TimeStepper
+from hedge.timestep.ab import \
+        make_generic_ab_coefficients, \
+        make_ab_coefficients
+
+
+# {{{ element binning
+
+def estimate_element_dts(discr, max_eigenvalue,
+        stepper=None, stepper_class=None, stepper_args=()):
+    """Estimate the largest stable timestep of each element of *discr*,
+    in the same way as
+    :meth:`hedge.models.Operator.estimate_timestep` does for the whole
+    discretization.
+
+    :param max_eigenvalue: the local wave speed, either as a scalar or as a
+      volume vector, whose maximum absolute value on each element is used.
+    :returns: an array indexed by element id.
+    """
+    from hedge.timestep.stability import \
+            approximate_rk4_relative_imag_stability_region
+    stability_factor = approximate_rk4_relative_imag_stability_region(
+            stepper, stepper_class, stepper_args)
+
+    first_nodes, dt_factors = discr.element_dt_factors()
+
+    if isinstance(max_eigenvalue, numpy.ndarray):
+        el_max_eigenvalues = numpy.array([
+            numpy.max(numpy.abs(max_eigenvalue[rng]))
+            for eg in discr.element_groups
+            for rng in eg.ranges])
+    else:
+        el_max_eigenvalues = max_eigenvalue
+
+    # element_dt_factors() is in element group order, not by element id
+    element_ids = numpy.array([
+        el.id for eg in discr.element_groups for el in eg.members],
+        dtype=numpy.intp)
+
+    result = numpy.empty(len(discr.mesh.elements), dtype=numpy.float64)
+    result[element_ids] = stability_factor * dt_factors / el_max_eigenvalues
+
+    return result
+
+
+def bin_elements_by_dt(element_dts, max_rate_count=None):
+    """Assign each element a rate exponent *r* such that the element is
+    stable when stepped with ``macro_dt / 2**r``.
+
+    :param element_dts: per-element stable timesteps, e.g. from
+      :func:`estimate_element_dts`.
+    :param max_rate_count: if not *None*, the largest number of distinct
+      rates used. *macro_dt* is reduced as necessary to keep the smallest
+      elements stable.
+    :returns: a tuple *(macro_dt, rates)*, where *rates* is an integer array
+      indexed by element id.
+    """
+    element_dts = numpy.asarray(element_dts, dtype=numpy.float64)
+
+    macro_dt = numpy.max(element_dts)
+    if max_rate_count is not None:
+        macro_dt = min(macro_dt,
+                2**(max_rate_count-1)*numpy.min(element_dts))
+
+    rates = numpy.ceil(numpy.log2(macro_dt/element_dts) - 1e-12)
+    rates = numpy.maximum(rates, 0).astype(numpy.int32)
+
+    return macro_dt, rates
+
+# }}}
+
+
+# {{{ rate classes
+
+# Node indices refer to the last axis, so that these also apply to
+# hedge.tools.field_block.FieldBlock states.
+
+def _gather(field, indices):
+    from pytools.obj_array import with_object_array_or_scalar
+    return with_object_array_or_scalar(lambda f: f[..., indices], field)
+
+
+def _scatter(dest, indices, values):
+    from hedge.tools import is_obj_array
+    if is_obj_array(dest):
+        from pytools import indices_in_shape
+        for i in indices_in_shape(dest.shape):
+            dest[i][indices] = values[i]
+    else:
+        dest[..., indices] = values
+
+
+def _empty_like(sample, size):
+    def empty_like(f):
+        return numpy.empty(f.shape[:-1] + (size,), dtype=f.dtype) \
+                .view(type(f))
+
+    from pytools.obj_array import with_object_array_or_scalar
+    return with_object_array_or_scalar(empty_like, sample)
+
+
+def _linear_comb(coefficients, vectors):
+    from operator import add
+    return reduce(add,
+            (coeff * v for coeff, v in
+                zip(coefficients, vectors)))
+
+
+class RateClass(Record):
+    """
+    .. attribute:: rate
+
+        The rate exponent. Elements of this class take steps of size
+        ``macro_dt / 2**rate``.
+
+    .. attribute:: element_ids
+
+        Global ids of the elements in this class.
+
+    .. attribute:: nodes
+
+        Global node indices of this class, defining the order of the nodes in
+        this class's state vectors.
+
+    .. attribute:: discr
+
+        A discretization of this class's elements, plus a halo of
+        neighboring elements.
+
+    .. attribute:: own_in_sub
+
+        Indices of :attr:`nodes` in vectors on :attr:`discr`.
+
+    .. attribute:: halo_sources
+
+        A list of tuples *(class_index, indices_in_sub, indices_in_class)*
+        describing where on :attr:`discr` the halo values taken from other
+        classes go.
+
+    .. attribute:: rhs
+    """
+
+
+def make_rate_classes(discr, element_rates, make_rhs, halo_layers=1):
+    """Split *discr* into one :class:`RateClass` per distinct rate in
+    *element_rates*.
+
+    Each class gets its own discretization, which covers the class's
+    elements plus *halo_layers* layers of neighboring elements. Right-hand
+    sides evaluated on it are correct on the class's own elements as long as
+    the operator's stencil does not reach further than the halo, i.e. one
+    layer for first-order operators.
+
+    :param make_rhs: a function that takes a discretization and returns a
+      right-hand side function *rhs(t, y)* on it, e.g. the ``bind`` method
+      of a :class:`hedge.models.Operator`.
+    """
+    if hasattr(discr, "parallel_discr") or hasattr(discr, "subdiscr"):
+        raise NotImplementedError("local time stepping on distributed "
+                "discretizations")
+
+    mesh = discr.mesh
+
+    neighbors = [set() for el in mesh.elements]
+    for (e1, f1), (e2, f2) in mesh.interfaces:
+        neighbors[e1.id].add(e2.id)
+        neighbors[e2.id].add(e1.id)
+
+    from pytools import single_valued
+    ldis = single_valued(eg.local_discretization for eg in discr.element_groups)
+
+    def el_node_indices(some_discr, el_id):
+        rng = some_discr.find_el_range(el_id)
+        return numpy.arange(rng.start, rng.stop, dtype=numpy.intp)
+
+    distinct_rates = sorted(set(element_rates))
+    el_to_class = numpy.empty(len(mesh.elements), dtype=numpy.intp)
+    for class_idx, rate in enumerate(distinct_rates):
+        el_to_class[numpy.asarray(element_rates) == rate] = class_idx
+
+    # position of each global node within its class's state vector
+    node_to_class_index = numpy.empty(len(discr), dtype=numpy.intp)
+
+    class_element_ids = []
+    class_nodes = []
+    for class_idx in range(len(distinct_rates)):
+        element_ids = [el.id for el in mesh.elements
+                if el_to_class[el.id] == class_idx]
+        nodes = numpy.hstack([el_node_indices(discr, el_id)
+            for el_id in element_ids])
+        node_to_class_index[nodes] = numpy.arange(len(nodes))
+
+        class_element_ids.append(element_ids)
+        class_nodes.append(nodes)
+
+    from hedge.partition import partition_mesh
+
+    result = []
+    for class_idx, rate in enumerate(distinct_rates):
+        element_ids = class_element_ids[class_idx]
+
+        # grow the halo
+        covered = set(element_ids)
+        front = covered
+        for i in range(halo_layers):
+            front = set(nb for el_id in front for nb in neighbors[el_id]) \
+                    - covered
+            covered |= front
+
+        part_data, = [pd for pd in partition_mesh(mesh,
+            [0 if el.id in covered else 1 for el in mesh.elements],
+            part_bdry_tag_factory=lambda part: "lts_halo_boundary")
+            if pd.part_nr == 0]
+
+        sub_discr = type(discr)(part_data.mesh,
+                local_discretization=ldis,
+                quad_min_degrees=discr.quad_min_degrees,
+                default_scalar_type=discr.default_scalar_type,
+                run_context=discr.run_context)
+
+        own_in_sub = numpy.hstack([
+            el_node_indices(sub_discr, part_data.global2local_elements[el_id])
+            for el_id in element_ids])
+
+        halo_el_ids = sorted(covered - set(element_ids))
+        halo_sources = []
+        for src_class_idx in range(len(distinct_rates)):
+            src_el_ids = [el_id for el_id in halo_el_ids
+                    if el_to_class[el_id] == src_class_idx]
+            if not src_el_ids:
+                continue
+
+            halo_sources.append((
+                src_class_idx,
+                numpy.hstack([
+                    el_node_indices(sub_discr,
+                        part_data.global2local_elements[el_id])
+                    for el_id in src_el_ids]),
+                node_to_class_index[numpy.hstack([
+                    el_node_indices(discr, el_id)
+                    for el_id in src_el_ids])]))
+
+        result.append(RateClass(
+            rate=rate,
+            element_ids=element_ids,
+            nodes=class_nodes[class_idx],
+            discr=sub_discr,
+            own_in_sub=own_in_sub,
+            halo_sources=halo_sources,
+            rhs=make_rhs(sub_discr)))
+
+    return result
+
+# }}}
+
+
+# {{{ time stepper
+
+class LocalTimeSteppingAdamsBashforth(TimeStepper):
+    """Advances groups of elements with power-of-two fractions of a macro
+    timestep, using a multirate Adams-Bashforth scheme.
+
+    Elements are binned into rate classes by :func:`bin_elements_by_dt`.
+    Each class takes steps of size ``macro_dt / 2**rate`` using its own
+    history of right-hand sides. Whenever a class needs its right-hand side,
+    the states of neighboring classes are taken from their current step if
+    they are at the same time, or else interpolated in time from their own
+    Adams-Bashforth histories. Right-hand sides of a class are only
+    evaluated on the class's elements and a small halo, see
+    :func:`make_rate_classes`.
+
+    Usage::
+
+        element_dts = estimate_element_dts(discr,
+                op.max_eigenvalue(t, u, discr),
+                stepper_class=AdamsBashforthTimeStepper,
+                stepper_args=(order,))
+        stepper = LocalTimeSteppingAdamsBashforth(
+                discr, op.bind, order, element_dts)
+        rhs = op.bind(discr)
+
+        for step, t, dt in times_and_steps(
+                max_dt_getter=lambda t: stepper.macro_dt, ...):
+            u = stepper(u, t, dt, rhs)
+
+    *rhs* is the right-hand side on the whole discretization. It is only used
+    to start up the scheme with *startup_stepper*, at the finest rate.
+
+    Only steps of size :attr:`macro_dt` may be taken.
+    """
+
+    def __init__(self, discr, make_rhs, order, element_dts,
+            max_rate_count=4, halo_layers=1, startup_stepper=None):
+        self.discr = discr
+        self.order = order
+
+        self.macro_dt, self.element_rates = bin_elements_by_dt(
+                element_dts, max_rate_count)
+        self.rate_classes = make_rate_classes(
+                discr, self.element_rates, make_rhs, halo_layers)
+
+        self.max_rate = max(rc.rate for rc in self.rate_classes)
+
+        # step size of each class, in units of the finest step
+        self.fine_steps_per_step = [2**(self.max_rate - rc.rate)
+                for rc in self.rate_classes]
+
+        self.ab_coefficients = make_ab_coefficients(order)
+        self.interp_coefficients_cache = {}
+
+        # states, right-hand side histories (newest first), and the time
+        # level (in finest steps) of state and newest history entry
+        self.states = [None] * len(self.rate_classes)
+        self.histories = [[] for rc in self.rate_classes]
+        self.state_levels = [0] * len(self.rate_classes)
+        self.history_levels = [0] * len(self.rate_classes)
+        self.level = 0
+        self.t_start = None
+
+        if startup_stepper is not None:
+            self.startup_stepper = startup_stepper
+        else:
+            from hedge.timestep.runge_kutta import LSRK4TimeStepper
+            self.startup_stepper = LSRK4TimeStepper()
+
+        self.startup_level = 0
+
+        from pytools.log import EventCounter
+        self.rhs_element_counter = EventCounter("n_lts_rhs_elements",
+                "Number of element right-hand side evaluations in LTS")
+
+    def get_stability_relevant_init_args(self):
+        return (self.order,)
+
+    def add_instrumentation(self, logmgr):
+        logmgr.add_quantity(self.rhs_element_counter)
+
+    @property
+    def fine_dt(self):
+        return self.macro_dt / 2**self.max_rate
+
+    def level_to_time(self, level):
+        return self.t_start + level*self.fine_dt
+
+    # {{{ startup
+
+    def run_startup(self, y, t, rhs):
+        fine_steps = 2**self.max_rate
+        final_level = (self.order-1)*fine_steps
+
+        def record_history(level, y):
+            rhs_value = None
+            for i, rc in enumerate(self.rate_classes):
+                step = self.fine_steps_per_step[i]
+                if (level % step == 0
+                        and level >= final_level - (self.order-1)*step):
+                    if rhs_value is None:
+                        rhs_value = rhs(self.level_to_time(level), y)
+                        self.rhs_element_counter.add(len(self.discr.mesh.elements))
+
+                    self.histories[i].insert(0, _gather(rhs_value, rc.nodes))
+
+        if self.startup_level == 0:
+            record_history(0, y)
+
+        for i in range(fine_steps):
+            if self.startup_level == final_level:
+                break
+
+            y = self.startup_stepper(y, self.level_to_time(self.startup_level),
+                    self.fine_dt, rhs)
+            self.startup_level += 1
+            record_history(self.startup_level, y)
+
+        if self.startup_level == final_level:
+            for i in range(len(self.rate_classes)):
+                assert len(self.histories[i]) == self.order
+                self.state_levels[i] = self.history_levels[i] = final_level
+
+            self.level = final_level
+
+            # here's some memory we won't need any more
+            self.startup_stepper = None
+
+        return y
+
+    # }}}
+
+    # {{{ multirate AB step
+
+    def get_interp_coefficients(self, theta):
+        try:
+            return self.interp_coefficients_cache[theta]
+        except KeyError:
+            result = self.interp_coefficients_cache[theta] = \
+                    make_generic_ab_coefficients(
+                            numpy.arange(0, -self.order, -1), 0, theta)
+            return result
+
+    def class_dt(self, i):
+        return self.fine_steps_per_step[i]*self.fine_dt
+
+    def advance(self, i):
+        self.states[i] = self.states[i] + self.class_dt(i)*_linear_comb(
+                self.ab_coefficients, self.histories[i])
+        self.state_levels[i] += self.fine_steps_per_step[i]
+
+    def get_halo_values(self, src_idx, indices, level):
+        y = _gather(self.states[src_idx], indices)
+
+        src_level = self.state_levels[src_idx]
+        if src_level == level:
+            return y
+
+        assert self.history_levels[src_idx] == src_level < level
+
+        theta = (level - src_level)/self.fine_steps_per_step[src_idx]
+        return y + self.class_dt(src_idx)*_linear_comb(
+                self.get_interp_coefficients(theta),
+                [_gather(f, indices) for f in self.histories[src_idx]])
+
+    def evaluate_rhs(self, i, level):
+        rc = self.rate_classes[i]
+
+        sub_y = _empty_like(self.states[i], len(rc.discr))
+        _scatter(sub_y, rc.own_in_sub, self.states[i])
+        for src_idx, indices_in_sub, indices_in_src in rc.halo_sources:
+            _scatter(sub_y, indices_in_sub,
+                    self.get_halo_values(src_idx, indices_in_src, level))
+
+        rhs_value = _gather(
+                rc.rhs(self.level_to_time(level), sub_y), rc.own_in_sub)
+        self.rhs_element_counter.add(len(rc.discr.mesh.elements))
+
+        hist = self.histories[i]
+        hist.pop()
+        hist.insert(0, rhs_value)
+        self.history_levels[i] = level
+
+    def run_ab(self, y):
+        for i, rc in enumerate(self.rate_classes):
+            self.states[i] = _gather(y, rc.nodes)
+
+        fine_steps = 2**self.max_rate
+        for substep in range(fine_steps):
+            level = self.level + substep
+            due = [i for i in range(len(self.rate_classes))
+                    if substep % self.fine_steps_per_step[i] == 0]
+
+            for i in due:
+                if self.state_levels[i] < level:
+                    self.advance(i)
+                assert self.state_levels[i] == level
+
+            for i in due:
+                if self.history_levels[i] < level:
+                    self.evaluate_rhs(i, level)
+
+        self.level += fine_steps
+        for i in range(len(self.rate_classes)):
+            self.advance(i)
+            assert self.state_levels[i] == self.level
+
+        result = _empty_like(y, len(self.discr))
+        for rc, state in zip(self.rate_classes, self.states):
+            _scatter(result, rc.nodes, state)
+
+        return result
+
+    # }}}
+
+    def __call__(self, y, t, dt, rhs):
+        if abs(dt - self.macro_dt) > 1e-10*self.macro_dt:
+            raise ValueError("local time stepping only supports steps of "
+                    "size macro_dt")
+
+        if self.t_start is None:
+            self.t_start = t
+
+        if self.startup_stepper is not None:
+            if self.order == 1:
+                # forward Euler, no need for the startup stepper
+                y = self.run_startup(y, t, rhs)
+                assert self.startup_stepper is None
+            else:
+                return self.run_startup(y, t, rhs)
+
+        return self.run_ab(y)
+
+# }}}
+
+
+# vim: foldmethod=marker
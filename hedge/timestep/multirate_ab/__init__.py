@@ -172,6 +172,35 @@ class TwoRateAdamsBashforthTimeStepper(TimeStepper):
         else:
             return self.run_ab(ys, t, rhss)
 
+    def get_checkpoint_state(self):
+        vectors = {"histories": [self.histories[hn] for hn in HIST_NAMES]}
+        startup_complete = self.startup_stepper is None
+        if not startup_complete:
+            vectors["startup_history"] = self.startup_history
+
+        return vectors, {
+                "orders": [self.orders[hn] for hn in HIST_NAMES],
+                "substep_count": self.substep_count,
+                "startup_complete": startup_complete,
+                }
+
+    def set_checkpoint_state(self, vectors, meta):
+        if (meta["orders"] != [self.orders[hn] for hn in HIST_NAMES]
+                or meta["substep_count"] != self.substep_count):
+            raise ValueError("checkpoint was written with different "
+                    "orders or substep count")
+
+        self.histories = dict(zip(HIST_NAMES, vectors["histories"]))
+
+        if meta["startup_complete"]:
+            self.startup_stepper = None
+            try:
+                del self.startup_history
+            except AttributeError:
+                pass
+        else:
+            self.startup_history = vectors["startup_history"]
+
     def run_ab(self, ys, t, rhss):
         step_evaluator = _MRABEvaluator(self, ys, t, rhss)
         step_evaluator.run()
@@ -38,6 +38,10 @@ class LSRK4TimeStepper(TimeStepper):
     or
     Carpenter, M.H., and Kennedy, C.A., Fourth-order-2N-storage
     Runge-Kutta schemes, NASA Langley Tech Report TM 109112, 1994
+
+    If *residual_dtype* is given, the residual is kept in that dtype,
+    so that e.g. a single-precision state is advanced by increments
+    accumulated in double precision.
     """
 
     _RK4A = [
@@ -70,7 +74,7 @@ class LSRK4TimeStepper(TimeStepper):
     adaptive = False
 
     def __init__(self, dtype=numpy.float64, rcon=None,
-            vector_primitive_factory=None):
+            vector_primitive_factory=None, residual_dtype=None):
         if vector_primitive_factory is None:
             from hedge.vector_primitives import VectorPrimitiveFactory
             self.vector_primitive_factory = VectorPrimitiveFactory()
@@ -89,8 +93,14 @@ class LSRK4TimeStepper(TimeStepper):
 
         from pytools import match_precision
         self.dtype = numpy.dtype(dtype)
-        self.scalar_dtype = match_precision(
-                numpy.dtype(numpy.float64), self.dtype)
+        if residual_dtype is None:
+            self.residual_dtype = None
+            self.scalar_dtype = match_precision(
+                    numpy.dtype(numpy.float64), self.dtype)
+        else:
+            self.residual_dtype = numpy.dtype(residual_dtype)
+            self.scalar_dtype = match_precision(
+                    numpy.dtype(numpy.float64), self.residual_dtype)
         self.coeffs = numpy.array([self._RK4A, self._RK4B, self._RK4C],
                 dtype=self.scalar_dtype).T
 
@@ -106,22 +116,27 @@ class LSRK4TimeStepper(TimeStepper):
             self.residual
         except AttributeError:
             self.residual = 0*rhs(t, y)
+            if self.residual_dtype is not None:
+                from hedge.tools import cast_field
+                self.residual = cast_field(self.residual, self.residual_dtype)
+
             from hedge.tools import count_dofs
             self.dof_count = count_dofs(self.residual)
 
-            self.linear_combiner = self.vector_primitive_factory\
-                    .make_linear_combiner(self.dtype, self.scalar_dtype,
-                            y, arg_count=2)
+            self.updater = self.vector_primitive_factory\
+                    .make_low_storage_rk_updater(self.dtype, self.scalar_dtype,
+                            y, residual_dtype=self.residual_dtype)
 
-        lc = self.linear_combiner
-
-        for a, b, c in self.coeffs:
+        for i, (a, b, c) in enumerate(self.coeffs):
             this_rhs = rhs(t + c*dt, y)
 
             sub_timer = self.timer.start_sub_timer()
-            self.residual = lc((a, self.residual), (dt, this_rhs))
+            # The first stage writes the new state to a fresh vector, so
+            # that the caller's *y* is left alone. Later stages update that
+            # vector in place.
+            y = self.updater(a, self.residual, dt, this_rhs, b, y,
+                    preserve_y=(i == 0))
             del this_rhs
-            y = lc((1, y), (b, self.residual))
             sub_timer.stop().submit()
 
         # 5 is the number of flops above, *NOT* the number of stages,
@@ -247,72 +262,114 @@ class EmbeddedRungeKuttaTimeStepperBase(TimeStepper):
 
 
 class EmbeddedButcherTableauTimeStepperBase(EmbeddedRungeKuttaTimeStepperBase):
-    def __call__(self, y, t, dt, rhs, reject_hook=None):
-        from hedge.tools import count_dofs
+    """
+    If the last stage of the tableau evaluates the right-hand side at the
+    high-order solution ("first same as last"), that evaluation is reused
+    as the first stage of the next step. Stage inputs and the low-order
+    solution used for error estimation are written into storage that is
+    kept across stages and steps.
+    """
+
+    def __init__(self, *args, **kwargs):
+        EmbeddedRungeKuttaTimeStepperBase.__init__(self, *args, **kwargs)
+
+        stage_count = len(self.butcher_tableau)
+
+        def nonzero_terms(coeffs):
+            return [(i, coeff) for i, coeff in enumerate(coeffs) if coeff]
+
+        self.stage_terms = [
+                (c, nonzero_terms(coeffs))
+                for c, coeffs in self.butcher_tableau]
+        self.high_order_terms = nonzero_terms(self.high_order_coeffs)
+        self.low_order_terms = nonzero_terms(self.low_order_coeffs)
+
+        last_c, last_coeffs = self.butcher_tableau[-1]
+        last_coeffs = list(last_coeffs) + [0]*(stage_count-len(last_coeffs))
+        self.first_same_as_last = (
+                (self.adaptive or self.use_high_order)
+                and last_c == 1
+                and last_coeffs == list(self.high_order_coeffs))
+
+        self.last_rhs = None
+        self.dof_count = None
+        self.norm = None
+
+        self.stage_storage = None
+        self.low_order_storage = None
 
+    def __call__(self, y, t, dt, rhs, reject_hook=None):
         # {{{ preparation
-        try:
-            self.last_rhs
-        except AttributeError:
+        if self.last_rhs is None:
             self.last_rhs = rhs(t, y)
-            self.dof_count = count_dofs(self.last_rhs)
 
-            if self.adaptive:
-                self.norm = self.vector_primitive_factory \
-                        .make_maximum_norm(self.last_rhs)
-            else:
-                self.norm = None
+            if self.dof_count is None:
+                from hedge.tools import count_dofs
+                self.dof_count = count_dofs(self.last_rhs)
+
+        if self.adaptive and self.norm is None:
+            self.norm = self.vector_primitive_factory \
+                    .make_maximum_norm(self.last_rhs)
 
         # }}}
 
         flop_count = [0]
+        last_stage = len(self.stage_terms) - 1
+
+        def combine(terms, result=None):
+            args = [(1, y)] + [(dt*coeff, rhss[j]) for j, coeff in terms]
+            flop_count[0] += len(args)*2 - 1
+            return self.get_linear_combiner(
+                    len(args), self.last_rhs)(*args, result=result)
 
         while True:
-            rhss = []
+            rhss = [self.last_rhs]
+            fsal_y = None
 
             # {{{ stage loop
 
-            for i, (c, coeffs) in enumerate(self.butcher_tableau):
-                if len(coeffs) == 0:
-                    assert c == 0
-                    this_rhs = self.last_rhs
-                else:
-                    sub_timer = self.timer.start_sub_timer()
-                    args = [(1, y)] + [
-                            (dt*coeff, rhss[j]) for j, coeff in enumerate(coeffs)
-                            if coeff]
-                    flop_count[0] += len(args)*2 - 1
-                    sub_y = self.limiter(self.get_linear_combiner(
-                            len(args), self.last_rhs)(*args))
-                    sub_timer.stop().submit()
+            for i, (c, terms) in enumerate(self.stage_terms):
+                if i == 0:
+                    assert c == 0 and not terms
+                    continue
 
-                    this_rhs = rhs(t + c*dt, sub_y)
+                sub_timer = self.timer.start_sub_timer()
+                if i == last_stage and self.first_same_as_last:
+                    # This stage is the solution--keep it around.
+                    fsal_y = combine(terms)
+                    sub_y = self.limiter(fsal_y)
+                    fsal_limited_y = sub_y
+                else:
+                    self.stage_storage = combine(terms, self.stage_storage)
+                    sub_y = self.limiter(self.stage_storage)
+                sub_timer.stop().submit()
 
-                rhss.append(this_rhs)
+                rhss.append(rhs(t + c*dt, sub_y))
 
             # }}}
 
-            def finish_solution(coeffs):
-                args = [(1, y)] + [
-                        (dt*coeff, rhss[i]) for i, coeff in enumerate(coeffs)
-                        if coeff]
-                flop_count[0] += len(args)*2 - 1
-                return self.get_linear_combiner(
-                        len(args), self.last_rhs)(*args)
-
             if not self.adaptive:
-                if self.use_high_order:
-                    y = self.limiter(finish_solution(self.high_order_coeffs))
+                if fsal_y is not None:
+                    y = fsal_limited_y
+                    self.last_rhs = rhss[-1]
                 else:
-                    y = self.limiter(finish_solution(self.low_order_coeffs))
+                    if self.use_high_order:
+                        y = self.limiter(combine(self.high_order_terms))
+                    else:
+                        y = self.limiter(combine(self.low_order_terms))
+
+                    self.last_rhs = None
 
-                self.last_rhs = this_rhs
                 self.flop_counter.add(self.dof_count*flop_count[0])
                 return y
             else:
                 # {{{ step size adaptation
-                high_order_end_y = finish_solution(self.high_order_coeffs)
-                low_order_end_y = finish_solution(self.low_order_coeffs)
+                if fsal_y is not None:
+                    high_order_end_y = fsal_y
+                else:
+                    high_order_end_y = combine(self.high_order_terms)
+                self.low_order_storage = low_order_end_y = combine(
+                        self.low_order_terms, self.low_order_storage)
 
                 flop_count[0] += 3+1  # one two-lincomb, one norm
 
@@ -324,16 +381,25 @@ class EmbeddedButcherTableauTimeStepperBase(EmbeddedRungeKuttaTimeStepperBase):
 
                 if not accept_step:
                     if reject_hook:
-                        y = reject_hook(dt, rel_err, t, y)
+                        new_y = reject_hook(dt, rel_err, t, y)
+                        if new_y is not y:
+                            y = new_y
+                            self.last_rhs = rhs(t, y)
 
                     dt = next_dt
-                    # ... and go back to top of loop
+                    # ... and go back to top of loop, where the first
+                    # stage is reused
                 else:
                     # finish up
-                    self.last_rhs = this_rhs
                     self.flop_counter.add(self.dof_count*flop_count[0])
 
-                    return self.limiter(high_order_end_y), t+dt, dt, next_dt
+                    if fsal_y is not None:
+                        self.last_rhs = rhss[-1]
+                        return fsal_limited_y, t+dt, dt, next_dt
+                    else:
+                        self.last_rhs = None
+                        return (self.limiter(high_order_end_y),
+                                t+dt, dt, next_dt)
                 # }}}
 
 # }}}
@@ -605,6 +671,190 @@ class SSP23ManyStageTimeStepper(EmbeddedShuOsherFormTimeStepperBase):
 # }}}
 
 
+# {{{ low-storage SSP RK
+
+class LowStorageSSPTimeStepperBase(TimeStepper):
+    """Strong-stability-preserving Runge-Kutta methods that need at most two
+    state-sized registers besides the initial state, as in [1].
+
+    The attribute *low_storage_program* is a list of register updates
+    *(target, a, source, b, c)*, each of which stands for::
+
+        q[target] = a*q[target] + b*q[source] + c*dt*f(q[1])
+
+    Register 0 holds the initial state and is never written, registers 1
+    and 2 start out equal to it. The right-hand side is always evaluated at
+    register 1, and reused until register 1 changes. Register 1 holds the
+    result after the last update.
+
+    Updates are performed in place by a single fused kernel obtained from
+    :meth:`hedge.vector_primitives.VectorPrimitiveFactory.make_low_storage_ssp_updater`.
+    If a *limiter* is given, it is applied to register 1 after each update
+    of it. A limiter that works in place and returns its argument causes
+    no copies.
+
+    [1] D. Ketcheson, Highly Efficient Strong Stability Preserving
+    Runge-Kutta Methods with Low-Storage Implementations,
+    SIAM J. Sci. Comput. 30 (2008), 2113-2136.
+    """
+
+    dt_fudge_factor = 1
+
+    adaptive = False
+
+    def __init__(self, dtype=numpy.float64, rcon=None,
+            vector_primitive_factory=None, limiter=None):
+        if vector_primitive_factory is None:
+            from hedge.vector_primitives import VectorPrimitiveFactory
+            self.vector_primitive_factory = VectorPrimitiveFactory()
+        else:
+            self.vector_primitive_factory = vector_primitive_factory
+
+        from pytools.log import IntervalTimer, EventCounter
+        timer_factory = IntervalTimer
+        if rcon is not None:
+            timer_factory = rcon.make_timer
+
+        if limiter is None:
+            self.limiter = lambda x: x
+        else:
+            self.limiter = limiter
+
+        self.timer = timer_factory(
+                "t_rk", "Time spent doing algebra in Runge-Kutta")
+        self.flop_counter = EventCounter(
+                "n_flops_rk", "Floating point operations performed in Runge-Kutta")
+
+        from pytools import match_precision
+        self.dtype = numpy.dtype(dtype)
+        self.scalar_dtype = match_precision(
+                numpy.dtype(numpy.float64), self.dtype)
+
+        self.linear_combiner_cache = {}
+        self.accumulator_storage = None
+
+    def get_stability_relevant_init_args(self):
+        return ()
+
+    def add_instrumentation(self, logmgr):
+        logmgr.add_quantity(self.timer)
+        logmgr.add_quantity(self.flop_counter)
+
+    def get_linear_combiner(self, arg_count, sample_vec):
+        try:
+            return self.linear_combiner_cache[arg_count]
+        except KeyError:
+            lc = self.vector_primitive_factory \
+                    .make_linear_combiner(
+                            self.dtype, self.scalar_dtype, sample_vec,
+                            arg_count=arg_count)
+            self.linear_combiner_cache[arg_count] = lc
+            return lc
+
+    def __call__(self, y, t, dt, rhs):
+        try:
+            updater = self.updater
+        except AttributeError:
+            from hedge.tools import count_dofs
+            self.dof_count = count_dofs(y)
+
+            updater = self.updater = self.vector_primitive_factory \
+                    .make_low_storage_ssp_updater(
+                            self.dtype, self.scalar_dtype, y)
+
+        registers = [y, y, y]
+        owned = [False, False, False]
+        time_fractions = [0, 0, 0]
+        stage_rhs = None
+        flop_count = 0
+
+        for target, a, source, b, c in self.low_storage_program:
+            if c and stage_rhs is None:
+                stage_rhs = rhs(t + time_fractions[1]*dt, registers[1])
+
+            sub_timer = self.timer.start_sub_timer()
+            if owned[target]:
+                updater(a, registers[target], b, registers[source],
+                        c*dt, stage_rhs if c else registers[source])
+                flop_count += 5
+            else:
+                # First write to this register: allocate it (or reuse
+                # last step's accumulator) and leave the caller's *y* alone.
+                args = [(fac, vec) for fac, vec in [
+                    (a, registers[target]),
+                    (b, registers[source]),
+                    (c*dt, stage_rhs)] if fac]
+                flop_count += 2*len(args) - 1
+
+                lc = self.get_linear_combiner(len(args), y)
+                if target == 2:
+                    self.accumulator_storage = registers[target] = lc(
+                            *args, **dict(result=self.accumulator_storage))
+                else:
+                    registers[target] = lc(*args)
+                owned[target] = True
+
+            if target == 1:
+                registers[1] = self.limiter(registers[1])
+                stage_rhs = None
+            sub_timer.stop().submit()
+
+            time_fractions[target] = (a*time_fractions[target]
+                    + b*time_fractions[source] + c)
+
+        assert abs(time_fractions[1] - 1) < 1e-12
+
+        self.flop_counter.add(self.dof_count*flop_count)
+
+        return registers[1]
+
+
+class SSPRK54TimeStepper(LowStorageSSPTimeStepperBase):
+    """The optimal five-stage, fourth-order SSP method of Spiteri and Ruuth,
+    with an SSP coefficient of 1.508. It needs two registers besides the
+    initial state.
+
+    See Section 6.2.2 in [1].
+
+    [1] S. Gottlieb, D. Ketcheson, and C.-W. Shu, Strong Stability Preserving
+    Time Discretizations. World Scientific, 2011.
+    """
+
+    low_storage_program = [
+            (1, 1, 0, 0, 0.391752226571890),
+            (1, 0.555629506348765, 0, 0.444370493651235, 0.368410593050371),
+            (2, 0, 1, 0.517231671970585, 0),
+            (1, 0.379898148511597, 0, 0.620101851488403, 0.251891774271694),
+            (2, 1, 1, 0.096059710526147, 0.063692468666290),
+            (1, 0.821920045606868, 0, 0.178079954393132, 0.544974750228521),
+            (1, 0.386708617503269, 2, 1, 0.226007483236906),
+            ]
+
+
+class SSPRK104TimeStepper(LowStorageSSPTimeStepperBase):
+    """Ketcheson's ten-stage, fourth-order SSP method, with an SSP
+    coefficient of 6. It needs two registers besides the initial state.
+
+    See Section 6.2.2 in [1] and Example 4.3 in [2].
+
+    [1] S. Gottlieb, D. Ketcheson, and C.-W. Shu, Strong Stability Preserving
+    Time Discretizations. World Scientific, 2011.
+
+    [2] D. Ketcheson, Highly Efficient Strong Stability Preserving
+    Runge-Kutta Methods with Low-Storage Implementations,
+    SIAM J. Sci. Comput. 30 (2008), 2113-2136.
+    """
+
+    low_storage_program = (
+            [(1, 1, 0, 0, 1/6)]*5
+            + [(2, 1/25, 1, 9/25, 0),
+               (1, -5, 2, 15, 0)]
+            + [(1, 1, 0, 0, 1/6)]*4
+            + [(1, 3/5, 2, 1, 1/10)])
+
+# }}}
+
+
 
 
 # vim: foldmethod=marker
@@ -59,57 +59,402 @@ def approximate_rk4_relative_imag_stability_region(
 
 
 
+def _get_stability_region_cache():
+    try:
+        from pytools.persistent_dict import PersistentDict
+    except ImportError:
+        return None
+
+    return PersistentDict("hedge-stability-regions-v1")
+
+
+
+
+def _numeric_repr(value):
+    """Return a canonical string for *value* if it is a number or a
+    (nested) sequence of numbers, else *None*."""
+    if isinstance(value, numpy.ndarray):
+        if value.dtype.kind in "biufc":
+            return repr(value.tolist())
+        else:
+            return None
+    elif isinstance(value, (int, long, float, complex, numpy.number)):
+        return repr(value)
+    elif isinstance(value, (list, tuple)):
+        entries = [_numeric_repr(entry) for entry in value]
+        if None in entries:
+            return None
+        return "[%s]" % ", ".join(entries)
+    else:
+        return None
+
+
+def _get_stepper_coefficient_hash(stepper_class, stepper_args):
+    """Return a hash of all numerical attributes (such as Butcher tableaux
+    and other method coefficients) of *stepper_class* and of an instance
+    created from *stepper_args*. Cached stability regions are keyed by
+    it, so that changing the coefficients of a method invalidates them.
+    """
+    attributes = {}
+    for cls in reversed(stepper_class.__mro__):
+        attributes.update(cls.__dict__)
+
+    stepper = stepper_class(*stepper_args, **{"dtype": numpy.complex128})
+    attributes.update(getattr(stepper, "__dict__", {}))
+
+    from hashlib import sha1
+    checksum = sha1()
+    for name, value in sorted(attributes.iteritems()):
+        value_repr = _numeric_repr(value)
+        if value_repr is not None:
+            checksum.update("%s=%s;" % (name, value_repr))
+
+    return checksum.hexdigest()
+
+
+
+
+def find_stable_magnitudes(stepper_class, stepper_args, k_values,
+        step_count=20):
+    """Run one stepper of *stepper_class* on the test equation
+    :math:`y'=ky` for all complex *k_values* at once.
+
+    :returns: a boolean array telling which of the *k_values* remained
+      stable (in the sense of :math:`|y|\\le 2`) over *step_count* steps
+      of size 1.
+
+    This assumes that the stepper treats each entry of its state
+    independently of all others, as do steppers whose stages are linear
+    combinations of states and right-hand sides. Steppers that couple
+    entries, e.g. through the norms used to adapt step sizes or through
+    iterative implicit solves, cannot be probed this way.
+    """
+    stepper = stepper_class(*stepper_args, **{"dtype": numpy.complex128})
+    if getattr(stepper, "adaptive", False):
+        raise ValueError("stability regions can only be probed for "
+                "steppers with fixed step sizes")
+
+    k_values = numpy.asarray(k_values, dtype=numpy.complex128)
+    y = numpy.ones_like(k_values)
+    stable = numpy.ones(k_values.shape, dtype=numpy.bool)
+
+    def rhs(t, y):
+        return k_values*y
+
+    old_err = numpy.seterr(over="ignore", invalid="ignore")
+    try:
+        for i in range(step_count):
+            stable &= numpy.abs(y) <= 2
+            if not stable.any():
+                break
+            y = stepper(y, i, 1, rhs)
+    finally:
+        numpy.seterr(**old_err)
+
+    return stable
+
+
+
+
 @memoize
 def approximate_imag_stability_region(stepper_class, *stepper_args):
-    def stepper_maker():
-        return stepper_class(*stepper_args, **{"dtype": numpy.complex128})
+    """Find the extent of the stability region of *stepper_class* along
+    the imaginary axis.
+
+    Test eigenvalues are probed as one vector per pass, see
+    :func:`find_stable_magnitudes`. Results are cached on disk per
+    stepper class, *stepper_args* and stepper coefficients.
+    """
+    cache = _get_stability_region_cache()
+    cache_key = ("%s.%s" % (stepper_class.__module__, stepper_class.__name__),
+            stepper_args,
+            _get_stepper_coefficient_hash(stepper_class, stepper_args))
+
+    if cache is not None:
+        try:
+            return cache.fetch(cache_key)
+        except KeyError:
+            pass
 
     prec = 1e-5
+    sample_count = 64
+    min_mag = prec
+    max_mag = 2**9
 
-    def is_stable(stepper, k):
-        y = 1
-        for i in range(20):
-            if abs(y) > 2:
-                return False
-            y = stepper(y, i, 1, lambda t, y: k*y)
-        return True
-
-    def make_k(angle, mag):
-        from cmath import exp
-        return -prec+mag*exp(1j*angle)
-
-    def refine(angle, stable, unstable):
-        assert is_stable(stepper_maker(), make_k(angle, stable))
-        assert not is_stable(stepper_maker(), make_k(angle, unstable))
-        while abs(stable-unstable) > prec:
-            mid = (stable+unstable)/2
-            if is_stable(stepper_maker(), make_k(angle, mid)):
-                stable = mid
-            else:
-                unstable = mid
+    from cmath import pi
+    angle = pi/2
+
+    def make_k(mag):
+        return -prec+mag*numpy.exp(1j*angle)
+
+    def first_unstable(mags):
+        stable = find_stable_magnitudes(stepper_class, stepper_args,
+                make_k(mags))
+        unstable_indices, = numpy.where(~stable)
+        if len(unstable_indices):
+            return unstable_indices[0]
         else:
-            return stable
+            return None
 
-    def find_stable_k(angle):
-        mag = 1
+    # {{{ bracket the stability boundary on a logarithmic grid
 
-        if is_stable(stepper_maker(), make_k(angle, mag)):
-            mag *= 2
-            while is_stable(stepper_maker(), make_k(angle, mag)):
-                mag *= 2
+    mags = numpy.logspace(numpy.log2(min_mag), numpy.log2(max_mag),
+            sample_count, base=2)
+    i_unstable = first_unstable(mags)
 
-                if mag > 2**8:
-                    return mag
-            return refine(angle, mag/2, mag)
-        else:
-            mag /= 2
-            while not is_stable(stepper_maker(), make_k(angle, mag)):
-                mag /= 2
+    if i_unstable is None:
+        mag = max_mag
+    elif i_unstable == 0:
+        mag = min_mag
+    else:
+        stable, unstable = mags[i_unstable-1], mags[i_unstable]
 
-                if mag < prec:
-                    return mag
-            return refine(angle, mag, mag*2)
+        # {{{ refine the bracket, sample_count points at a time
 
-    from cmath import pi
-    angle = pi/2
-    return abs(make_k(angle, find_stable_k(angle)))
+        while unstable - stable > prec:
+            mags = numpy.linspace(stable, unstable, sample_count)
+            i_unstable = first_unstable(mags)
+            assert i_unstable is not None and i_unstable > 0
+            stable, unstable = mags[i_unstable-1], mags[i_unstable]
+
+        # }}}
+
+        mag = stable
+
+    # }}}
+
+    result = abs(make_k(mag))
+
+    if cache is not None:
+        cache.store(cache_key, result)
+
+    return result
+
+
+
+
+# {{{ time steps from estimated spectra
+
+@memoize
+def approximate_stability_region_boundary(stepper_class, stepper_args=(),
+        angle_count=65):
+    """Find the distance from the origin to the boundary of the stability
+    region of *stepper_class* along *angle_count* rays, evenly spaced from
+    the positive imaginary to the negative real axis.
+
+    :returns: an array of *angle_count* distances. Regions of steppers with
+      real coefficients are symmetric about the real axis, so these also
+      describe the lower half plane.
+
+    All rays are searched at once, and results are cached on disk like
+    those of :func:`approximate_imag_stability_region`.
+    """
+    cache = _get_stability_region_cache()
+    cache_key = ("boundary",
+            "%s.%s" % (stepper_class.__module__, stepper_class.__name__),
+            stepper_args,
+            _get_stepper_coefficient_hash(stepper_class, stepper_args),
+            angle_count)
+
+    if cache is not None:
+        try:
+            return cache.fetch(cache_key)
+        except KeyError:
+            pass
+
+    prec = 1e-4
+    sample_count = 64
+    min_mag = prec
+    max_mag = 2**9
+
+    from math import pi
+    directions = numpy.exp(1j*numpy.linspace(pi/2, pi, angle_count))
+
+    def make_k(mags, dirs):
+        return -prec+mags*dirs
+
+    def first_unstable(mags, dirs):
+        """Return, for each row of *mags*, the index of the first unstable
+        magnitude, or -1 if there is none."""
+        k_values = make_k(mags, dirs[:, numpy.newaxis])
+        unstable = ~find_stable_magnitudes(stepper_class, stepper_args,
+                k_values.ravel()).reshape(k_values.shape)
+        return numpy.where(unstable.any(axis=1),
+                numpy.argmax(unstable, axis=1), -1)
+
+    # {{{ bracket the stability boundary on a logarithmic grid
+
+    mags = numpy.tile(
+            numpy.logspace(numpy.log2(min_mag), numpy.log2(max_mag),
+                sample_count, base=2),
+            (angle_count, 1))
+    i_unstable = first_unstable(mags, directions)
+    rows = numpy.arange(angle_count)
+
+    stable = numpy.where(i_unstable == -1, max_mag,
+            numpy.where(i_unstable == 0, min_mag,
+                mags[rows, i_unstable-1]))
+    unstable = numpy.where(i_unstable > 0, mags[rows, i_unstable], stable)
+
+    # }}}
+
+    # {{{ refine the brackets, sample_count points per ray at a time
+
+    active = unstable - stable > prec
+    while active.any():
+        act_stable = stable[active]
+        act_unstable = unstable[active]
+        mags = (act_stable[:, numpy.newaxis]
+                + (act_unstable-act_stable)[:, numpy.newaxis]
+                * numpy.linspace(0, 1, sample_count))
+        i_unstable = first_unstable(mags, directions[active])
+        assert (i_unstable > 0).all()
+
+        act_rows = numpy.arange(len(i_unstable))
+        stable[active] = mags[act_rows, i_unstable-1]
+        unstable[active] = mags[act_rows, i_unstable]
+        active = unstable - stable > prec
+
+    # }}}
+
+    result = numpy.abs(make_k(stable, directions))
+
+    if cache is not None:
+        cache.store(cache_key, result)
+
+    return result
+
+
+
+
+def _local_inner(a, b):
+    from hedge.tools import is_obj_array
+    if is_obj_array(a):
+        return sum(numpy.vdot(a_i, b_i) for a_i, b_i in zip(a, b))
+    else:
+        return numpy.vdot(a, b)
+
+
+
+
+def _random_like(rng, fields):
+    from hedge.tools import is_obj_array
+    if is_obj_array(fields):
+        result = numpy.empty(fields.shape, dtype=object)
+        for i, field in enumerate(fields):
+            result[i] = _random_like(rng, field)
+        return result
+    else:
+        # keep the array type, e.g. of a FieldBlock
+        return rng.uniform(-1, 1, fields.shape).astype(fields.dtype) \
+                .view(type(fields))
+
+
+
+
+def estimate_rhs_eigenvalues(rhs, t, fields, krylov_dim=30, pcon=None):
+    """Estimate the extreme eigenvalues of the Jacobian of *rhs* at *t* and
+    *fields* by *krylov_dim* steps of the Arnoldi iteration.
+
+    :param rhs: a right-hand side function *rhs(t, fields)*, as returned by
+      the ``bind`` methods of operators.
+    :param fields: a volume vector or an object array of volume vectors.
+    :param pcon: the run context, whose ranks the inner products are
+      summed over.
+    :returns: the Ritz values, an array of up to *krylov_dim* complex
+      numbers. Its outermost entries approximate the outermost
+      eigenvalues from inside the spectrum.
+
+    Jacobian-vector products are taken by finite differences, which is
+    exact up to rounding for linear right-hand sides. New Arnoldi vectors
+    are orthogonalized by classical Gram-Schmidt with one
+    reorthogonalization, so that each step needs two global reductions.
+    """
+    from hedge.iterative import GlobalSumReduction
+    reduction = GlobalSumReduction(pcon)
+
+    def norm(vec):
+        return abs(reduction([_local_inner(vec, vec)])[0])**0.5
+
+    from hedge.tools import is_obj_array
+    if is_obj_array(fields):
+        dtype = fields[0].dtype
+    else:
+        dtype = fields.dtype
+    fd_step = (numpy.sqrt(numpy.finfo(dtype).eps)
+            * max(norm(fields), 1))
+    base_rhs = rhs(t, fields)
+
+    v = _random_like(numpy.random.RandomState(17), fields)
+    basis = [v/norm(v)]
+    hessenberg = numpy.zeros((krylov_dim+1, krylov_dim))
+
+    for j in range(krylov_dim):
+        w = (rhs(t, fields + fd_step*basis[j]) - base_rhs)/fd_step
+
+        h = reduction([_local_inner(v_i, w) for v_i in basis]).real
+        w = w - sum(h_i*v_i for h_i, v_i in zip(h, basis))
+        reduced = reduction([_local_inner(v_i, w) for v_i in basis]
+                + [_local_inner(w, w)]).real
+        h_2 = reduced[:-1]
+        w = w - sum(h_i*v_i for h_i, v_i in zip(h_2, basis))
+        h_norm = max(reduced[-1] - numpy.sum(h_2**2), 0)**0.5
+
+        hessenberg[:j+1, j] = h + h_2
+        hessenberg[j+1, j] = h_norm
+
+        if h_norm <= 1e-12*numpy.abs(hessenberg[:j+1, j]).max():
+            # the Krylov space is invariant, its Ritz values are exact
+            return numpy.linalg.eigvals(hessenberg[:j+1, :j+1])
+
+        basis.append(w/h_norm)
+
+    return numpy.linalg.eigvals(hessenberg[:krylov_dim, :krylov_dim])
+
+
+
+
+def stable_timestep_for_eigenvalues(eigenvalues, stepper=None,
+        stepper_class=None, stepper_args=(), angle_count=65):
+    """Return the largest time step *dt* for which *dt* times each of
+    *eigenvalues* lies within the stability region of a time stepper,
+    given either as an instance *stepper* or as *stepper_class* and
+    *stepper_args*. If neither is given, RK4 is assumed.
+
+    The stability region is taken from
+    :func:`approximate_stability_region_boundary`, using the smaller
+    distance of the two rays adjacent to each eigenvalue. Eigenvalues in
+    the right half plane are treated as if they were on the imaginary
+    axis.
+    """
+    if stepper is not None and stepper_class is not None:
+        raise ValueError("only one of 'stepper' and 'stepper_class' "
+                "may be specified")
+
+    if stepper is not None:
+        stepper_class = type(stepper)
+        stepper_args = stepper.get_stability_relevant_init_args()
+
+    if stepper_class is None:
+        from hedge.timestep.runge_kutta import LSRK4TimeStepper
+        stepper_class = LSRK4TimeStepper
+        stepper_args = ()
+
+    boundary = approximate_stability_region_boundary(
+            stepper_class, tuple(stepper_args), angle_count)
+
+    eigenvalues = numpy.asarray(eigenvalues)
+    eigenvalues = eigenvalues[eigenvalues != 0]
+    if not len(eigenvalues):
+        raise ValueError("no nonzero eigenvalues given")
+
+    from math import pi
+    angles = numpy.clip(numpy.abs(numpy.angle(eigenvalues)), pi/2, pi)
+    ray_positions = (angles - pi/2)/(pi/2)*(angle_count-1)
+    radii = numpy.minimum(
+            boundary[numpy.floor(ray_positions).astype(numpy.intp)],
+            boundary[numpy.ceil(ray_positions).astype(numpy.intp)])
+
+    return numpy.min(radii/numpy.abs(eigenvalues))
+
+# }}}
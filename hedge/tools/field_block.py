@@ -0,0 +1,139 @@
+"""Contiguous storage for several volume fields."""
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2007 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+
+
+import numpy
+
+
+
+
+class FieldBlock(numpy.ndarray):
+    """An array of shape *(component_count, node_count)* holding several
+    volume vectors, e.g. the conserved variables of a system of
+    conservation laws, in one allocation.
+
+    Indexing a block with a component number yields that component as a
+    plain :class:`numpy.ndarray` view, so that a block may stand in for an
+    object array of volume vectors. Unlike such an object array, a block is
+    treated as a single vector by
+    :class:`hedge.vector_primitives.VectorPrimitiveFactory`, so that the
+    linear combinations and updates in time steppers run as one kernel
+    over all components. Operators compiled by the JIT backend accept
+    blocks as arguments and return vector-valued results as blocks if any
+    of their arguments was one.
+
+    Blocks are created by :func:`make_field_block`.
+    """
+
+    def __getitem__(self, index):
+        result = numpy.ndarray.__getitem__(self, index)
+        if isinstance(result, FieldBlock) and result.ndim != 2:
+            return result.view(numpy.ndarray)
+        else:
+            return result
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def components(self):
+        """Return an object array of views of the components."""
+        result = numpy.empty(len(self), dtype=object)
+        for i in xrange(len(self)):
+            result[i] = self[i]
+        return result
+
+
+
+
+def make_field_block(fields, dtype=None):
+    """Return a :class:`FieldBlock` holding *fields*.
+
+    :param fields: an object array or sequence of volume vectors, which is
+      copied, or an array of shape *(component_count, node_count)*, such as
+      the result of :meth:`hedge.discretization.Discretization.volume_zeros`
+      with *shape=(component_count,)*, which is used without copying if it
+      is C-contiguous and of the requested *dtype*.
+    """
+    if isinstance(fields, numpy.ndarray) and fields.dtype != object:
+        if fields.ndim != 2:
+            raise ValueError("field blocks must be two-dimensional")
+        return numpy.ascontiguousarray(fields, dtype=dtype).view(FieldBlock)
+
+    from pytools import common_dtype
+    if dtype is None:
+        dtype = common_dtype(fld.dtype for fld in fields)
+
+    node_count, = set(len(fld) for fld in fields)
+    result = numpy.empty((len(fields), node_count), dtype=dtype) \
+            .view(FieldBlock)
+    for i, fld in enumerate(fields):
+        result[i] = fld
+
+    return result
+
+
+
+
+def get_field_block_view(components):
+    """If *components* are views of consecutive rows of one contiguous
+    array (such as the result of :meth:`FieldBlock.components`), return
+    those rows as a :class:`FieldBlock` without copying. Otherwise, return
+    *None*.
+    """
+    if not len(components):
+        return None
+
+    def get_root(ary):
+        while isinstance(ary.base, numpy.ndarray):
+            ary = ary.base
+        return ary
+
+    first = components[0]
+    if not (isinstance(first, numpy.ndarray) and first.ndim == 1
+            and first.dtype != object and first.flags.c_contiguous):
+        return None
+
+    root = get_root(first)
+    row_bytes = first.nbytes
+    start = first.__array_interface__["data"][0]
+
+    for i, comp in enumerate(components):
+        if not (isinstance(comp, numpy.ndarray)
+                and comp.shape == first.shape
+                and comp.dtype == first.dtype
+                and comp.flags.c_contiguous
+                and get_root(comp) is root
+                and comp.__array_interface__["data"][0]
+                == start + i*row_bytes):
+            return None
+
+    from numpy.lib.stride_tricks import as_strided
+    return as_strided(first,
+            shape=(len(components), len(first)),
+            strides=(row_bytes, first.itemsize)).view(FieldBlock)
@@ -34,15 +34,20 @@ class ObjectArrayLinearCombinationWrapper(object):
     def __init__(self, scalar_kernel):
         self.scalar_kernel = scalar_kernel
 
-    def __call__(self, *args):
+    def __call__(self, *args, **kwargs):
         from pytools import indices_in_shape, single_valued
 
         oa_shape = single_valued(ary.shape for fac, ary in args)
-        result = numpy.zeros(oa_shape, dtype=object)
-
-        for i in indices_in_shape(oa_shape):
-            args_i = [(fac, ary[i]) for fac, ary in args]
-            result[i] = self.scalar_kernel(*args_i)
+        result = kwargs.get("result")
+        if result is None:
+            result = numpy.zeros(oa_shape, dtype=object)
+            for i in indices_in_shape(oa_shape):
+                args_i = [(fac, ary[i]) for fac, ary in args]
+                result[i] = self.scalar_kernel(*args_i)
+        else:
+            for i in indices_in_shape(oa_shape):
+                args_i = [(fac, ary[i]) for fac, ary in args]
+                result[i] = self.scalar_kernel(*args_i, result=result[i])
 
         return result
 
@@ -51,14 +56,22 @@ class UnoptimizedLinearCombiner(object):
     def __init__(self, result_dtype, scalar_dtype):
         self.result_dtype = result_dtype
 
-    def __call__(self, *args):
-        return sum(vec*self.result_dtype.type(fac) for fac, vec in args).astype(self.result_dtype)
+    def __call__(self, *args, **kwargs):
+        value = sum(vec*self.result_dtype.type(fac) for fac, vec in args)
+
+        result = kwargs.get("result")
+        if isinstance(result, numpy.ndarray):
+            result[...] = value
+            return result
+        else:
+            return value.astype(self.result_dtype)
 
 
 class NumpyLinearCombiner(object):
     def __init__(self, result_dtype, scalar_dtype, sample_vec, arg_count):
         self.result_dtype = result_dtype
         self.shape = sample_vec.shape
+        self.array_type = type(sample_vec)
 
         from codepy.elementwise import \
                 make_linear_comb_kernel_with_result_dtype
@@ -67,8 +80,13 @@ class NumpyLinearCombiner(object):
                 (scalar_dtype,)*arg_count,
                 (sample_vec.dtype,)*arg_count)
 
-    def __call__(self, *args):
-        result = numpy.empty(self.shape, self.result_dtype)
+    def __call__(self, *args, **kwargs):
+        result = kwargs.get("result")
+        if result is None:
+            result = numpy.empty(self.shape, self.result_dtype)
+            if self.array_type is not numpy.ndarray:
+                # e.g. a hedge.tools.field_block.FieldBlock
+                result = result.view(self.array_type)
 
         from pytools import flatten
         self.kernel(result, *tuple(flatten(args)))
@@ -96,10 +114,12 @@ class CUDALinearCombiner:
         else:
             self.allocator = None
 
-    def __call__(self, *args):
-        import pycuda.gpuarray as gpuarray
-        result = gpuarray.empty(self.shape, self.result_dtype,
-                allocator=self.allocator)
+    def __call__(self, *args, **kwargs):
+        result = kwargs.get("result")
+        if result is None:
+            import pycuda.gpuarray as gpuarray
+            result = gpuarray.empty(self.shape, self.result_dtype,
+                    allocator=self.allocator)
 
         knl_args = []
         for fac, vec in args:
@@ -119,6 +139,183 @@ class CUDALinearCombiner:
 # }}}
 
 
+# {{{ low-storage Runge-Kutta update
+
+class ObjectArrayLowStorageRKUpdateWrapper(object):
+    def __init__(self, scalar_kernel):
+        self.scalar_kernel = scalar_kernel
+
+    def __call__(self, a, residual, dt, rhs, b, y, preserve_y=False):
+        from pytools import indices_in_shape
+
+        if preserve_y:
+            result = numpy.empty(y.shape, dtype=object)
+        else:
+            result = y
+
+        for i in indices_in_shape(residual.shape):
+            result[i] = self.scalar_kernel(a, residual[i], dt, rhs[i], b, y[i],
+                    preserve_y=preserve_y)
+
+        return result
+
+
+class UnoptimizedLowStorageRKUpdater(object):
+    def __call__(self, a, residual, dt, rhs, b, y, preserve_y=False):
+        residual *= a
+        residual += dt*rhs
+
+        if preserve_y:
+            return y + b*residual
+        else:
+            y += b*residual
+            return y
+
+
+class NumpyLowStorageRKUpdater(object):
+    def __init__(self, vector_dtype, scalar_dtype, residual_dtype=None):
+        if residual_dtype is None:
+            residual_dtype = vector_dtype
+
+        from codepy.elementwise import ElementwiseKernel, VectorArg, ScalarArg
+        self.kernel = ElementwiseKernel([
+                VectorArg(residual_dtype, "residual"),
+                VectorArg(vector_dtype, "y"),
+                VectorArg(vector_dtype, "rhs"),
+                ScalarArg(scalar_dtype, "a"),
+                ScalarArg(scalar_dtype, "dt"),
+                ScalarArg(scalar_dtype, "b"),
+                ],
+                "residual[i] = a*residual[i] + dt*rhs[i];\n"
+                "y[i] += b*residual[i];",
+                name="low_storage_rk_update")
+        self.preserving_kernel = ElementwiseKernel([
+                VectorArg(residual_dtype, "residual"),
+                VectorArg(vector_dtype, "y_new"),
+                VectorArg(vector_dtype, "y"),
+                VectorArg(vector_dtype, "rhs"),
+                ScalarArg(scalar_dtype, "a"),
+                ScalarArg(scalar_dtype, "dt"),
+                ScalarArg(scalar_dtype, "b"),
+                ],
+                "residual[i] = a*residual[i] + dt*rhs[i];\n"
+                "y_new[i] = y[i] + b*residual[i];",
+                name="low_storage_rk_update_preserving")
+
+    def __call__(self, a, residual, dt, rhs, b, y, preserve_y=False):
+        if preserve_y:
+            y_new = numpy.empty_like(y)
+            self.preserving_kernel(residual, y_new, y, rhs, a, dt, b)
+            return y_new
+        else:
+            self.kernel(residual, y, rhs, a, dt, b)
+            return y
+
+
+class CUDALowStorageRKUpdater(object):
+    def __init__(self, vector_dtype, scalar_dtype):
+        from pycuda.elementwise import ElementwiseKernel
+        from pycuda.tools import dtype_to_ctype
+
+        type_dict = {
+                "vec": dtype_to_ctype(vector_dtype),
+                "scalar": dtype_to_ctype(scalar_dtype),
+                }
+
+        self.vector_dtype = vector_dtype
+        self.kernel = ElementwiseKernel(
+                "%(vec)s *residual, %(vec)s *y, %(vec)s *rhs, "
+                "%(scalar)s a, %(scalar)s dt, %(scalar)s b" % type_dict,
+                "residual[i] = a*residual[i] + dt*rhs[i];\n"
+                "y[i] += b*residual[i];",
+                name="low_storage_rk_update")
+        self.preserving_kernel = ElementwiseKernel(
+                "%(vec)s *residual, %(vec)s *y_new, %(vec)s *y, %(vec)s *rhs, "
+                "%(scalar)s a, %(scalar)s dt, %(scalar)s b" % type_dict,
+                "residual[i] = a*residual[i] + dt*rhs[i];\n"
+                "y_new[i] = y[i] + b*residual[i];",
+                name="low_storage_rk_update_preserving")
+
+    def __call__(self, a, residual, dt, rhs, b, y, preserve_y=False):
+        if rhs.dtype != self.vector_dtype:
+            raise TypeError("unexpected vector type in CUDA low-storage "
+                    "RK update")
+
+        if preserve_y:
+            import pycuda.gpuarray as gpuarray
+            y_new = gpuarray.empty_like(y)
+            self.preserving_kernel(residual, y_new, y, rhs, a, dt, b)
+            return y_new
+        else:
+            self.kernel(residual, y, rhs, a, dt, b)
+            return y
+
+# }}}
+
+
+# {{{ low-storage SSP Runge-Kutta update
+
+class ObjectArrayLowStorageSSPUpdateWrapper(object):
+    def __init__(self, scalar_kernel):
+        self.scalar_kernel = scalar_kernel
+
+    def __call__(self, a, y, b, x, c, rhs):
+        from pytools import indices_in_shape
+
+        for i in indices_in_shape(y.shape):
+            self.scalar_kernel(a, y[i], b, x[i], c, rhs[i])
+
+
+class UnoptimizedLowStorageSSPUpdater(object):
+    def __call__(self, a, y, b, x, c, rhs):
+        y *= a
+        y += b*x
+        y += c*rhs
+
+
+class NumpyLowStorageSSPUpdater(object):
+    def __init__(self, vector_dtype, scalar_dtype):
+        from codepy.elementwise import ElementwiseKernel, VectorArg, ScalarArg
+        self.kernel = ElementwiseKernel([
+                VectorArg(vector_dtype, "y"),
+                VectorArg(vector_dtype, "x"),
+                VectorArg(vector_dtype, "rhs"),
+                ScalarArg(scalar_dtype, "a"),
+                ScalarArg(scalar_dtype, "b"),
+                ScalarArg(scalar_dtype, "c"),
+                ],
+                "y[i] = a*y[i] + b*x[i] + c*rhs[i];",
+                name="low_storage_ssp_update")
+
+    def __call__(self, a, y, b, x, c, rhs):
+        self.kernel(y, x, rhs, a, b, c)
+
+
+class CUDALowStorageSSPUpdater(object):
+    def __init__(self, vector_dtype, scalar_dtype):
+        from pycuda.elementwise import ElementwiseKernel
+        from pycuda.tools import dtype_to_ctype
+
+        self.vector_dtype = vector_dtype
+        self.kernel = ElementwiseKernel(
+                "%(vec)s *y, %(vec)s *x, %(vec)s *rhs, "
+                "%(scalar)s a, %(scalar)s b, %(scalar)s c" % {
+                    "vec": dtype_to_ctype(vector_dtype),
+                    "scalar": dtype_to_ctype(scalar_dtype),
+                    },
+                "y[i] = a*y[i] + b*x[i] + c*rhs[i];",
+                name="low_storage_ssp_update")
+
+    def __call__(self, a, y, b, x, c, rhs):
+        if rhs.dtype != self.vector_dtype:
+            raise TypeError("unexpected vector type in CUDA low-storage "
+                    "SSP update")
+
+        self.kernel(y, x, rhs, a, b, c)
+
+# }}}
+
+
 # {{{ inner product
 
 class ObjectArrayInnerProductWrapper(object):
@@ -177,7 +374,10 @@ class VectorPrimitiveFactory(object):
           array composition, and dtypes.
         :returns: a function that accepts `arg_count` arguments
           *((factor0, vec0), (factor1, vec1), ...)* and returns
-          `factor0*vec0 + factor1*vec1`.
+          `factor0*vec0 + factor1*vec1`. If the keyword argument *result*
+          is given, the combination may be written into that (preallocated)
+          vector, which must not alias any of the arguments. Callers must
+          use the return value in either case.
         """
         from hedge.tools import is_obj_array
         sample_is_obj_array = is_obj_array(sample_vec)
@@ -203,6 +403,95 @@ class VectorPrimitiveFactory(object):
 
         return kernel
 
+    def make_special_low_storage_rk_updater(self, vector_dtype, scalar_dtype,
+            sample_vec):
+        return None
+
+    def make_low_storage_rk_updater(self, vector_dtype, scalar_dtype,
+            sample_vec, residual_dtype=None):
+        """
+        :param vector_dtype: dtype of states and right hand sides.
+        :param scalar_dtype: dtype of the scalars.
+        :param sample_vec: must match states and right hand sides in shape, object
+          array composition, and dtypes.
+        :param residual_dtype: dtype of the residual, if different from
+          *vector_dtype*, e.g. to accumulate single-precision right hand
+          sides in double precision. Only supported for numpy vectors.
+        :returns: a function that accepts arguments
+          *(a, residual, dt, rhs, b, y, preserve_y=False)* and performs the
+          2N-storage Runge-Kutta stage update `residual = a*residual + dt*rhs`,
+          `y = y + b*residual` in place and in a single pass. It returns
+          the updated *y*. If *preserve_y* is true, *y* is left unchanged
+          and the updated state is written to a newly allocated vector
+          instead, still in the same pass.
+        """
+        from hedge.tools import is_obj_array
+        sample_is_obj_array = is_obj_array(sample_vec)
+
+        if sample_is_obj_array:
+            sample_vec = sample_vec[0]
+
+        if isinstance(sample_vec, numpy.ndarray) and sample_vec.dtype != object:
+            kernel = NumpyLowStorageRKUpdater(vector_dtype, scalar_dtype,
+                    residual_dtype)
+        elif residual_dtype is not None \
+                and numpy.dtype(residual_dtype) != numpy.dtype(vector_dtype):
+            raise ValueError("residuals of a different dtype are only "
+                    "supported for numpy vectors")
+        else:
+            kernel = self.make_special_low_storage_rk_updater(
+                    vector_dtype, scalar_dtype, sample_vec)
+
+            if kernel is None:
+                from warnings import warn
+                warn("using unoptimized low-storage RK update routine" +
+                        _NO_VPF_SUGGESTION)
+                kernel = UnoptimizedLowStorageRKUpdater()
+
+        if sample_is_obj_array:
+            kernel = ObjectArrayLowStorageRKUpdateWrapper(kernel)
+
+        return kernel
+
+    def make_special_low_storage_ssp_updater(self, vector_dtype, scalar_dtype,
+            sample_vec):
+        return None
+
+    def make_low_storage_ssp_updater(self, vector_dtype, scalar_dtype,
+            sample_vec):
+        """
+        :param vector_dtype: dtype of states and right hand sides.
+        :param scalar_dtype: dtype of the scalars.
+        :param sample_vec: must match states and right hand sides in shape, object
+          array composition, and dtypes.
+        :returns: a function that accepts arguments
+          *(a, y, b, x, c, rhs)* and performs the update
+          `y = a*y + b*x + c*rhs` in place and in a single pass.
+          *x* and *rhs* must not alias *y*.
+        """
+        from hedge.tools import is_obj_array
+        sample_is_obj_array = is_obj_array(sample_vec)
+
+        if sample_is_obj_array:
+            sample_vec = sample_vec[0]
+
+        if isinstance(sample_vec, numpy.ndarray) and sample_vec.dtype != object:
+            kernel = NumpyLowStorageSSPUpdater(vector_dtype, scalar_dtype)
+        else:
+            kernel = self.make_special_low_storage_ssp_updater(
+                    vector_dtype, scalar_dtype, sample_vec)
+
+            if kernel is None:
+                from warnings import warn
+                warn("using unoptimized low-storage SSP update routine" +
+                        _NO_VPF_SUGGESTION)
+                kernel = UnoptimizedLowStorageSSPUpdater()
+
+        if sample_is_obj_array:
+            kernel = ObjectArrayLowStorageSSPUpdateWrapper(kernel)
+
+        return kernel
+
     def make_special_inner_product(self, sample_vec):
         return None
 
@@ -214,7 +503,12 @@ class VectorPrimitiveFactory(object):
             sample_vec = sample_vec[0]
 
         if isinstance(sample_vec, numpy.ndarray) and sample_vec.dtype != object:
-            kernel = numpy.dot
+            if sample_vec.ndim == 1:
+                kernel = numpy.dot
+            else:
+                # e.g. a hedge.tools.field_block.FieldBlock
+                def kernel(a, b):
+                    return numpy.dot(numpy.ravel(a), numpy.ravel(b))
         else:
             kernel = self.make_special_inner_product(sample_vec)
 
@@ -237,7 +531,8 @@ class VectorPrimitiveFactory(object):
             sample_vec = sample_vec[0]
 
         if isinstance(sample_vec, numpy.ndarray) and sample_vec.dtype != object:
-            kernel = numpy.max
+            def kernel(a):
+                return numpy.max(numpy.abs(a))
         else:
             kernel = self.make_special_maximum_norm(sample_vec)
 
@@ -260,6 +555,20 @@ class CUDAVectorPrimitiveFactory(VectorPrimitiveFactory):
         my_kwargs["pool"] = self.discr.pool
         return CUDALinearCombiner(*args, **my_kwargs)
 
+    def make_special_low_storage_rk_updater(self, vector_dtype, scalar_dtype,
+            sample_vec):
+        from pycuda.gpuarray import GPUArray
+
+        if isinstance(sample_vec, GPUArray):
+            return CUDALowStorageRKUpdater(vector_dtype, scalar_dtype)
+
+    def make_special_low_storage_ssp_updater(self, vector_dtype, scalar_dtype,
+            sample_vec):
+        from pycuda.gpuarray import GPUArray
+
+        if isinstance(sample_vec, GPUArray):
+            return CUDALowStorageSSPUpdater(vector_dtype, scalar_dtype)
+
     def make_special_inner_product(self, sample_vec):
         from pycuda.gpuarray import GPUArray
 
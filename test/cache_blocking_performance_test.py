@@ -0,0 +1,66 @@
+"""This benchmark informs the choice of the *cache_block_bytes* and
+*cache_block_min_nodes* arguments of the JIT discretization, see
+:class:`hedge.backends.jit.Discretization`.
+
+It times the right-hand side of a 3D wave operator with and without
+cache blocking, for a few block sizes. Element-local instructions are
+executed one block at a time, at the price of dispatching each of them
+once per block from Python. Blocking only pays off if the memory traffic
+it saves outweighs that overhead, which depends on the machine, the
+order and the operator.
+"""
+
+def main():
+    from time import time
+    import numpy
+    import numpy.linalg as la
+    from hedge.mesh.generator import make_box_mesh
+    from hedge.backends.jit import Discretization
+    from hedge.models.wave import StrongWaveOperator
+    from hedge.tools import join_fields
+
+    ORDER = 4
+    ITER = 20
+
+    mesh = make_box_mesh(max_volume=0.0005, periodicity=(True, True, True))
+    op = StrongWaveOperator(-1, mesh.dimensions, flux_type="upwind")
+
+    def u0(x, el):
+        return numpy.sin(2*numpy.pi*x[0])*numpy.cos(2*numpy.pi*x[1]) \
+                + numpy.sin(2*numpy.pi*x[2])
+
+    def run(**kwargs):
+        discr = Discretization(mesh, order=ORDER, **kwargs)
+        fields = join_fields(discr.interpolate_volume_function(u0),
+                [discr.volume_zeros() for i in range(discr.dimensions)])
+        rhs = op.bind(discr)
+
+        # compile and warm up
+        result = rhs(0, fields)
+
+        start = time()
+        for i in xrange(ITER):
+            result = rhs(0, fields)
+        return (time()-start)/ITER, result
+
+    print "%d elements, %d nodes" % (
+            len(mesh.elements), len(Discretization(mesh, order=ORDER).nodes))
+
+    ref_time, ref_result = run()
+    print "unblocked: %g s/rhs" % ref_time
+
+    for cache_block_bytes in [1 << 17, 1 << 19, 1 << 21]:
+        for cache_block_min_nodes in [1024, 4096, 16384]:
+            blocked_time, blocked_result = run(
+                    cache_block_bytes=cache_block_bytes,
+                    cache_block_min_nodes=cache_block_min_nodes)
+            error = max(la.norm(ref_field - blocked_field)
+                    for ref_field, blocked_field
+                    in zip(ref_result, blocked_result))
+            print ("cache_block_bytes=%d, cache_block_min_nodes=%d: "
+                    "%g s/rhs, speedup %.2f, difference %g" % (
+                        cache_block_bytes, cache_block_min_nodes,
+                        blocked_time, ref_time/blocked_time, error))
+
+if __name__ == "__main__":
+    main()
@@ -84,6 +84,62 @@ def test_ab_coefficients():
 
 
 
+def test_ab_ring_buffer():
+    """Check Adams-Bashforth against the list-based history implementation
+    it replaced."""
+    from operator import add
+    from hedge.timestep.ab import (AdamsBashforthTimeStepper,
+            make_ab_coefficients)
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+
+    rng = numpy.random.RandomState(11)
+    mat = rng.randn(15, 15)
+    mat = mat - mat.T
+
+    def rhs(t, y):
+        return numpy.dot(mat, y) + numpy.cos(t)
+
+    def reference_steps(order, y, dt, step_count):
+        coefficients = make_ab_coefficients(order)
+        startup_stepper = LSRK4TimeStepper()
+
+        f_history = [rhs(0, y)]
+        result = []
+        for step in range(step_count):
+            t = step*dt
+            if len(f_history) < order:
+                ynew = startup_stepper(y, t, dt, rhs)
+            else:
+                ynew = y + dt * reduce(add,
+                        (coeff * f
+                            for coeff, f in
+                            zip(coefficients, f_history)))
+                f_history.pop()
+
+            f_history.insert(0, rhs(t+dt, ynew))
+            y = ynew
+            result.append(y)
+
+        return result
+
+    y0 = rng.randn(15)
+    dt = 0.01
+    step_count = 20
+    for order in range(1, 6):
+        stepper = AdamsBashforthTimeStepper(order)
+
+        y = y0
+        for step, ref_y in enumerate(reference_steps(order, y0, dt, step_count)):
+            y_before = y.copy()
+            new_y = stepper(y, step*dt, dt, rhs)
+            assert (y == y_before).all()
+            y = new_y
+
+            assert la.norm(y - ref_y) < 1e-13*la.norm(ref_y)
+
+
+
+
 class MultirateTimesteperAccuracyChecker:
     """Check that the multirate timestepper has the advertised accuracy
     """
@@ -222,7 +278,9 @@ def test_timestep_accuracy():
             SSP2TimeStepper,
             SSP3TimeStepper,
             SSP23FewStageTimeStepper,
-            SSP23ManyStageTimeStepper)
+            SSP23ManyStageTimeStepper,
+            SSPRK54TimeStepper,
+            SSPRK104TimeStepper)
 
     from hedge.timestep.imex_rk import KennedyCarpenterIMEXARK4
     from hedge.timestep.ab import AdamsBashforthTimeStepper
@@ -241,6 +299,9 @@ def test_timestep_accuracy():
     verify_timestep_order(lambda: SSP23FewStageTimeStepper(True), 3)
     verify_timestep_order(lambda: SSP23FewStageTimeStepper(False), 2)
 
+    verify_timestep_order(SSPRK54TimeStepper, 4)
+    verify_timestep_order(SSPRK104TimeStepper, 4)
+
     verify_timestep_order(lambda: ODE45TimeStepper(True), 5, dtmul=2**5)
     verify_timestep_order(lambda: ODE45TimeStepper(False), 4)
     verify_timestep_order(lambda: ODE23TimeStepper(True), 3, dtmul=2**3)
@@ -259,6 +320,456 @@ def test_timestep_accuracy():
 
 
 
+def test_embedded_rk_rhs_reuse():
+    """Check reuse of right-hand sides and storage in ODE23/ODE45"""
+    from hedge.timestep.runge_kutta import ODE23TimeStepper, ODE45TimeStepper
+
+    mat = numpy.array([[-1, 2], [-2, -1]], dtype=numpy.float64)
+    rhs_times = []
+
+    def rhs(t, y):
+        rhs_times.append(t)
+        return numpy.dot(mat, y) + numpy.sin(t)
+
+    def reference_step(stepper, y, t, dt):
+        rhss = []
+        for c, coeffs in stepper.butcher_tableau:
+            sub_y = y + dt*sum(coeff*f for coeff, f in zip(coeffs, rhss))
+            rhss.append(numpy.dot(mat, sub_y) + numpy.sin(t + c*dt))
+
+        if stepper.use_high_order:
+            coeffs = stepper.high_order_coeffs
+        else:
+            coeffs = stepper.low_order_coeffs
+        return y + dt*sum(coeff*f for coeff, f in zip(coeffs, rhss))
+
+    y0 = numpy.array([1, 0], dtype=numpy.float64)
+    dt = 0.05
+    step_count = 10
+
+    for stepper_class in [ODE23TimeStepper, ODE45TimeStepper]:
+        stage_count = len(stepper_class.butcher_tableau)
+
+        # {{{ fixed steps: accuracy, evaluation counts, storage reuse
+
+        for use_high_order in [True, False]:
+            stepper = stepper_class(use_high_order)
+            assert stepper.first_same_as_last == use_high_order
+
+            y = ref_y = y0
+            stage_storage = None
+            del rhs_times[:]
+            for step in range(step_count):
+                t = step*dt
+                y = stepper(y, t, dt, rhs)
+                ref_y = reference_step(stepper, ref_y, t, dt)
+                assert la.norm(y - ref_y) < 1e-13
+
+                if step > 0:
+                    assert stepper.stage_storage is stage_storage
+                stage_storage = stepper.stage_storage
+
+            if use_high_order:
+                # the last stage of each step is the first of the next
+                assert len(rhs_times) == 1 + step_count*(stage_count-1)
+            else:
+                assert len(rhs_times) == step_count*stage_count
+
+        # }}}
+
+        # {{{ adaptive steps: first stage survives rejected steps
+
+        stepper = stepper_class(rtol=1e-8, atol=1e-8)
+        assert stepper.first_same_as_last
+
+        y = y0
+        t = 0
+        next_dt = 1
+        low_order_storage = None
+        accepted_count = 0
+        del rhs_times[:]
+        while t < 1:
+            start_t = t
+            rhs_count = len(rhs_times)
+            y, t, taken_dt, next_dt = stepper(y, t, next_dt, rhs)
+            accepted_count += 1
+
+            # The right-hand side at the start of the step is only
+            # evaluated before the first step. It is not recomputed
+            # after a rejected attempt.
+            step_rhs_times = rhs_times[rhs_count:]
+            initial_count = step_rhs_times.count(start_t)
+            assert initial_count == (start_t == 0 and 1 or 0)
+            assert (len(step_rhs_times) - initial_count) \
+                    % (stage_count-1) == 0
+
+            if low_order_storage is not None:
+                assert stepper.low_order_storage is low_order_storage
+            low_order_storage = stepper.low_order_storage
+
+        # the initial step of 1 is too large to be accepted
+        attempt_count = (len(rhs_times) - 1) // (stage_count-1)
+        assert attempt_count > accepted_count
+
+        # }}}
+
+
+
+
+
+def test_dumka3_eigenvalue_estimate():
+    """Check Dumka3's built-in spectral radius estimate on a stiff linear
+    system"""
+    from hedge.timestep.dumka3 import Dumka3TimeStepper
+
+    decay_rates = numpy.linspace(1, 2000, 50)
+    rhs = lambda t, y: -decay_rates*y
+
+    eigenvalue_interval = 10
+    stepper = Dumka3TimeStepper(eigenvalue_interval=eigenvalue_interval)
+
+    rhs_count = [0]
+    def counting_rhs(t, y):
+        rhs_count[0] += 1
+        return rhs(t, y)
+
+    y = numpy.ones_like(decay_rates)
+    t = 0
+    dt = 0.02
+    step_count = 40
+    estimate_rhs_counts = []
+    for step in range(step_count):
+        rhs_count[0] = 0
+        y = stepper(y, t, dt, counting_rhs)
+        t += dt
+
+        assert 0.9*decay_rates[-1] < stepper.spectral_radius \
+                <= decay_rates[-1]*(1+1e-6)
+        estimate_rhs_counts.append(
+                rhs_count[0] - 3*len(stepper.stage_tables[stepper.pol_index]))
+
+    # warm-started re-estimates are cheaper than the initial one
+    assert max(estimate_rhs_counts[eigenvalue_interval:]) \
+            <= estimate_rhs_counts[0]
+    assert sum(1 for n in estimate_rhs_counts if n) \
+            <= step_count // eigenvalue_interval + 1
+
+    assert la.norm(y - numpy.exp(-decay_rates*t)) < 1e-6
+
+
+
+
+def test_stability_region_probing():
+    """Check vectorized stability region probing against one probe per
+    eigenvalue, and the coefficient hash used for caching results"""
+    from math import sqrt
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper, ODE23TimeStepper
+    from hedge.timestep.stability import (find_stable_magnitudes,
+            approximate_imag_stability_region,
+            _get_stepper_coefficient_hash)
+
+    mags = numpy.linspace(0.5, 4, 50)
+    k_values = numpy.hstack([
+        -1e-5 + 1j*mags,
+        mags*numpy.exp(0.75j*numpy.pi),
+        ])
+
+    for stepper_class, stepper_args in [
+            (LSRK4TimeStepper, ()),
+            (ODE23TimeStepper, (True,)),
+            ]:
+        stable = find_stable_magnitudes(stepper_class, stepper_args,
+                k_values)
+        assert stable.any() and not stable.all()
+        for k, k_stable in zip(k_values, stable):
+            assert find_stable_magnitudes(
+                    stepper_class, stepper_args, [k])[0] == k_stable
+
+    # The high-order ODE23 solution is that of a three-stage third-order
+    # method, whose stability region reaches up to sqrt(3) on the imaginary
+    # axis. Probing over finitely many steps allows for slight growth.
+    imag_extent = approximate_imag_stability_region(ODE23TimeStepper, True)
+    assert sqrt(3) <= imag_extent < 1.1*sqrt(3)
+
+    assert find_stable_magnitudes(ODE23TimeStepper, (True,),
+            [1j*0.99*sqrt(3)])[0]
+    assert not find_stable_magnitudes(ODE23TimeStepper, (True,),
+            [1j*1.1*imag_extent])[0]
+
+    # {{{ coefficient hash
+
+    class ModifiedODE23TimeStepper(ODE23TimeStepper):
+        high_order_coeffs = [2/9, 1/3, 4/9 + 1e-10, 0]
+
+    ode23_hash = _get_stepper_coefficient_hash(ODE23TimeStepper, (True,))
+    assert ode23_hash == _get_stepper_coefficient_hash(
+            ODE23TimeStepper, (True,))
+    assert ode23_hash != _get_stepper_coefficient_hash(
+            ODE23TimeStepper, (False,))
+    assert ode23_hash != _get_stepper_coefficient_hash(
+            ModifiedODE23TimeStepper, (True,))
+
+    # }}}
+
+
+
+
+def test_spectral_timestep_estimate():
+    """Check time steps found from Arnoldi eigenvalue estimates on an upwind
+    discretization of periodic advection"""
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from hedge.timestep.stability import (
+            approximate_imag_stability_region,
+            approximate_stability_region_boundary,
+            estimate_rhs_eigenvalues, stable_timestep_for_eigenvalues)
+
+    boundary = approximate_stability_region_boundary(LSRK4TimeStepper)
+    assert abs(boundary[0] - approximate_imag_stability_region(
+        LSRK4TimeStepper)) < 1e-3
+
+    n = 100
+    matrix = n*(numpy.eye(n, k=-1) - numpy.eye(n))
+    matrix[0, -1] = n
+    rhs = lambda t, y: numpy.dot(matrix, y)
+
+    exact_dt = stable_timestep_for_eigenvalues(la.eigvals(matrix))
+    estimated_dt = stable_timestep_for_eigenvalues(
+            estimate_rhs_eigenvalues(rhs, 0, numpy.zeros(n)))
+    assert abs(estimated_dt - exact_dt) < 0.05*exact_dt
+
+    def growth(dt, step_count=200):
+        stepper = LSRK4TimeStepper()
+        y = numpy.random.RandomState(0).randn(n)
+        y0_norm = la.norm(y)
+        for i in range(step_count):
+            y = stepper(y, i*dt, dt, rhs)
+        return la.norm(y)/y0_norm
+
+    assert growth(0.98*exact_dt) <= 1
+    assert growth(1.1*exact_dt) > 10
+
+
+
+
+def test_timestep_checkpoint():
+    """Check that restarting from a checkpoint reproduces the run exactly"""
+    import os
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from hedge.timestep.ab import AdamsBashforthTimeStepper
+
+    def rhs(t, y):
+        return numpy.array([y[1], -y[0]], dtype=numpy.float64)
+
+    def run(stepper, y, t, dt, nsteps):
+        for i in range(nsteps):
+            y = stepper(y, t, dt, rhs)
+            t += dt
+        return y, t
+
+    dt = 0.01
+    tmpdir = mkdtemp()
+    try:
+        filename_base = os.path.join(tmpdir, "ab")
+
+        for order in [1, 3, 4]:
+            # checkpoint both during and after startup
+            for first_steps in [order-1, order+5]:
+                stepper = AdamsBashforthTimeStepper(order)
+                y, t = run(stepper, numpy.array([1, 0], dtype=numpy.float64),
+                        0, dt, first_steps)
+                stepper.write_checkpoint(filename_base, y, t)
+
+                restarted = AdamsBashforthTimeStepper(order)
+                y_restart, t_restart = restarted.read_checkpoint(filename_base)
+                assert t_restart == t
+                assert (y_restart == y).all()
+                assert not isinstance(y_restart, numpy.memmap)
+
+                y_ref, t_ref = run(stepper, y.copy(), t, dt, 10)
+                y_restart, t_restart = run(restarted, y_restart, t_restart,
+                        dt, 10)
+                assert (y_ref == y_restart).all()
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_field_block():
+    """Check that contiguous field blocks stand in for object arrays"""
+    import os
+    from tempfile import mkdtemp
+    from shutil import rmtree
+    from hedge.tools import make_obj_array
+    from hedge.tools.field_block import (
+            FieldBlock, make_field_block, get_field_block_view)
+    from hedge.vector_primitives import VectorPrimitiveFactory
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from hedge.timestep.checkpoint import write_checkpoint, read_checkpoint
+
+    node_count = 50
+    rng = numpy.random.RandomState(11)
+    fields = make_obj_array([rng.randn(node_count) for i in range(3)])
+    block = make_field_block(fields)
+    assert block.shape == (3, node_count)
+
+    # components are plain views
+    assert type(block[1]) is numpy.ndarray
+    block[1][0] = 17
+    assert block[1, 0] == 17
+    block[1][0] = fields[1][0]
+
+    assert isinstance(block[1:], FieldBlock)
+    assert isinstance(2*block + block, FieldBlock)
+
+    assert get_field_block_view(block.components()) is not None
+    assert (get_field_block_view(block.components()[1:]) == block[1:]).all()
+    assert get_field_block_view(block.components()[::-1]) is None
+    assert get_field_block_view(fields) is None
+
+    # vector primitives act on the whole block
+    vpf = VectorPrimitiveFactory()
+    combiner = vpf.make_linear_combiner(
+            block.dtype, block.dtype, block, arg_count=2)
+    comb = combiner((2, block), (-1, block))
+    assert isinstance(comb, FieldBlock)
+    assert la.norm(comb - block) < 1e-14*la.norm(block)
+
+    inner = vpf.make_inner_product(block)
+    assert abs(inner(block, block) - sum(numpy.dot(f, f) for f in fields)) \
+            < 1e-12*inner(block, block)
+
+    # time stepping matches object arrays
+    def rhs(t, y):
+        return make_obj_array([y[1], -y[0], -y[2]])
+
+    def block_rhs(t, y):
+        return make_field_block(rhs(t, y))
+
+    obj_stepper = LSRK4TimeStepper()
+    block_stepper = LSRK4TimeStepper()
+    y = fields
+    y_block = block
+    for step in range(10):
+        y = obj_stepper(y, step*0.01, 0.01, rhs)
+        y_block = block_stepper(y_block, step*0.01, 0.01, block_rhs)
+
+    assert isinstance(y_block, FieldBlock)
+    for y_i, y_block_i in zip(y, y_block):
+        assert la.norm(y_i - y_block_i) < 1e-14*la.norm(y_i)
+
+    # blocks survive checkpoints
+    tmpdir = mkdtemp()
+    try:
+        filename_base = os.path.join(tmpdir, "block")
+        write_checkpoint(filename_base, {"y": y_block}, {})
+        vectors, meta = read_checkpoint(filename_base)
+        assert isinstance(vectors["y"], FieldBlock)
+        assert (vectors["y"] == y_block).all()
+    finally:
+        rmtree(tmpdir)
+
+
+
+
+def test_mixed_precision_lsrk4():
+    """Check LSRK4 with a single-precision state and double residuals"""
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+
+    rng = numpy.random.RandomState(5)
+    mat = rng.randn(20, 20)
+    mat = mat - mat.T
+
+    def rhs(t, y):
+        return numpy.dot(mat, y).astype(y.dtype)
+
+    y0 = rng.randn(20)
+    dt = 0.01
+
+    def run(stepper, y):
+        for step in range(100):
+            y = stepper(y, step*dt, dt, rhs)
+        return y
+
+    y_double = run(LSRK4TimeStepper(), y0)
+
+    stepper = LSRK4TimeStepper(dtype=numpy.float32,
+            residual_dtype=numpy.float64)
+    y_mixed = run(stepper, y0.astype(numpy.float32))
+
+    assert y_mixed.dtype == numpy.float32
+    assert stepper.residual.dtype == numpy.float64
+    assert la.norm(y_mixed - y_double) < 1e-5*la.norm(y_double)
+
+
+
+
+def test_lsrk4_fused_update():
+    """Check the fused LSRK4 stage updates against the unfused scheme"""
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from pytools.obj_array import make_obj_array
+
+    rng = numpy.random.RandomState(7)
+    mat = rng.randn(20, 20)
+    mat = mat - mat.T
+
+    def rhs(t, y):
+        return numpy.dot(mat, y) + numpy.sin(t)
+
+    def obj_array_rhs(t, y):
+        return make_obj_array([rhs(t, y[0]) + y[1], -y[0]])
+
+    def reference_step(y, t, dt, rhs):
+        residual = 0*y
+        for a, b, c in zip(LSRK4TimeStepper._RK4A, LSRK4TimeStepper._RK4B,
+                LSRK4TimeStepper._RK4C):
+            residual = a*residual + dt*rhs(t + c*dt, y)
+            y = y + b*residual
+        return y
+
+    def copy(y):
+        if y.dtype == object:
+            return make_obj_array([y_i.copy() for y_i in y])
+        else:
+            return y.copy()
+
+    def norm(y):
+        if y.dtype == object:
+            return la.norm(numpy.hstack(y))
+        else:
+            return la.norm(y)
+
+    dt = 0.01
+    for y0, this_rhs in [
+            (rng.randn(20), rhs),
+            (make_obj_array([rng.randn(20), rng.randn(20)]), obj_array_rhs),
+            ]:
+        stepper = LSRK4TimeStepper()
+
+        y = ref_y = y0
+        states = []
+        for step in range(20):
+            t = step*dt
+            y_before = copy(y)
+
+            new_y = stepper(y, t, dt, this_rhs)
+            # the caller's state is left alone
+            assert norm(y - y_before) == 0
+            y = new_y
+
+            ref_y = reference_step(ref_y, t, dt, this_rhs)
+            assert norm(y - ref_y) < 1e-12*norm(ref_y)
+
+            states.append((y, copy(y)))
+
+        # later steps do not overwrite states returned earlier
+        for state, state_copy in states:
+            assert norm(state - state_copy) == 0
+
+
+
+
 def test_imex_timestep_accuracy():
     """Check that all timesteppers have the advertised accuracy"""
     from math import sqrt, log, sin, cos
@@ -320,6 +831,100 @@ def test_imex_timestep_accuracy():
 
 
 
+def test_imex_newton_krylov_stage_solver():
+    """Check the Jacobian-free Newton-Krylov solver for implicit IMEX stages"""
+    from hedge.timestep.imex_rk import (
+            KennedyCarpenterIMEXARK4, NewtonKrylovStageSolver)
+
+    # stiff nonlinear relaxation towards sin(t)
+    stiffness = 200
+
+    def rhs_impl(t, y):
+        return -stiffness*(y-numpy.sin(t))*(1+y**2)
+
+    def rhs_expl(t, y):
+        return 0*y
+
+    solver = NewtonKrylovStageSolver(rhs_impl, newton_tol=1e-11,
+            krylov_tol=1e-4)
+
+    # stage equations are solved to the requested accuracy
+    y0 = numpy.linspace(-1, 1, 20)
+    for alpha in [0.01, 0.1]:
+        k = solver(0.3, y0, alpha)
+        residual = k - rhs_impl(0.3, y0+alpha*k)
+        assert la.norm(residual) < 1e-10*la.norm(k)
+
+    # repeating a solve reuses the previous solution
+    newton_its = solver.newton_counter.events
+    jac_vec_products = solver.jacobian_product_counter.events
+    solver(0.3, y0, 0.1)
+    assert solver.newton_counter.events == newton_its
+    assert solver.jacobian_product_counter.events == jac_vec_products
+
+    # time integration follows the slow manifold y ~ sin(t)
+    stepper = KennedyCarpenterIMEXARK4(True)
+    y = numpy.zeros(20)
+    t = 0
+    dt = 0.05
+    while t < 1-1e-10:
+        y = stepper(y, t, dt, rhs_expl, solver)
+        t += dt
+
+    assert la.norm(y-numpy.sin(t), numpy.inf) < 2/stiffness
+    assert solver.jacobian_product_counter.events > jac_vec_products
+
+    # preconditioners are rebuilt after precon_max_age stage solves, and
+    # once they stop working well
+    decay_rates = numpy.linspace(1, 100, 20)
+
+    def rhs_linear(t, y):
+        return -decay_rates*y
+
+    built_for = []
+
+    def precon_factory(t, y0, alpha):
+        built_for.append(decay_rates.copy())
+        return lambda y, scale=1+alpha*decay_rates: y/scale
+
+    solver = NewtonKrylovStageSolver(rhs_linear, newton_tol=1e-11,
+            krylov_tol=1e-6, recycle_count=0, precon_factory=precon_factory,
+            precon_max_age=3)
+    for i in range(4):
+        solver(0, y0 + i, 0.1)
+    assert len(built_for) == 2
+
+    decay_rates = decay_rates[::-1].copy()
+    solver(0, y0 + 4, 0.1)
+    assert len(built_for) == 2
+    solver(0, y0 + 5, 0.1)
+    assert len(built_for) == 3
+    assert (built_for[-1] == decay_rates).all()
+
+    # ... and when a Krylov solve fails
+    built_for = []
+
+    def identity_precon_factory(t, y0, alpha):
+        built_for.append(decay_rates.copy())
+        return lambda y: y
+
+    from hedge.iterative import ConvergenceError
+    solver = NewtonKrylovStageSolver(rhs_linear, newton_tol=1e-11,
+            krylov_tol=1e-6, recycle_count=0,
+            precon_factory=identity_precon_factory, max_krylov_iterations=1)
+    for i in range(2):
+        try:
+            solver(0, y0, 0.1)
+        except ConvergenceError:
+            pass
+        else:
+            assert False, "Krylov solve did not fail"
+
+    assert len(built_for) == 2
+
+
+
+
 def test_adaptive_timestep():
     class VanDerPolOscillator:
         def __init__(self, mu=30):
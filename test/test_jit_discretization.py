@@ -912,6 +912,451 @@ def test_convergence_advec_2d():
             assert eoc_rec.estimate_order_of_convergence(2)[-1, 1] > 10
 
 
+def test_ensemble_advec_2d():
+    """Check that advancing an ensemble matches advancing each member"""
+
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.timestep import RK4TimeStepper
+    from math import sin
+    from hedge.models.advection import StrongAdvectionOperator
+    from hedge.data import TimeDependentGivenFunction
+
+    v = numpy.array([0.27, 0.1])
+
+    def boundary_tagger(vertices, el, face_nr, all_v):
+        if numpy.dot(el.face_normals[face_nr], v) < 0:
+            return ["inflow"]
+        else:
+            return ["outflow"]
+
+    mesh = make_disk_mesh(r=1, boundary_tagger=boundary_tagger, max_area=0.1)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    op = StrongAdvectionOperator(v,
+            inflow_u=TimeDependentGivenFunction(
+                lambda x, el, t: sin(x[0]-t)),
+            flux_type="upwind")
+    rhs = op.bind(discr)
+
+    member_count = 4
+    members = [
+            discr.interpolate_volume_function(
+                lambda x, el: sin((i+1)*x[0] + x[1]))
+            for i in range(member_count)]
+    ensemble = numpy.array(numpy.array(members).T, order="C")
+
+    ensemble_rhs = rhs(0, ensemble)
+    assert ensemble_rhs.shape == ensemble.shape
+    for i, member in enumerate(members):
+        assert la.norm(ensemble_rhs[:, i] - rhs(0, member)) \
+                < 1e-12 * la.norm(ensemble_rhs[:, i])
+
+    dt = op.estimate_timestep(discr, stepper=RK4TimeStepper())
+    ensemble_stepper = RK4TimeStepper()
+    member_steppers = [RK4TimeStepper() for member in members]
+    for step in range(5):
+        ensemble = ensemble_stepper(ensemble, step*dt, dt, rhs)
+        members = [stepper(member, step*dt, dt, rhs)
+                for stepper, member in zip(member_steppers, members)]
+
+    for i, member in enumerate(members):
+        assert la.norm(ensemble[:, i] - member) < 1e-12 * la.norm(member)
+
+    # vectors shared by all members and per-member scalars
+    from hedge.optemplate import Field, ScalarParameter
+    c = discr.interpolate_volume_function(lambda x, el: 1 + x[0]**2)
+    a = numpy.arange(1., member_count+1).reshape(1, member_count)
+    result = discr.compile(
+            ScalarParameter("a")*Field("c")*Field("u") + Field("c"))(
+                    u=ensemble, c=c, a=a)
+    assert result.shape == ensemble.shape
+    for i in range(member_count):
+        ref = a[0, i]*c*ensemble[:, i] + c
+        assert la.norm(result[:, i] - ref) < 1e-12 * la.norm(ref)
+
+
+
+def test_field_block_wave_2d():
+    """Check that operators and time steppers accept field blocks"""
+
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.models.wave import StrongWaveOperator
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from hedge.tools import join_fields
+    from hedge.tools.field_block import FieldBlock, make_field_block
+
+    mesh = make_disk_mesh(r=1, max_area=0.1)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    op = StrongWaveOperator(-1, discr.dimensions, flux_type="upwind")
+    rhs = op.bind(discr)
+
+    fields = join_fields(
+            discr.interpolate_volume_function(
+                lambda x, el: numpy.cos(numpy.pi/2*la.norm(x))),
+            [discr.volume_zeros() for i in range(discr.dimensions)])
+    block = make_field_block(fields)
+
+    block_rhs = rhs(0, block)
+    assert isinstance(block_rhs, FieldBlock)
+    for rhs_i, block_rhs_i in zip(rhs(0, fields), block_rhs):
+        assert la.norm(rhs_i - block_rhs_i) < 1e-12 * la.norm(block_rhs)
+
+    assert abs(discr.norm(block) - discr.norm(fields)) \
+            < 1e-12 * discr.norm(fields)
+
+    # results are computed into the result block, also if one variable
+    # provides several components
+    from hedge.optemplate import make_sym_vector
+    w = make_sym_vector("w", 2)
+    combine = discr.compile(join_fields(2*w[0] + w[1], 2*w[0] + w[1], 0))
+    w_block = make_field_block(fields[:2])
+    combined = combine(w=w_block)
+    assert isinstance(combined, FieldBlock)
+    ref = 2*fields[0] + fields[1]
+    assert la.norm(combined[0] - ref) < 1e-12 * la.norm(ref)
+    assert la.norm(combined[1] - ref) < 1e-12 * la.norm(ref)
+    assert (combined[2] == 0).all()
+
+    dt = op.estimate_timestep(discr, stepper=LSRK4TimeStepper())
+    stepper = LSRK4TimeStepper()
+    block_stepper = LSRK4TimeStepper()
+    for step in range(5):
+        fields = stepper(fields, step*dt, dt, rhs)
+        block = block_stepper(block, step*dt, dt, rhs)
+
+    assert isinstance(block, FieldBlock)
+    for field, block_field in zip(fields, block):
+        assert la.norm(field - block_field) < 1e-12 * la.norm(block)
+
+
+
+def test_mixed_precision_wave_2d():
+    """Check that mixed precision matches double precision to single
+    precision accuracy"""
+
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.models.wave import StrongWaveOperator
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from hedge.tools import join_fields
+
+    mesh = make_disk_mesh(r=1, max_area=0.1)
+    op = StrongWaveOperator(-1, mesh.dimensions, flux_type="upwind")
+
+    def run(discr, stepper):
+        fields = join_fields(
+                discr.interpolate_volume_function(
+                    lambda x, el: numpy.cos(numpy.pi/2*la.norm(x))),
+                [discr.volume_zeros() for i in range(discr.dimensions)])
+
+        rhs = op.bind(discr)
+        initial_rhs = rhs(0, fields)
+
+        dt = op.estimate_timestep(discr, stepper=stepper)
+        for step in range(10):
+            fields = stepper(fields, step*dt, dt, rhs)
+
+        return initial_rhs, fields
+
+    double_discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    double_rhs, double_fields = run(double_discr, LSRK4TimeStepper())
+
+    mixed_discr = discr_class(mesh, order=3, mixed_precision=True,
+            debug=discr_class.noninteractive_debug_flags())
+    assert mixed_discr.default_scalar_type == numpy.float32
+    mixed_rhs, mixed_fields = run(mixed_discr,
+            LSRK4TimeStepper(dtype=numpy.float32,
+                residual_dtype=numpy.float64))
+
+    rhs_scale = max(la.norm(field) for field in double_rhs)
+    for double_field, mixed_field in zip(double_rhs, mixed_rhs):
+        assert la.norm(double_field - mixed_field) < 1e-5 * rhs_scale
+
+    field_scale = max(la.norm(field) for field in double_fields)
+    for double_field, mixed_field in zip(double_fields, mixed_fields):
+        assert mixed_field.dtype == numpy.float32
+        assert la.norm(double_field - mixed_field) < 1e-5 * field_scale
+
+    integral = mixed_discr.integral(mixed_fields[0])
+    assert numpy.asarray(integral).dtype == numpy.float64
+    assert abs(integral - double_discr.integral(double_fields[0])) \
+            < 1e-5 * abs(integral)
+
+
+def test_cache_blocked_rhs():
+    """Check that executing element-local instructions one block of
+    elements at a time leaves operator results unchanged"""
+
+    from hedge.mesh.generator import make_box_mesh
+    from hedge.models.wave import StrongWaveOperator
+    from hedge.models.advection import WeakAdvectionOperator
+    from hedge.backends.jit.compiler import BlockedInstructionGroup
+    from hedge.tools import join_fields
+
+    mesh = make_box_mesh(max_volume=0.01, periodicity=(True, True, True))
+
+    ref_discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    blocked_discr = discr_class(mesh, order=3, cache_block_bytes=1 << 15,
+            cache_block_min_nodes=256,
+            debug=discr_class.noninteractive_debug_flags())
+
+    def u0(x, el):
+        return numpy.sin(2*numpy.pi*x[0])*numpy.cos(2*numpy.pi*x[1]) \
+                + numpy.sin(2*numpy.pi*x[2])
+
+    def make_wave_fields(discr):
+        return join_fields(discr.interpolate_volume_function(u0),
+                [discr.volume_zeros() for i in range(discr.dimensions)])
+
+    def make_advection_fields(discr):
+        return discr.interpolate_volume_function(u0)
+
+    for op, make_fields in [
+            (StrongWaveOperator(-1, mesh.dimensions, flux_type="upwind"),
+                make_wave_fields),
+            (WeakAdvectionOperator(numpy.array([1, 0.5, 0.25]),
+                flux_type="upwind"),
+                make_advection_fields),
+            ]:
+        compiled = blocked_discr.compile(op.op_template())
+        assert any(isinstance(insn, BlockedInstructionGroup)
+                for insn in compiled.code.instructions)
+
+        ref_rhs = join_fields(op.bind(ref_discr)(0, make_fields(ref_discr)))
+        blocked_rhs = join_fields(
+                op.bind(blocked_discr)(0, make_fields(blocked_discr)))
+
+        rhs_scale = max(la.norm(field) for field in ref_rhs)
+        for ref_field, blocked_field in zip(ref_rhs, blocked_rhs):
+            assert la.norm(ref_field - blocked_field) < 1e-12 * rhs_scale
+
+
+def test_batched_nodal_reductions():
+    """Check that nodal reductions evaluated in one batch match the same
+    reductions evaluated one at a time"""
+
+    from hedge.mesh.generator import make_rect_mesh
+    from hedge.optemplate import Field
+    from hedge.optemplate.operators import NodalSum, NodalMax, NodalMin
+    from hedge.compiler import ReductionBatchAssign
+    from hedge.tools import join_fields
+
+    mesh = make_rect_mesh(a=(-1, -1), b=(1, 1), max_area=0.05)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+
+    u = discr.interpolate_volume_function(
+            lambda x, el: numpy.sin(3*x[0]) + x[1])
+    v = discr.interpolate_volume_function(
+            lambda x, el: numpy.cos(2*x[1]) - x[0]**2)
+
+    u_fld = Field("u")
+    v_fld = Field("v")
+    reductions = [
+            (NodalSum()(u_fld), numpy.sum(u)),
+            (NodalMax()(u_fld*u_fld), numpy.max(u*u)),
+            (NodalMin()(v_fld), numpy.min(v)),
+            (NodalMax()(v_fld-u_fld), numpy.max(v-u)),
+            (NodalSum()(u_fld*v_fld), numpy.sum(u*v)),
+            (NodalMin()(u_fld+2*v_fld), numpy.min(u+2*v)),
+            ]
+
+    batched_op = discr.compile(join_fields(*[red for red, ref in reductions]))
+    assert any(isinstance(insn, ReductionBatchAssign)
+            and len(insn.names) == len(reductions)
+            for insn in batched_op.code.instructions)
+
+    batched = batched_op(u=u, v=v)
+    for (red, ref), batched_value in zip(reductions, batched):
+        assert batched_value == discr.compile(red)(u=u, v=v)
+        assert abs(batched_value - ref) < 1e-12 * max(1, abs(ref))
+
+
+def test_local_time_stepping():
+    """Test local time stepping of 1D advection on a graded mesh"""
+
+    from math import pi
+    from hedge.mesh.generator import make_1d_mesh
+    from hedge.models.advection import StrongAdvectionOperator
+    from hedge.timestep.ab import AdamsBashforthTimeStepper
+    from hedge.timestep.lts import (
+            estimate_element_dts,
+            LocalTimeSteppingAdamsBashforth)
+
+    # a few small elements in an otherwise coarse mesh
+    points = numpy.hstack([
+        numpy.linspace(0, 3, 16)[:-1],
+        numpy.linspace(3, 3.2, 5)[:-1],
+        numpy.linspace(3.2, 2*pi, 16),
+        ])
+    mesh = make_1d_mesh(points, periodic=True)
+
+    discr = discr_class(mesh, order=4,
+            debug=discr_class.noninteractive_debug_flags())
+    op = StrongAdvectionOperator(numpy.array([1.]), flux_type="upwind")
+
+    def u_analytic(x, el, t):
+        return numpy.sin(x[0]-t)
+
+    u = discr.interpolate_volume_function(
+            lambda x, el: u_analytic(x, el, 0))
+
+    order = 3
+    element_dts = estimate_element_dts(discr,
+            op.max_eigenvalue(0, u, discr),
+            stepper_class=AdamsBashforthTimeStepper, stepper_args=(order,))
+    stepper = LocalTimeSteppingAdamsBashforth(
+            discr, op.bind, order, element_dts)
+    assert len(stepper.rate_classes) > 1
+
+    rhs = op.bind(discr)
+    dt = stepper.macro_dt
+    nsteps = int(1/dt) + 1
+    for step in range(nsteps):
+        u = stepper(u, step*dt, dt, rhs)
+
+    u_true = discr.interpolate_volume_function(
+            lambda x, el: u_analytic(x, el, nsteps*dt))
+    assert discr.norm(u - u_true) < 1e-4
+
+    # stepping all elements at the finest rate would take this many
+    # element right-hand side evaluations
+    single_rate_count = nsteps * 2**stepper.max_rate * len(mesh.elements)
+    assert stepper.rhs_element_counter() < single_rate_count
+
+
+def test_cfl_estimator():
+    """Check element-wise CFL estimation against the per-element estimate"""
+
+    from hedge.mesh.generator import make_rect_mesh
+    from hedge.optemplate import Field
+    from hedge.optemplate.operators import ElementwiseMaxOperator
+    from hedge.timestep.cfl import CFLTimestepEstimator
+    from hedge.timestep.lts import estimate_element_dts
+
+    mesh = make_rect_mesh(a=(-1, -1), b=(1, 1), max_area=0.02)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+
+    wave_speeds = discr.compile(ElementwiseMaxOperator()(Field("c")))(
+            c=discr.interpolate_volume_function(
+                lambda x, el: 1 + x[0]**2 + 0.5*x[1]))
+
+    estimator = CFLTimestepEstimator(discr)
+    estimator.submit_wave_speeds(wave_speeds)
+
+    ref_dt = numpy.min(estimate_element_dts(discr, wave_speeds))
+    assert abs(estimator(0) - ref_dt) < 1e-12 * ref_dt
+    assert abs(estimator.max_wave_speed() - numpy.max(wave_speeds)) < 1e-12
+
+    # with a communicator, only calls that reduce return an unscaled value
+    class MPI:
+        MIN = min
+
+    class Request:
+        def Wait(self):
+            pass
+
+    class Communicator:
+        reduction_count = 0
+        check_count = 0
+
+        def allreduce(self, value, op):
+            self.reduction_count += 1
+            return value
+
+        def Iallreduce(self, send_buf, recv_buf, op):
+            self.check_count += 1
+            recv_buf[:] = send_buf
+            return Request()
+
+    estimator.communicator = comm = Communicator()
+    estimator.mpi = MPI
+    estimator.reduction_interval = 3
+    dts = [estimator(0) for i in range(6)]
+    assert comm.reduction_count == 2
+    for i, dt in enumerate(dts):
+        if i % 3 == 0:
+            assert dt == ref_dt
+        else:
+            assert abs(dt - ref_dt/estimator.growth_bound) < 1e-12 * ref_dt
+
+    # wave speeds that outgrow growth_bound between reductions are caught
+    # by the call right after they are submitted
+    estimator.reduction_interval = 8
+    for i in range(3):
+        estimator.submit_wave_speeds(wave_speeds)
+        assert estimator(0) < ref_dt
+    assert comm.reduction_count == 2
+
+    estimator.submit_wave_speeds(3*wave_speeds)
+    assert comm.check_count == 4
+    assert abs(estimator(0) - ref_dt/3) < 1e-12 * ref_dt
+    assert comm.reduction_count == 3
+    assert estimator.reduction_interval == 4
+
+    # operators without element-wise wave speeds fall back to max_eigenvalue
+    from hedge.models.advection import StrongAdvectionOperator
+    op = StrongAdvectionOperator(numpy.array([1., 0.5]))
+    max_eigenvalue = op.max_eigenvalue(0, None, discr)
+    op_dt = op.estimate_timestep(discr, t=0,
+            cfl_estimator=op.make_cfl_estimator(discr))
+    ref_dt = numpy.min(estimate_element_dts(discr, max_eigenvalue))
+    assert abs(op_dt - ref_dt) < 1e-12 * ref_dt
+    assert op_dt >= (1 - 1e-12) * op.estimate_timestep(discr, t=0)
+
+    # ... and take it from the current fields on every call
+    class StateDependentOperator(StrongAdvectionOperator):
+        def max_eigenvalue(self, t=None, fields=None, discr=None):
+            return fields
+
+    op = StateDependentOperator(numpy.array([1., 0.5]))
+    estimator = op.make_cfl_estimator(discr)
+    dt = op.estimate_timestep(discr, t=0, fields=1,
+            cfl_estimator=estimator)
+    assert abs(op.estimate_timestep(discr, t=0, fields=2,
+            cfl_estimator=estimator) - dt/2) < 1e-12 * dt
+
+
+def test_spectral_timestep_estimate():
+    """Check that spectrally estimated time steps keep advection stable"""
+
+    from hedge.mesh.generator import make_regular_rect_mesh
+    from hedge.models.advection import StrongAdvectionOperator
+    from hedge.data import TimeDependentGivenFunction
+    from hedge.timestep.runge_kutta import LSRK4TimeStepper
+    from math import sin, pi
+
+    v = numpy.array([0.8, 0.3])
+    mesh = make_regular_rect_mesh(a=(0, 0), b=(2*pi, 2*pi), n=(6, 6),
+            periodicity=(True, True))
+    discr = discr_class(mesh, order=4,
+            debug=discr_class.noninteractive_debug_flags())
+    op = StrongAdvectionOperator(v,
+            inflow_u=TimeDependentGivenFunction(lambda x, el, t: 0),
+            flux_type="upwind")
+
+    u = discr.interpolate_volume_function(
+            lambda x, el: sin(x[0])*sin(2*x[1]))
+    u0_norm = discr.norm(u)
+
+    stepper = LSRK4TimeStepper()
+    dt = op.estimate_timestep(discr, stepper=stepper, fields=u,
+            spectral=True)
+    assert discr in op._eigenvalue_cache
+    assert op.estimate_timestep(discr, stepper=stepper, fields=u,
+            spectral=True) == dt
+
+    rhs = op.bind(discr)
+    for step in range(int(2/dt)):
+        u = stepper(u, step*dt, dt, rhs)
+
+    # upwind advection is dissipative
+    assert discr.norm(u) <= u0_norm
+
+
 @pytools.test.mark_test.long
 def test_elliptic():
     """Test various properties of elliptic operators."""
@@ -1015,6 +1460,240 @@ def test_elliptic():
     assert eocrec.estimate_order_of_convergence()[0, 1] > 8
 
 
+def test_block_jacobi_preconditioner():
+    """Check that the block-Jacobi preconditioner finds the element-diagonal
+    blocks of elliptic operators and speeds up CG."""
+
+    from hedge.mesh import TAG_ALL, TAG_NONE
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.data import GivenFunction
+    from hedge.models.poisson import PoissonOperator
+    from hedge.second_order import LDGSecondDerivative, IPDGSecondDerivative
+    from hedge.iterative import parallel_cg
+    from hedge.tools import unit_vector
+    from math import sin
+
+    mesh = make_disk_mesh(r=0.5, max_area=0.05)
+
+    for scheme in [LDGSecondDerivative(), IPDGSecondDerivative()]:
+        discr = discr_class(mesh, order=4,
+                debug=discr_class.noninteractive_debug_flags())
+
+        op = PoissonOperator(discr.dimensions,
+                dirichlet_tag=TAG_ALL,
+                dirichlet_bc=GivenFunction(lambda x, el: sin(x[0])),
+                neumann_tag=TAG_NONE, scheme=scheme)
+        bound_op = op.bind(discr)
+        precon = bound_op.block_jacobi_preconditioner()
+
+        # compare against columns of the full operator for one element
+        el_rng = discr.find_el_range(0)
+        blk = numpy.array([
+            bound_op(unit_vector(len(discr), j))[el_rng]
+            for j in range(el_rng.start, el_rng.stop)]).T
+        assert la.norm(la.inv(blk) - precon.inverse_blocks[0][0]) \
+                < 1e-10*la.norm(la.inv(blk))
+
+        rhs = bound_op.prepare_rhs(discr.interpolate_volume_function(
+            lambda x, el: sin(3*x[0])*x[1]))
+
+        def solve(precon):
+            iterations = [0]
+
+            def count_iterations(what, *args):
+                if what != "end":
+                    iterations[0] += 1
+
+            sol = -parallel_cg(discr.run_context, -bound_op, rhs,
+                    precon=precon, tol=1e-10, max_iterations=40000,
+                    debug_callback=count_iterations)
+            return sol, iterations[0]
+
+        plain_sol, plain_iterations = solve(None)
+        bj_sol, bj_iterations = solve(-precon)
+
+        assert discr.norm(plain_sol - bj_sol) < 1e-7*discr.norm(plain_sol)
+        assert 2*bj_iterations < plain_iterations
+
+
+def test_p_multigrid_preconditioner():
+    """Check that p-multigrid-preconditioned CG needs few iterations,
+    nearly independently of the order."""
+
+    from hedge.mesh import TAG_ALL, TAG_NONE
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.data import GivenFunction
+    from hedge.models.poisson import PoissonOperator
+    from hedge.iterative import parallel_cg
+    from math import sin
+
+    mesh = make_disk_mesh(r=0.5, max_area=0.05)
+
+    def make_discr(order):
+        return discr_class(mesh, order=order,
+                debug=discr_class.noninteractive_debug_flags())
+
+    mg_iteration_counts = []
+    for order in [4, 8]:
+        discr = make_discr(order)
+        op = PoissonOperator(discr.dimensions,
+                dirichlet_tag=TAG_ALL,
+                dirichlet_bc=GivenFunction(lambda x, el: sin(x[0])),
+                neumann_tag=TAG_NONE)
+        bound_op = op.bind(discr)
+
+        coarse_orders = []
+        coarse_order = order // 2
+        while coarse_order >= 1:
+            coarse_orders.append(coarse_order)
+            coarse_order //= 2
+
+        rhs = bound_op.prepare_rhs(discr.interpolate_volume_function(
+            lambda x, el: sin(3*x[0])*x[1]))
+
+        def solve(precon):
+            iterations = [0]
+
+            def count_iterations(what, *args):
+                if what != "end":
+                    iterations[0] += 1
+
+            sol = -parallel_cg(discr.run_context, -bound_op, rhs,
+                    precon=precon, tol=1e-10, max_iterations=40000,
+                    debug_callback=count_iterations)
+            return sol, iterations[0]
+
+        bj_sol, bj_iterations = solve(-bound_op.block_jacobi_preconditioner())
+
+        for coarse_solver in ["direct", "cg"]:
+            mg = bound_op.p_multigrid_preconditioner(
+                    [make_discr(o) for o in coarse_orders],
+                    coarse_solver=coarse_solver)
+            mg_sol, mg_iterations = solve(-mg)
+
+            assert discr.norm(mg_sol - bj_sol) < 1e-7*discr.norm(bj_sol)
+            assert 2*mg_iterations < bj_iterations
+
+        mg_iteration_counts.append(mg_iterations)
+
+    assert mg_iteration_counts[1] < 1.5*mg_iteration_counts[0]
+
+
+def test_pipelined_and_block_cg():
+    """Check pipelined and block CG against plain CG on a Poisson problem."""
+
+    from hedge.mesh import TAG_ALL, TAG_NONE
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.data import GivenFunction
+    from hedge.models.poisson import PoissonOperator
+    from hedge.iterative import parallel_cg, pipelined_cg, block_cg
+    from math import sin, cos
+
+    mesh = make_disk_mesh(r=0.5, max_area=0.05)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    rcon = discr.run_context
+
+    op = PoissonOperator(discr.dimensions,
+            dirichlet_tag=TAG_ALL,
+            dirichlet_bc=GivenFunction(lambda x, el: 0),
+            neumann_tag=TAG_NONE)
+    bound_op = op.bind(discr)
+    precon = -bound_op.block_jacobi_preconditioner()
+
+    rhss = [bound_op.prepare_rhs(discr.interpolate_volume_function(f))
+            for f in [
+                lambda x, el: sin(3*x[0])*x[1],
+                lambda x, el: cos(x[0]+x[1]),
+                lambda x, el: 1,
+                ]]
+
+    cg_sols = [parallel_cg(rcon, -bound_op, -rhs, precon=precon, tol=1e-10)
+            for rhs in rhss]
+
+    for rhs, cg_sol in zip(rhss, cg_sols):
+        sol = pipelined_cg(rcon, -bound_op, -rhs, precon=precon, tol=1e-10)
+        assert discr.norm(sol - cg_sol) < 1e-7*discr.norm(cg_sol)
+
+    block_sol = block_cg(rcon, -bound_op, -numpy.array(rhss).T,
+            precon=precon, tol=1e-10)
+    for j, cg_sol in enumerate(cg_sols):
+        assert discr.norm(block_sol[:, j] - cg_sol) \
+                < 1e-7*discr.norm(cg_sol)
+
+
+def test_indefinite_krylov_solvers():
+    """Check GMRES, BiCGStab and MINRES on an indefinite Helmholtz problem."""
+
+    from hedge.mesh import TAG_ALL, TAG_NONE
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.data import GivenFunction
+    from hedge.models.poisson import PoissonOperator, HelmholtzOperator
+    from hedge.iterative import gmres, bicgstab, minres
+    from math import sin
+
+    mesh = make_disk_mesh(r=0.5, max_area=0.05)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+    rcon = discr.run_context
+
+    bc_kwargs = dict(
+            dirichlet_tag=TAG_ALL,
+            dirichlet_bc=GivenFunction(lambda x, el: 0),
+            neumann_tag=TAG_NONE)
+
+    # k**2 lies between the first two Dirichlet eigenvalues of the disk
+    bound_op = HelmholtzOperator(6, discr.dimensions, **bc_kwargs).bind(discr)
+    rhs = bound_op.prepare_rhs(discr.interpolate_volume_function(
+        lambda x, el: sin(3*x[0])*x[1]))
+
+    ref_sol = gmres(rcon, bound_op, rhs, tol=1e-10, restart=len(discr))
+
+    def check(sol):
+        assert discr.norm(sol - ref_sol) < 1e-6*discr.norm(ref_sol)
+
+    precon = bound_op.block_jacobi_preconditioner()
+    check(gmres(rcon, bound_op, rhs, precon=precon, tol=1e-10))
+    check(bicgstab(rcon, bound_op, rhs, precon=precon, tol=1e-10))
+
+    # MINRES needs a positive definite preconditioner
+    check(minres(rcon, bound_op, rhs, tol=1e-10))
+    spd_precon = -PoissonOperator(discr.dimensions, **bc_kwargs).bind(
+            discr).block_jacobi_preconditioner()
+    check(minres(rcon, bound_op, rhs, precon=spd_precon, tol=1e-10))
+
+
+def test_sparse_matrix_assembly():
+    """Check the sparse matrix of an elliptic operator against its
+    matrix-free application."""
+
+    from hedge.mesh import TAG_ALL, TAG_NONE
+    from hedge.mesh.generator import make_disk_mesh
+    from hedge.data import GivenFunction
+    from hedge.models.poisson import PoissonOperator
+    from hedge.second_order import LDGSecondDerivative, IPDGSecondDerivative
+    from scipy.sparse.linalg import spsolve
+
+    mesh = make_disk_mesh(r=0.5, max_area=0.05)
+    discr = discr_class(mesh, order=3,
+            debug=discr_class.noninteractive_debug_flags())
+
+    for scheme in [LDGSecondDerivative(), IPDGSecondDerivative()]:
+        bound_op = PoissonOperator(discr.dimensions,
+                dirichlet_tag=TAG_ALL,
+                dirichlet_bc=GivenFunction(lambda x, el: 0),
+                neumann_tag=TAG_NONE, scheme=scheme).bind(discr)
+
+        matrix = bound_op.sparse_matrix()
+        assert matrix.nnz < len(discr)**2
+
+        x = numpy.random.randn(len(discr)).astype(bound_op.dtype)
+        assert la.norm(matrix*x - bound_op(x)) < 1e-10*la.norm(bound_op(x))
+
+        rhs = bound_op(x)
+        assert la.norm(spsolve(matrix, rhs) - x) < 1e-8*la.norm(x)
+
+
 def test_projection():
     """Test whether projection between different orders works"""
 
@@ -173,5 +173,368 @@ def test_hedge_parallel():
 
 
 
+def check_flux_exchange(rcon, dtype):
+    """Check that repeated right-hand side evaluations, which reuse the
+    persistent flux exchange channels, match a serial computation."""
+    from hedge.mesh.generator import make_rect_mesh
+    from hedge.models.advection import StrongAdvectionOperator
+    from hedge.data import TimeDependentGivenFunction
+    from hedge.backends.mpi import reassemble_volume_field
+    from math import sin
+
+    v = numpy.array([0.3, 0.9])
+
+    def u_analytic(x, el, t):
+        return sin(3*numpy.dot(v, x) - t)
+
+    mesh = make_rect_mesh(a=(-1, -1), b=(1, 1), max_area=0.02,
+            periodicity=(True, False))
+
+    # a random partition splits many faces across ranks
+    from random import Random
+    rng = Random(17)
+    partition = [rng.choice(rcon.ranks) for el in mesh.elements]
+
+    if rcon.is_head_rank:
+        mesh_data = rcon.distribute_mesh(mesh, partition)
+    else:
+        mesh_data = rcon.receive_mesh()
+
+    op = StrongAdvectionOperator(v,
+            inflow_u=TimeDependentGivenFunction(u_analytic),
+            flux_type="upwind")
+
+    discr = rcon.make_discretization(mesh_data, order=3,
+            default_scalar_type=dtype)
+    rhs = op.bind(discr)
+
+    # Keep all results: exchange buffers reused by later evaluations must
+    # not change the results of earlier ones.
+    times = [0.1*i for i in range(5)]
+    results = [
+            rhs(t, discr.interpolate_volume_function(
+                lambda x, el: u_analytic(x, el, t)))
+            for t in times]
+
+    if rcon.is_head_rank:
+        from hedge.backends.jit import Discretization
+        serial_discr = Discretization(mesh, order=3,
+                default_scalar_type=dtype)
+    else:
+        serial_discr = None
+
+    results = [reassemble_volume_field(rcon, serial_discr, discr, result)
+            for result in results]
+
+    if rcon.is_head_rank:
+        serial_rhs = op.bind(serial_discr)
+
+        tolerance = 1e-4 if dtype == numpy.float32 else 1e-10
+        for t, result in zip(times, results):
+            ref = serial_rhs(t, serial_discr.interpolate_volume_function(
+                lambda x, el: u_analytic(x, el, t)))
+            assert la.norm(result - ref) <= tolerance*la.norm(ref)
+
+    discr.close()
+
+
+
+
+def run_flux_exchange_test(dtype):
+    # picked up by __main__ when this file is rerun under mpirun
+    import os
+    os.environ["HEDGE_PARALLEL_TEST"] = "flux_exchange:%s" % (
+            numpy.dtype(dtype).name)
+
+    from hedge.backends import guess_run_context
+    from pytools.mpi import run_with_mpi_ranks
+    run_with_mpi_ranks(__file__, 2, lambda: check_flux_exchange(
+        guess_run_context(["mpi"]), dtype))
+
+
+
+
+def test_flux_exchange():
+    from pytools.test import mark_test
+
+    for dtype in [numpy.float32, numpy.float64]:
+        yield ("flux exchange in %s precision" % dtype,
+                mark_test.mpi(run_flux_exchange_test),
+                dtype)
+
+
+
+
+def check_repartition(rcon):
+    """Check that fields moved to a discretization built from a weighted
+    repartition keep their values and their global integrals."""
+    from hedge.mesh.generator import make_rect_mesh
+    from hedge.backends.mpi import migrate_volume_field
+    from hedge.partition import partition_imbalance
+    from hedge.tools import join_fields
+
+    mesh = make_rect_mesh(a=(-1, -1), b=(1, 1), max_area=0.02)
+
+    if rcon.is_head_rank:
+        mesh_data = rcon.distribute_mesh(mesh)
+    else:
+        mesh_data = rcon.receive_mesh()
+
+    discr = rcon.make_discretization(mesh_data, order=3)
+
+    def f(x, el):
+        return numpy.sin(2*x[0]) + x[1]**2
+
+    u = discr.interpolate_volume_function(f)
+    fields = join_fields(u, 2*u)
+
+    # elements in the right half are ten times as expensive
+    global_weights = numpy.array([
+        10 if el.centroid(mesh.points)[0] > 0 else 1
+        for el in mesh.elements], dtype=numpy.float64)
+
+    from pytools import reverse_dictionary
+    local2global_elements = reverse_dictionary(discr.global2local_elements)
+    weights = global_weights[[local2global_elements[local_el_id]
+        for local_el_id in range(len(local2global_elements))]]
+
+    new_mesh_data = rcon.repartition(discr, element_weights=weights)
+    assert new_mesh_data is not None
+
+    if rcon.is_head_rank:
+        assert partition_imbalance(rcon.global_partition, global_weights,
+                len(rcon.ranks)) < 0.1
+
+    new_discr = rcon.make_discretization(new_mesh_data, order=3)
+    new_fields = migrate_volume_field(rcon, discr, new_discr, fields)
+
+    ref = new_discr.interpolate_volume_function(f)
+    for new_field, factor in zip(new_fields, [1, 2]):
+        assert la.norm(new_field - factor*ref) <= 1e-12*la.norm(ref)
+
+    integral = discr.integral(u)
+    assert abs(new_discr.integral(new_fields[0]) - integral) \
+            <= 1e-12*abs(integral)
+
+    discr.close()
+    new_discr.close()
+
+
+
+
+def test_repartition():
+    """Repartition with skewed element weights on shared-memory ranks"""
+    from hedge.backends.shm import run_with_shared_memory_ranks
+    run_with_shared_memory_ranks(2, check_repartition)
+
+
+
+
+def test_rank_boundary_flux_priority():
+    """Check that rank boundary fluxes are scheduled after local work."""
+    from pymbolic.primitives import Variable
+    from hedge.optemplate import (DependencyMapper, OperatorBinding,
+            BoundaryPair)
+    from hedge.optemplate.operators import FluxOperator, BoundaryFluxOperator
+    from hedge.compiler import Assign, FluxExchangeBatchAssign, Code
+    from hedge.backends.jit.compiler import CompiledFluxBatchAssign
+    from hedge.mesh import TAG_RANK_BOUNDARY
+
+    def dep_mapper_factory(include_subscripts=False):
+        return DependencyMapper(
+                include_operator_bindings=False,
+                include_subscripts=include_subscripts,
+                include_calls="descend_args")
+
+    u = Variable("u")
+    u_remote = Variable("u_remote")
+    rank_tag = TAG_RANK_BOUNDARY(1)
+
+    def make_flux_batch(name, op, field):
+        return CompiledFluxBatchAssign(
+                names=[name], expressions=[OperatorBinding(op, field)],
+                repr_op=op.repr_op(), dep_mapper_factory=dep_mapper_factory)
+
+    exchange = FluxExchangeBatchAssign(
+            names=["u_remote"], indices_and_ranks=[(0, 1)],
+            arg_fields=[u], dep_mapper_factory=dep_mapper_factory)
+    volume = Assign(names=["vol"], exprs=[2*u],
+            dep_mapper_factory=dep_mapper_factory)
+    int_flux = make_flux_batch("int_flux", FluxOperator(0), u)
+    bdry_flux = make_flux_batch("bdry_flux",
+            BoundaryFluxOperator(0, "inflow"), BoundaryPair(u, u, "inflow"))
+    rank_flux = make_flux_batch("rank_flux",
+            BoundaryFluxOperator(0, rank_tag),
+            BoundaryPair(u, u_remote, rank_tag))
+
+    assert exchange.priority == 1
+    assert volume.priority == int_flux.priority == bdry_flux.priority == 0
+    assert rank_flux.priority == -1
+
+    class ExchangeFuture(object):
+        def is_ready(self):
+            return False
+
+        def __call__(self):
+            return [("u_remote", 1)], []
+
+    class RecordingExecutionMapper(object):
+        def __init__(self):
+            self.context = {"u": 1}
+            self.log = []
+
+        def exec_flux_exchange_batch_assign(self, insn):
+            self.log.append(insn)
+            return [], [ExchangeFuture()]
+
+        def exec_assign(self, insn):
+            self.log.append(insn)
+            return [(name, 1) for name in insn.names], []
+
+        exec_flux_batch_assign = exec_assign
+
+        def wait_for_future(self, future):
+            self.log.append("wait")
+            return future()
+
+        def __call__(self, expr):
+            return self.context[expr.name]
+
+    from pytools.obj_array import make_obj_array
+    code = Code([rank_flux, bdry_flux, int_flux, volume, exchange],
+            make_obj_array([Variable(name)
+                for name in ["vol", "int_flux", "bdry_flux", "rank_flux"]]))
+
+    # The first run is scheduled dynamically and records its schedule,
+    # the second one replays the recorded schedule.
+    for static in [False, True]:
+        assert (code.last_schedule is not None) == static
+
+        exec_mapper = RecordingExecutionMapper()
+        code.execute(exec_mapper)
+
+        log = exec_mapper.log
+        assert log[0] is exchange
+        assert set(log[1:4]) == set([volume, int_flux, bdry_flux])
+        assert log[4:] == ["wait", rank_flux]
+
+
+
+
+def test_weighted_partition():
+    """Check that element weights improve the balance of a partition"""
+    from hedge.mesh.generator import make_rect_mesh
+    from hedge.partition import (ElementCostModel, partition_weighted,
+            partition_imbalance)
+
+    mesh = make_rect_mesh(a=(-1, -1), b=(1, 1), max_area=0.01)
+
+    # pretend a shock sensor is active on the left half of the domain
+    cost_factors = numpy.array([
+        4 if numpy.average(
+            [mesh.points[vi][0] for vi in el.vertex_indices]) < 0 else 1
+        for el in mesh.elements])
+    weights = ElementCostModel().element_weights(mesh, cost_factors)
+
+    part_count = 4
+    unweighted = partition_weighted(mesh, part_count)
+    weighted = partition_weighted(mesh, part_count, element_weights=weights)
+
+    assert len(weighted) == len(mesh.elements)
+    assert set(weighted) == set(range(part_count))
+
+    weighted_imbalance = partition_imbalance(weighted, weights, part_count)
+    assert weighted_imbalance < 0.1
+    assert weighted_imbalance < partition_imbalance(
+            unweighted, weights, part_count)
+
+
+
+
+def check_shared_memory_communication(rcon):
+    from hedge.backends.shm import SUM, MAX
+
+    comm = rcon.communicator
+    rank, size = comm.rank, comm.size
+
+    assert comm.allreduce(rank, op=SUM) == sum(range(size))
+    assert comm.allgather(rank) == range(size)
+
+    # ring exchange through persistent requests
+    send_buf = numpy.zeros(5)
+    recv_buf = numpy.zeros(5)
+    next_rank = (rank+1) % size
+    prev_rank = (rank-1) % size
+    send_req = comm.Send_init([send_buf, None], next_rank, tag=1)
+    recv_req = comm.Recv_init([recv_buf, None], source=prev_rank, tag=1)
+
+    for i in range(20):
+        recv_req.Start()
+        send_buf.fill(100*rank+i)
+        send_req.Start()
+
+        recv_req.Wait()
+        send_req.Wait()
+        assert (recv_buf == 100*prev_rank+i).all()
+
+    send_req.Free()
+    recv_req.Free()
+
+    values = numpy.array([rank, -rank], dtype=numpy.float64)
+    result = numpy.empty_like(values)
+    comm.Allreduce(values, result, op=MAX)
+    assert list(result) == [size-1, 0]
+
+
+
+
+def test_shared_memory_communicator():
+    from hedge.backends.shm import run_with_shared_memory_ranks
+    run_with_shared_memory_ranks(3, check_shared_memory_communication)
+
+
+
+
+def fail_on_one_rank(rcon):
+    comm = rcon.communicator
+    if comm.rank == 1:
+        raise ValueError("failing on purpose")
+
+    # would wait forever if the failed rank's peers were not terminated
+    comm.recv(source=1, tag=1)
+
+
+
+
+def test_shared_memory_rank_failure():
+    """Check that a failing shared-memory rank does not hang the others"""
+    from hedge.backends.shm import run_with_shared_memory_ranks
+
+    try:
+        run_with_shared_memory_ranks(3, fail_on_one_rank)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "rank failure not reported"
+
+
+
+
+def test_shared_memory_flux_exchange():
+    """Run a distributed operator on shared-memory ranks"""
+    from hedge.backends.shm import run_with_shared_memory_ranks
+
+    for dtype in [numpy.float32, numpy.float64]:
+        run_with_shared_memory_ranks(2, check_flux_exchange, (dtype,))
+
+
+
+
 if __name__ == "__main__":
-    run_parallel_test(numpy.float32)
+    import os
+    if "HEDGE_PARALLEL_TEST" in os.environ:
+        test_name, dtype_name = os.environ["HEDGE_PARALLEL_TEST"].split(":")
+        assert test_name == "flux_exchange"
+        run_flux_exchange_test(numpy.dtype(dtype_name).type)
+    else:
+        run_parallel_test(numpy.float32)